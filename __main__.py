@@ -3,27 +3,45 @@
    Program entry point
 -------------------------------- */
 """
+import multiprocessing
 import os
 import sys
 
-from app import Application, MultipleSingletonsError
+# modules are placed flat beside this file, also on "python -m backup_breadcrumb"
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-
-try:
-	# execute on the directory has .exe
-	os.chdir(os.path.dirname(os.path.abspath(sys.argv[0])))
+# hashing processes of the scrubber import this module again, as __mp_main__
+if __name__ == "__main__":
+	multiprocessing.freeze_support()
 	
-	instance = Application()
-	instance.start()
+	if sys.argv[1:2] and (sys.argv[1] in ("aggregate", "browse", "export", "layout", "log", "show", "restore", "restore-tree", "stats", "verify") or sys.argv[1].startswith("--repository")):
+		# command line interface, neither Qt nor the singleton is needed
+		import cli
+		sys.exit(cli.main(sys.argv[1:], os.path.dirname(os.path.abspath(sys.argv[0]))))
 	
-	# process command line option
-	instance.process(sys.argv)
+	from singleton import MultipleSingletonsError
 	
-	# start resident process
-	sys.exit(instance.exec())
-
-except MultipleSingletonsError:
-	# launched as second more process
-	# so just post command line options to the first process
-	# and immediatly exit
-	sys.exit(-1)
+	try:
+		# execute on the directory has .exe
+		os.chdir(os.path.dirname(os.path.abspath(sys.argv[0])))
+		
+		if "--headless" in sys.argv[1:] or "--worker" in sys.argv[1:]:
+			# backup engine only, no Qt widgets are imported
+			from daemon import Daemon
+			instance = Daemon(sys.argv)
+		else:
+			from app import Application
+			instance = Application()
+		instance.start()
+		
+		# process command line option
+		instance.process(sys.argv)
+		
+		# start resident process
+		sys.exit(instance.exec())
+	
+	except MultipleSingletonsError:
+		# launched as second more process
+		# so just post command line options to the first process
+		# and immediatly exit
+		sys.exit(-1)
@@ -0,0 +1,344 @@
+"""
+/* --------------------------------
+   Aggregation server
+
+ - collects versions of many workstations into 1 store, each workstation pushes them with its own replicate.Replicator
+ - contents are kept once under their hashes for every client, so that content shared by the machines is uploaded once
+ - a batch offers its hashes first, then the wanted contents follow back to back on the same connection, and 1 commit answers them all
+ - messages are framed as protocol does, each content follows its header as raw bytes
+ - {"commands" : [{"command" : "stats"}]} tells the throughput of each client
+ - imports no Qt, so that it runs standalone from the command line
+-------------------------------- */
+"""
+import hashlib
+import logging
+import os
+import re
+import socket
+from socketserver import BaseRequestHandler, ThreadingTCPServer
+import threading
+import time
+
+from durability import Durability
+from index import VersionIndex
+import journal
+import protocol
+from replicate import ObjectReplica
+import transfer
+
+
+DEFAULT_PORT = 8338
+
+
+class AggregationServer:
+	"""
+	tcp server on its own threads, 1 thread per connection
+	"""
+	def __init__(self, root, address=protocol.DEFAULT_ADDRESS, port=DEFAULT_PORT, durability=None):
+		"""
+		objects are kept under root, and manifests and the cursor of each client under root/clients/NAME
+		"""
+		self.__root = root
+		self.__address = address
+		self.__port = port
+		self.__durability = durability or Durability(Durability.FILE)
+		self.__setup()
+	
+	@property
+	def metrics(self):
+		"""
+		counts of each client, bytes_per_second is the rate while contents were being received
+		"""
+		with self.__lock:
+			ret = {name : dict(counts) for name, counts in self.__counts.items()}
+		for counts in ret.values():
+			counts["bytes_per_second"] = counts["bytes"] / counts["seconds"] if counts["seconds"] else 0.0
+		return ret
+	
+	@property
+	def root(self):
+		return self.__root
+	
+	@property
+	def server_address(self):
+		return self.__server.server_address if self.__server is not None else (self.__address, self.__port)
+	
+	def count(self, name, **amounts):
+		with self.__lock:
+			counts = self.__counts.setdefault(name, {"sessions" : 0, "batches" : 0, "offered" : 0, "uploaded" : 0, "bytes" : 0, "seconds" : 0.0, "failures" : 0})
+			for key, amount in amounts.items():
+				counts[key] += amount
+	
+	def open_client(self, name):
+		"""
+		returns the replicate.ObjectReplica of a client, its objects are shared with the others
+		"""
+		if not AggregationServer.__NAME_PATTERN.match(name):
+			raise ValueError(f"invalid client name: {name}")
+		return ObjectReplica(os.path.join(self.__root, AggregationServer.__CLIENTS, name), self.__durability, self.__root)
+	
+	def serve_forever(self):
+		self.__server = self.__Server((self.__address, self.__port), self.__Handler, self)
+		logging.info("AGGREGATE: %s:%s", self.__address, self.__server.server_address[1])
+		self.__server.serve_forever()
+	
+	def start(self):
+		self.__server = self.__Server((self.__address, self.__port), self.__Handler, self)
+		logging.info("AGGREGATE: %s:%s", self.__address, self.__server.server_address[1])
+		self.__thread = threading.Thread(target=self.__server.serve_forever, name="AggregationServer", daemon=True)
+		self.__thread.start()
+	
+	def stop(self):
+		if self.__server is None:
+			return
+		
+		self.__server.shutdown()
+		self.__server.server_close()
+		self.__server = None
+	
+	class __Server(ThreadingTCPServer):
+		allow_reuse_address = True
+		daemon_threads = True
+		
+		def __init__(self, server_address, handler_class, aggregation):
+			self.aggregation = aggregation
+			super().__init__(server_address, handler_class)
+	
+	class __Handler(BaseRequestHandler):
+		def handle(self):
+			self.__name = None
+			self.__replica = None
+			self.__failures = []
+			while True:
+				try:
+					message = protocol.receive(self.request)
+					if message is None:
+						return
+					if not self.__dispatch(message):
+						return
+				except (OSError, ValueError, protocol.ProtocolError) as ex:
+					logging.error("ERROR: %s %s", self.client_address[0], ex)
+					if self.__name is not None:
+						self.server.aggregation.count(self.__name, failures=1)
+					return
+		
+		def __dispatch(self, message):
+			"""
+			answers 1 message, and returns False to close the connection
+			"""
+			aggregation = self.server.aggregation
+			if "commands" in message:
+				results = []
+				for command in message["commands"]:
+					if command.get("command") == "stats":
+						results.append({"clients" : aggregation.metrics})
+					else:
+						results.append({"error" : f"unknown command: {command.get('command')}"})
+				protocol.send(self.request, {"results" : results})
+				return True
+			
+			if "hello" in message:
+				self.__replica = aggregation.open_client(message["hello"])
+				self.__name = message["hello"]
+				aggregation.count(self.__name, sessions=1)
+				protocol.send(self.request, {"sequence" : self.__replica.load_cursor(message["source"])})
+				return True
+			
+			if self.__replica is None:
+				protocol.send(self.request, {"error" : "hello first"})
+				return False
+			
+			if "have" in message:
+				wanted = self.__replica.want(set(message["have"]))
+				aggregation.count(self.__name, offered=len(message["have"]))
+				protocol.send(self.request, {"want" : sorted(wanted)})
+				return True
+			
+			if "put" in message:
+				self.__receive(message["put"], message["size"])
+				return True
+			
+			if "commit" in message:
+				if self.__failures:
+					# nothing of the batch is recorded, so that the client sends it again
+					protocol.send(self.request, {"error" : f"{len(self.__failures)} contents failed: {self.__failures[0]}"})
+					self.__failures = []
+					return True
+				entries = [VersionIndex.Entry(**entry) for entry in message["commit"]]
+				self.__replica.commit(entries, message["sequence"])
+				self.__replica.save_cursor(message["source"], message["sequence"])
+				aggregation.count(self.__name, batches=1)
+				protocol.send(self.request, {"committed" : len(entries)})
+				return True
+			
+			protocol.send(self.request, {"error" : "unknown message"})
+			return False
+		
+		def __receive(self, hash, size):
+			"""
+			reads size bytes of content into its object, the bytes are read up even when they are not kept
+			"""
+			if not _HASH_PATTERN.match(hash):
+				raise ValueError(f"invalid hash: {hash}")
+			
+			started = time.perf_counter()
+			destination = self.__replica.object_path(hash)
+			# another client may be uploading the same content
+			temporary_file_path = f"{destination}.{threading.get_ident()}{journal.TEMPORARY_EXTENSION}"
+			digest = hashlib.sha256()
+			error = None
+			buffer = bytearray(transfer.CHUNK_SIZE)
+			view = memoryview(buffer)
+			file = None
+			try:
+				try:
+					os.makedirs(os.path.dirname(destination), exist_ok=True)
+					file = open(temporary_file_path, "wb")
+				except OSError as ex:
+					error = ex
+				
+				remaining = size
+				while remaining:
+					received = self.request.recv_into(buffer, min(remaining, len(buffer)))
+					if not received:
+						raise protocol.ProtocolError("connection closed in the middle of a content")
+					digest.update(view[:received])
+					if error is None:
+						try:
+							file.write(view[:received])
+						except OSError as ex:
+							error = ex
+					remaining -= received
+				
+				if file is not None:
+					file.close()
+					file = None
+				if error is None and digest.hexdigest() != hash:
+					error = ValueError(f"content does not match {hash}")
+				if error is None:
+					try:
+						self.__replica.durability.sync(temporary_file_path)
+						os.replace(temporary_file_path, destination)
+					except OSError as ex:
+						error = ex
+			finally:
+				if file is not None:
+					file.close()
+				if os.path.exists(temporary_file_path):
+					os.remove(temporary_file_path)
+			
+			if error is not None:
+				logging.error("ERROR: %s %s", self.__name, error)
+				self.__failures.append(str(error))
+				self.server.aggregation.count(self.__name, failures=1)
+				return
+			self.server.aggregation.count(self.__name, uploaded=1, bytes=size, seconds=time.perf_counter() - started)
+	
+	__CLIENTS = "clients"
+	
+	__NAME_PATTERN = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._-]*$")
+	
+	def __setup(self):
+		self.__lock = threading.Lock()
+		self.__counts = {}
+		self.__server = None
+		self.__thread = None
+
+
+class AggregateReplica:
+	"""
+	the aggregation server seen from a replicate.Replicator, over 1 persistent connection
+	"""
+	def __init__(self, address, port=DEFAULT_PORT, name=None, timeout=60.0):
+		"""
+		name tells the client apart on the server, the host name by default
+		"""
+		self.__address = address
+		self.__port = port
+		self.__name = name or socket.gethostname()
+		self.__timeout = timeout
+		self.__setup()
+	
+	def __str__(self):
+		return f"{self.__address}:{self.__port}"
+	
+	def close(self):
+		if self.__socket is not None:
+			self.__socket.close()
+			self.__socket = None
+	
+	def commit(self, entries, sequence):
+		response = self.__request({"commit" : [entry._asdict() for entry in entries], "sequence" : sequence, "source" : self.__source})
+		if "error" in response:
+			raise protocol.ProtocolError(response["error"])
+	
+	def load_cursor(self, source):
+		ret = self.__request({"hello" : self.__name, "source" : source})["sequence"]
+		self.__source = source
+		return ret
+	
+	def place(self, entry):
+		# contents are found by their hashes on the server
+		pass
+	
+	def put(self, entry, source_file_path, throttle=None):
+		"""
+		sends the content without waiting for an answer, failures are answered to the commit of the batch
+		"""
+		with open(source_file_path, "rb") as file:
+			size = os.fstat(file.fileno()).st_size
+			sock = self.__connect()
+			try:
+				protocol.send(sock, {"put" : entry.hash, "size" : size})
+				# versions are never modified, so that size bytes are sent as told
+				remaining = size
+				while remaining:
+					chunk = file.read(min(remaining, transfer.CHUNK_SIZE))
+					if not chunk:
+						raise OSError(f"truncated while sending: {source_file_path}")
+					if throttle is not None:
+						throttle.acquire_bytes(len(chunk))
+					sock.sendall(chunk)
+					remaining -= len(chunk)
+			except BaseException:
+				# the stream is broken in the middle of a content
+				self.close()
+				raise
+		return size
+	
+	def save_cursor(self, source, sequence):
+		# saved by the server with the commit
+		pass
+	
+	def want(self, hashes):
+		return set(self.__request({"have" : sorted(hashes)})["want"])
+	
+	def __connect(self):
+		if self.__socket is None:
+			self.__socket = socket.create_connection((self.__address, self.__port), self.__timeout)
+			if self.__source is not None:
+				# a new connection introduces itself again
+				protocol.send(self.__socket, {"hello" : self.__name, "source" : self.__source})
+				if protocol.receive(self.__socket) is None:
+					raise protocol.ProtocolError("connection closed")
+		return self.__socket
+	
+	def __request(self, message):
+		try:
+			sock = self.__connect()
+			protocol.send(sock, message)
+			ret = protocol.receive(sock)
+		except BaseException:
+			self.close()
+			raise
+		if ret is None:
+			self.close()
+			raise protocol.ProtocolError("connection closed")
+		return ret
+	
+	def __setup(self):
+		self.__socket = None
+		self.__source = None
+
+
+_HASH_PATTERN = re.compile(r"^[0-9a-f]{64}$")
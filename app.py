@@ -2,33 +2,28 @@
 /* --------------------------------
    Application main work
 
- - management of work.File objects
- - management of work.Work(target) objects
+ - own the backup engine.Engine, or a passive one with remote.WorkerProcess in split mode
  - own the Window as file browser
- - own the resident tasktray icon
+ - own the resident tasktray icon, which shows the lag of the backup once a second
  - own icon and theme resources
- - process command line option and trace it by second more launch
+ - process command line option and requests of protocol by second more launch or scripts
+ - forms, assets and qdarktheme are imported on the first "Show", the tray lives without them
 -------------------------------- */
 """
 
-from argparse import ArgumentParser
-import datetime
-import json
+from concurrent.futures import Future
 import logging
 import os
 import sys
 import winreg
 
-from PySide6.QtCore import QSettings, Signal
-from PySide6.QtGui import QIcon
+from PySide6.QtCore import QSettings, Qt, QTimer, Signal
+from PySide6.QtGui import QColor, QIcon, QPainter
 from PySide6.QtWidgets import QApplication, QMenu, QSystemTrayIcon
-import qdarktheme
 
-import assets
-import forms
-import path
+from engine import Engine
+import metrics
 from singleton import MultipleSingletonsError, Singleton
-import work
 
 
 class Application(QApplication):
@@ -36,120 +31,126 @@ class Application(QApplication):
 		super().__init__(*args, **kwargs)
 		self.__setup()
 	
+	# Engine.status once a second, on the event loop
+	statusChanged = Signal(dict)
+	
 	@property
 	def config(self):
 		return self.__config
 	
+	@property
+	def engine(self):
+		return self.__engine
+	
 	@property
 	def icon(self):
+		if self.__icon is None:
+			self.__setup_icon()
 		return self.__icon
 	
+	@property
+	def index(self):
+		return self.__engine.index
+	
 	@property
 	def log_file_path(self):
-		return self.__log_file_path
+		return self.__engine.log_file_path
 	
 	@log_file_path.setter
 	def log_file_path(self, value):
-		self.__log_file_path = value
+		self.__engine.log_file_path = value
 	
 	@property
 	def palette(self):
+		if self.__palette is None:
+			self.__setup_theme()
 		return self.__palette
 	
 	@property
 	def repository_root(self):
-		return self.__repository_root
+		return self.__engine.repository_root
 	
 	@repository_root.setter
 	def repository_root(self, value):
-		self.__repository_root = value
+		self.__engine.repository_root = value
+	
+	@property
+	def status(self):
+		"""
+		Engine.status of the engine doing the backup, the one of the worker in split mode
+		"""
+		if self.__worker is not None:
+			return self.__worker_status
+		return self.__engine.status
 	
 	@property
 	def stylesheet(self):
+		if self.__stylesheet is None:
+			self.__setup_theme()
 		return self.__stylesheet
 	
 	@property
 	def targets_file_path(self):
-		return self.__targets_file_path
+		return self.__engine.targets_file_path
 	
 	@targets_file_path.setter
 	def targets_file_path(self, value):
-		self.__targets_file_path = value
+		self.__engine.targets_file_path = value
 	
 	@property
 	def window(self):
 		return self.__window
 	
+	@property
+	def worker(self):
+		return self.__worker
+	
 	def add_target(self):
-		ret = self.__create_target()
-		self.__targets.append(ret)
-		return ret
+		return self.__engine.add_target()
+	
+	def execute(self, request):
+		"""
+		returns the response to a request of protocol
+		"""
+		if "argv" in request:
+			# second more launch always wants the window
+			self.__show_window()
+			self.process(request["argv"])
+			return {"results" : []}
+		
+		results = []
+		for command in request.get("commands", []):
+			try:
+				results.append(self.__execute_command(command))
+			except Exception as ex:
+				results.append({"error" : str(ex)})
+		return {"results" : results}
 	
 	def find_target(self, root):
-		if root.endswith("..."):
-			root = root[:-3]
-		
-		for target in self.__targets:
-			if path.equals(target.root, root):
-				return target
-		
-		return None
+		return self.__engine.find_target(root)
 	
-	def get_targets(self):
-		for ret in self.__targets:
-			yield ret
-	
-	def inquiry(self, file_path):
-		ret = None
-		if os.path.isfile(file_path):
-			file_path = work.File.normalize(file_path)
-			if file_path in self.__files:
-				ret = self.__files[file_path]
-			else:
-				ret = work.File(file_path, self)
-				self.__files[file_path] = ret
-		
-		return ret
+	def find_versions(self, file_path):
+		return self.__engine.find_versions(file_path)
 	
-	def move_target(self, from_, to):
-		moved = self.__targets.pop(from_)
-		self.__targets.insert(to, moved)
+	def get_deleted_files(self, directory):
+		return self.__engine.get_deleted_files(directory)
 	
-	def on_created(self, event):
-		file_path = event.src_path
-		if self.__is_in_repository(file_path):
-			return
-		logging.info(f"{datetime.datetime.now()} CREATED: {file_path}")
-		file = self.inquiry(file_path)
-		file.store()
+	def get_targets(self):
+		return self.__engine.get_targets()
 	
-	def on_deleted(self, event):
-		file_path = event.src_path
-		if self.__is_in_repository(file_path):
-			return
-		logging.info(f"{datetime.datetime.now()} DELETED: {file_path}")
+	def inquiry(self, file_path, is_deleted=False):
+		return self.__engine.inquiry(file_path, is_deleted)
 	
-	def on_modified(self, event):
-		file_path = event.src_path
-		if self.__is_in_repository(file_path):
-			return
-		logging.info(f"{datetime.datetime.now()} MODIFIED: {file_path}")
-		file = self.inquiry(file_path)
-		file.store()
-	
-	def on_moved(self, event):
-		file_path = event.dest_path
-		if self.__is_in_repository(file_path):
-			return
-		logging.info(f"{datetime.datetime.now()} MOVED_TO: {file_path}")
-		file = self.inquiry(file_path)
-		file.store()
+	def move_target(self, from_, to):
+		self.__engine.move_target(from_, to)
 	
 	def process(self, argv):
-		self.__show_window()
+		if len(argv) > 1:
+			# target pages live on the window
+			self.__show_window()
 		
 		arguments = " ".join(argv)
-		logging.info(f"{datetime.datetime.now()} EXECUTE: {arguments}")
+		logging.info("EXECUTE: %s", arguments)
 		
 		if len(argv) > 1:
 			args = self.__parser.parse_args(argv[1:])
@@ -159,57 +160,50 @@ class Application(QApplication):
 				self.__process_add_targets(args.add_targets)
 	
 	def remove_target(self, target):
-		self.__targets.remove(target)
-		target.deactivate()
-		target.deleteLater()
+		self.__engine.remove_target(target)
 	
 	def restore(self, config=None):
 		config = self.__update_config(config)
 		if config is None:
 			return
 		
-		config.beginGroup("Application")
-		
-		repository_root = config.value("repository")
-		if repository_root:
-			self.__repository_root = repository_root
-		
-		targets_file_path = config.value("targets")
-		if targets_file_path:
-			self.__targets_file_path = targets_file_path
-		
-		log_file_path = config.value("log")
-		if log_file_path:
-			self.__log_file_path = log_file_path
-		
-		config.endGroup()
+		self.__engine.restore(config)
+	
+	def restore_file(self, file, timecode):
+		return self.__engine.restore_file(file, timecode)
 	
 	def revert(self, target, ):
-		self.__targets.remove(target)
-		target.deactivate()
+		self.__engine.revert(target)
 	
 	def start(self):
 		config = QSettings("config.ini", QSettings.IniFormat)
 		self.restore(config)
 		
-		if self.log_file_path:
-			logging.basicConfig(filename=self.log_file_path, encoding='utf-8', level=logging.INFO)
+		args, unknown = self.__parser.parse_known_args(sys.argv[1:])
+		is_split = args.split or str(config.value("Application/split", False)).lower() == "true"
+		self.__engine.is_passive = is_split
+		self.__engine.start()
+		if is_split:
+			from remote import WorkerProcess
+			
+			self.__worker = WorkerProcess(self.__engine, self)
+			self.__worker.statusReceived.connect(self.__on_worker_status)
+			self.__worker.start()
 		
-		self.__deserialize(self.targets_file_path)
-		
-		self.__tray_icon = self.__TrayIcon()
-		self.__tray_icon.setIcon(self.icon)
+		self.__tray_icon = self.__TrayIcon(self.icon)
 		self.__tray_icon.add_menu(self.tr("Show"), self.__show_window)
 		self.__tray_icon.add_menu(self.tr("Quit"), self.stop)
 		self.__tray_icon.setVisible(True)
 		self.__tray_icon.activated.connect(self.__on_icon_activated)
-		
-		self.__window = forms.create_window(self)
+		self.__status_timer.start()
+		self.__update_status()
 	
 	def stop(self):
-		self.__serialize(self.targets_file_path)
-		for target in self.__targets:
-			target.deactivate()
+		self.__status_timer.stop()
+		if self.__worker is not None:
+			self.__worker.stop()
+			self.__worker = None
+		self.__engine.stop()
 		
 		self.store()
 		
@@ -230,26 +224,12 @@ class Application(QApplication):
 		if config is None:
 			return
 		
-		config.beginGroup("Application")
-		config.setValue("repository", self.__repository_root)
-		config.setValue("targets", self.__targets_file_path)
-		config.setValue("log", self.__log_file_path)
-		config.endGroup()
-	
-	class __ArgumentParser(ArgumentParser):
-		def __init__(self, *args, **kwargs):
-			super().__init__(*args, **kwargs)
-			self.__setup()
-		
-		def __setup(self):
-			self.add_argument("-a", "--add", action="append", dest="add_targets", metavar="DIR_PATH",
-								help="add new backup target")
-			self.add_argument("-r", "--remove", action="append", dest="remove_targets", metavar="DIR_PATH",
-								help="remove backup target")
+		self.__engine.store(config)
 	
 	class __TrayIcon(QSystemTrayIcon):
-		def __init__(self, *args, **kwargs):
-			super().__init__(*args, **kwargs)
+		def __init__(self, icon, *args, **kwargs):
+			super().__init__(icon, *args, **kwargs)
+			self.__icon = icon
 			self.__setup()
 		
 		def add_menu(self, text, action):
@@ -257,48 +237,95 @@ class Application(QApplication):
 			ret.triggered.connect(action)
 			return ret
 		
+		def set_status(self, status):
+			"""
+			shows the state of Engine.status as a badge on the icon, and the lag on the tooltip
+			"""
+			state = status.get("state", Engine.IDLE)
+			if state != self.__state:
+				self.__state = state
+				self.setIcon(self.__badge(state))
+			self.setToolTip(self.__describe(status))
+		
+		# idle shows the icon as it is
+		__BADGE_COLORS = {Engine.BUSY : "#2d7ff9", Engine.BEHIND : "#e8453c"}
+		
+		__ICON_SIZE = 32
+		
+		def __badge(self, state):
+			color = self.__BADGE_COLORS.get(state)
+			if color is None:
+				return self.__icon
+			
+			if state not in self.__icons:
+				pixmap = self.__icon.pixmap(self.__ICON_SIZE, self.__ICON_SIZE)
+				diameter = pixmap.width() // 2
+				painter = QPainter(pixmap)
+				painter.setRenderHint(QPainter.Antialiasing)
+				painter.setPen(Qt.NoPen)
+				painter.setBrush(QColor(color))
+				painter.drawEllipse(pixmap.width() - diameter, pixmap.height() - diameter, diameter, diameter)
+				painter.end()
+				self.__icons[state] = QIcon(pixmap)
+			return self.__icons[state]
+		
+		def __describe(self, status):
+			state = status.get("state", Engine.IDLE)
+			if state == Engine.BEHIND:
+				ret = self.tr("Backup Breadcrumb: behind by {0}").format(metrics.format_seconds(status.get("oldest_pending_seconds", 0)))
+			elif state == Engine.BUSY:
+				ret = self.tr("Backup Breadcrumb: busy, {0} files queued").format(status.get("queued", 0))
+			else:
+				ret = self.tr("Backup Breadcrumb: up to date")
+			
+			retry_pending = status.get("retry_pending", 0)
+			if retry_pending:
+				ret += "\n" + self.tr("{0} files waiting for a retry").format(retry_pending)
+			return ret
+		
 		def __setup(self):
 			self.__menu = QMenu()
 			self.setContextMenu(self.__menu)
+			self.__state = Engine.IDLE
+			self.__icons = {}
 	
-	__dispatcher = Signal(list)
+	__dispatcher = Signal(object, object)
 	
-	__REG_PATH_THEMES_PERSONALIZE = r"Software\Microsoft\Windows\CurrentVersion\Themes\Personalize"
+	__ICON_FILE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets", "app.ico")
 	
-	def __create_target(self):
-		ret = work.Work(self)
-		ret.on_created_handler = self.on_created
-		ret.on_deleted_handler = self.on_deleted
-		ret.on_modified_handler = self.on_modified
-		ret.on_moved_handler = self.on_moved
-		return ret
+	__REQUEST_TIMEOUT = 300.0
 	
-	def __deserialize(self, file_path):
+	# milliseconds between refreshes of the tray icon and the window
+	__STATUS_INTERVAL = 1000
+	
+	__REG_PATH_THEMES_PERSONALIZE = r"Software\Microsoft\Windows\CurrentVersion\Themes\Personalize"
+	
+	def __execute_command(self, command):
+		# target pages live on the window once it has been built
+		name = command.get("command")
+		if self.window is not None and name == "add":
+			page = self.window.add_target_page(command["path"])
+			return {"target" : page.target.root if page else None}
+		if self.window is not None and name == "remove":
+			is_found = self.find_target(command["path"]) is not None
+			self.window.remove_target_pages(command["path"])
+			return {"removed" : is_found}
+		return self.__engine.execute(command)
+	
+	def __on_dispatched(self, request, future):
 		try:
-			with open(file_path, "r") as file:
-				data = json.load(file)
-				for desc, value in data.items():
-					target = self.__create_target()
-					target.deserialize(desc, value)
-					self.__targets.append(target)
+			future.set_result(self.execute(request))
 		except Exception as ex:
-			logging.error(f"{datetime.datetime.now()} ERROR: {ex}")
-	
-	def __is_in_repository(self, file_path):
-		repository_root = os.path.abspath(self.__repository_root)
-		repository_drive, repository_root = os.path.splitdrive(repository_root)
-		file_path = os.path.abspath(file_path)
-		file_drive, file_path = os.path.splitdrive(file_path)
-		
-		if file_drive.lower() != repository_drive.lower():
-			return False
-		
-		return not os.path.relpath(file_path, repository_root).startswith("..")
+			future.set_exception(ex)
 	
 	def __on_icon_activated(self, reason):
 		if reason == QSystemTrayIcon.DoubleClick:
 			self.__show_window()
 	
+	def __on_worker_status(self, record):
+		if record.get("event") == "status":
+			self.__worker_status = record
+	
 	def __process_add_targets(self, descs):
 		if self.window is None:
 			return
@@ -311,42 +338,39 @@ class Application(QApplication):
 			return
 		
 		for desc in descs:
-			self.window.remove_target_page(desc)
+			self.window.remove_target_pages(desc)
 	
-	def __receive(self, arguments):
-		self.__dispatcher.emit(arguments.split())
-	
-	def __serialize(self, file_path):
-		data = {}
-		for target in self.__targets:
-			root = target.root
-			if root:
-				data[root] = target.serialize()
-		
-		try:
-			with open(file_path, "w") as file:
-				json.dump(data, file, indent=2)
-		except Exception as ex:
-			logging.error(f"{datetime.datetime.now()} ERROR: {ex}")
+	def __receive(self, request):
+		# on a connection thread of the singleton, so that the request is executed on the event loop
+		future = Future()
+		self.__dispatcher.emit(request, future)
+		return future.result(self.__REQUEST_TIMEOUT)
 	
 	def __setup(self):
 		self.__singleton = Singleton()
 		self.__config = None
-		self.__repository_root = "repository"
-		self.__targets_file_path = "target.json"
-		self.__log_file_path = os.path.splitext(sys.argv[0])[0] + ".log"
+		self.__engine = Engine(self)
 		self.__window = None
-		self.__targets = []
-		self.__files = {}
-		self.__icon = QIcon(":assets/app.ico")
-		self.__parser = self.__ArgumentParser()
-		self.__setup_os_is_darkmode()
-		self.__stylesheet = qdarktheme.load_stylesheet("dark" if self.__os_is_darkmode else "light")
-		self.__palette = qdarktheme.load_palette("dark" if self.__os_is_darkmode else "light")
-		self.__dispatcher.connect(self.process)
-		self.__singleton.trace(self.__receive)
-		self.setStyleSheet(self.__stylesheet)
+		self.__worker = None
+		self.__worker_status = {"state" : Engine.IDLE}
+		self.__icon = None
+		self.__stylesheet = None
+		self.__palette = None
+		self.__parser = Engine.ArgumentParser()
+		self.__dispatcher.connect(self.__on_dispatched)
+		self.__singleton.handle(self.__receive)
 		self.setQuitOnLastWindowClosed(False)
+		
+		self.__status_timer = QTimer(self)
+		self.__status_timer.setInterval(self.__STATUS_INTERVAL)
+		self.__status_timer.timeout.connect(self.__update_status)
+	
+	def __setup_icon(self):
+		if os.path.isfile(self.__ICON_FILE_PATH):
+			self.__icon = QIcon(self.__ICON_FILE_PATH)
+		else:
+			import assets
+			self.__icon = QIcon(":assets/app.ico")
 	
 	def __setup_os_is_darkmode(self):
 		key = winreg.OpenKeyEx(winreg.HKEY_CURRENT_USER, self.__REG_PATH_THEMES_PERSONALIZE)
@@ -354,11 +378,30 @@ class Application(QApplication):
 		winreg.CloseKey(key)
 		self.__os_is_darkmode = value == 0
 	
+	def __setup_theme(self):
+		import qdarktheme
+		
+		self.__setup_os_is_darkmode()
+		self.__stylesheet = qdarktheme.load_stylesheet("dark" if self.__os_is_darkmode else "light")
+		self.__palette = qdarktheme.load_palette("dark" if self.__os_is_darkmode else "light")
+		self.setStyleSheet(self.__stylesheet)
+	
 	def __show_window(self):
-		if self.__window is not None:
-			self.__window.open()
+		if self.__window is None:
+			import forms
+			
+			if self.__stylesheet is None:
+				self.__setup_theme()
+			self.__window = forms.create_window(self)
+		
+		self.__window.open()
 	
 	def __update_config(self, config):
 		if config is not None:
 			self.__config = config
 		return self.__config
+	
+	def __update_status(self):
+		status = self.status
+		self.__tray_icon.set_status(status)
+		self.statusChanged.emit(status)
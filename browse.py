@@ -0,0 +1,254 @@
+"""
+/* --------------------------------
+   Browse server
+
+ - read-only http server of the version index, bound on loopback by default
+ - /tree/DIR_PATH/?at=TIME lists a directory as it was at a time, /history/PATH lists versions of a file
+ - /file/PATH?at=TIME or ?key=KEY serves the raw content of a version with Range, ETag and sendfile
+ - imports no Qt, so that it runs embedded in the engine or standalone from the command line
+-------------------------------- */
+"""
+import datetime
+import html
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import logging
+import mimetypes
+import os
+import re
+import threading
+from urllib.parse import parse_qs, quote, unquote, urlsplit
+
+import path
+from snapshot import FORMAT_TIMECODE, parse_time
+import transfer
+
+
+DEFAULT_ADDRESS = "127.0.0.1"
+DEFAULT_PORT = 8337
+
+
+class BrowseServer:
+	"""
+	http server on its own threads
+	"""
+	def __init__(self, index, address=DEFAULT_ADDRESS, port=DEFAULT_PORT):
+		"""
+		index is the index.VersionIndex shared with the engine, content hashes are cached on it
+		"""
+		self.__index = index
+		self.__address = address
+		self.__port = port
+		self.__setup()
+	
+	@property
+	def index(self):
+		return self.__index
+	
+	@property
+	def server_address(self):
+		return self.__server.server_address if self.__server is not None else (self.__address, self.__port)
+	
+	def serve_forever(self):
+		self.__server = self.__Server((self.__address, self.__port), self.__Handler, self)
+		logging.info("BROWSE: http://%s:%s/", self.__address, self.__server.server_address[1])
+		self.__server.serve_forever()
+	
+	def start(self):
+		self.__server = self.__Server((self.__address, self.__port), self.__Handler, self)
+		logging.info("BROWSE: http://%s:%s/", self.__address, self.__server.server_address[1])
+		self.__thread = threading.Thread(target=self.__server.serve_forever, name="BrowseServer", daemon=True)
+		self.__thread.start()
+	
+	def stop(self):
+		if self.__server is None:
+			return
+		
+		self.__server.shutdown()
+		self.__server.server_close()
+		self.__server = None
+	
+	class __Server(ThreadingHTTPServer):
+		daemon_threads = True
+		
+		def __init__(self, server_address, handler_class, browse):
+			self.browse = browse
+			super().__init__(server_address, handler_class)
+	
+	class __Handler(BaseHTTPRequestHandler):
+		server_version = "BackupBreadcrumb"
+		
+		def do_GET(self):
+			self.__handle(True)
+		
+		def do_HEAD(self):
+			self.__handle(False)
+		
+		def log_message(self, format, *args):
+			logging.debug("BROWSE: " + format, *args)
+		
+		__RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+		
+		def __ensure_hash(self, version):
+			if version.hash:
+				return version.hash
+			
+			# hashed once on the first request, and cached on the index
+			ret = transfer.hash_file(self.__repository_file_path(version), drops_cache=False)
+			self.server.browse.index.set_hash(version.path, version.key, ret)
+			return ret
+		
+		def __handle(self, has_body):
+			url = urlsplit(self.path)
+			query = {key : values[-1] for key, values in parse_qs(url.query).items()}
+			try:
+				time = parse_time(query["at"]) if "at" in query else datetime.datetime.now()
+			except ValueError:
+				self.send_error(HTTPStatus.BAD_REQUEST, "invalid time")
+				return
+			
+			route, _, file_path = url.path.lstrip("/").partition("/")
+			file_path = unquote(file_path)
+			try:
+				if route == "" or route == "tree":
+					self.__send_tree(file_path, time, has_body)
+				elif route == "history":
+					self.__send_history(file_path, has_body)
+				elif route == "file":
+					self.__send_file(file_path, time, query.get("key"), has_body)
+				else:
+					self.send_error(HTTPStatus.NOT_FOUND)
+			except (BrokenPipeError, ConnectionResetError):
+				pass
+		
+		@staticmethod
+		def __link(route, file_path, **query):
+			ret = f"/{route}/{quote(file_path)}"
+			if query:
+				ret += "?" + "&".join(f"{key}={quote(str(value))}" for key, value in query.items())
+			return html.escape(ret)
+		
+		def __repository_file_path(self, version):
+			return self.server.browse.index.repository_file_path(version)
+		
+		def __send_file(self, file_path, time, key, has_body):
+			index = self.server.browse.index
+			if key is None:
+				version = index.find_version_at(file_path, time.strftime(FORMAT_TIMECODE))
+			else:
+				version = next((version for version in index.find_versions(file_path) if version.key == key), None)
+			if version is None:
+				self.send_error(HTTPStatus.NOT_FOUND)
+				return
+			
+			try:
+				file = open(self.__repository_file_path(version), "rb")
+			except OSError:
+				self.send_error(HTTPStatus.NOT_FOUND)
+				return
+			
+			with file:
+				size = os.fstat(file.fileno()).st_size
+				etag = f"\"{self.__ensure_hash(version)}\""
+				if etag in [tag.strip() for tag in self.headers.get("If-None-Match", "").split(",")]:
+					self.send_response(HTTPStatus.NOT_MODIFIED)
+					self.send_header("ETag", etag)
+					self.end_headers()
+					return
+				
+				start, end = 0, size - 1
+				status = HTTPStatus.OK
+				requested_range = self.headers.get("Range")
+				if requested_range and self.headers.get("If-Range", etag) == etag:
+					m = self.__RANGE.match(requested_range.strip())
+					if m is None or m.group(1) == m.group(2) == "":
+						# multiple ranges are not supported, so that the whole content is sent
+						m = None
+					if m is not None:
+						if m.group(1) == "":
+							start = max(size - int(m.group(2)), 0)
+						else:
+							start = int(m.group(1))
+							if m.group(2) != "":
+								end = min(int(m.group(2)), size - 1)
+						if start >= size or start > end:
+							self.send_response(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+							self.send_header("Content-Range", f"bytes */{size}")
+							self.end_headers()
+							return
+						status = HTTPStatus.PARTIAL_CONTENT
+				
+				length = max(end - start + 1, 0)
+				content_type = mimetypes.guess_type(file_path)[0] or "application/octet-stream"
+				self.send_response(status)
+				self.send_header("Content-Type", content_type)
+				self.send_header("Content-Length", str(length))
+				self.send_header("Accept-Ranges", "bytes")
+				self.send_header("ETag", etag)
+				if version.mtime is not None:
+					self.send_header("Last-Modified", self.date_time_string(version.mtime))
+				if status == HTTPStatus.PARTIAL_CONTENT:
+					self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+				self.end_headers()
+				
+				if has_body and length:
+					# zero-copy where os.sendfile is available
+					self.wfile.flush()
+					self.connection.sendfile(file, start, length)
+		
+		def __send_history(self, file_path, has_body):
+			versions = self.server.browse.index.find_versions(file_path)
+			if not versions:
+				self.send_error(HTTPStatus.NOT_FOUND)
+				return
+			
+			rows = []
+			for version in reversed(versions):
+				timestamp = version.timestamp.strftime("%Y/%m/%d %H:%M")
+				mark = " (reversion)" if version.is_reversion else ""
+				rows.append(f"<li><a href=\"{self.__link('file', file_path, key=version.key)}\">{timestamp}</a> {version.size} bytes{mark}</li>")
+			self.__send_html(f"History of {file_path}", "\n".join(rows), has_body)
+		
+		def __send_html(self, title, body, has_body):
+			content = (f"<!DOCTYPE html>\n<html><head><meta charset=\"utf-8\"><title>{html.escape(title)}</title></head>"
+						f"<body><h1>{html.escape(title)}</h1><ul>\n{body}\n</ul></body></html>\n").encode()
+			self.send_response(HTTPStatus.OK)
+			self.send_header("Content-Type", "text/html; charset=utf-8")
+			self.send_header("Content-Length", str(len(content)))
+			self.end_headers()
+			if has_body:
+				self.wfile.write(content)
+		
+		def __send_tree(self, directory, time, has_body):
+			index = self.server.browse.index
+			timecode = time.strftime(FORMAT_TIMECODE)
+			files, directories = index.find_children(directory)
+			if directory:
+				directory = path.normalize_dir_expression(directory)
+			deleted = {tombstone.path : tombstone.deleted for tombstone in index.find_deleted_files(directory)} if directory else {}
+			at = time.strftime("%Y-%m-%dT%H:%M")
+			
+			rows = []
+			if directory:
+				parent = path.rsplitpath(directory)[0] if path.rsplitpath(directory)[0] != directory else ""
+				rows.append(f"<li><a href=\"{self.__link('tree', parent, at=at)}\">..</a></li>")
+			for name in directories:
+				# the root of posix is named "/" itself, as drives are named with their letters
+				name = path.normalize_dir_expression(name)
+				rows.append(f"<li><a href=\"{self.__link('tree', directory + name, at=at)}\">{html.escape(name)}</a></li>")
+			for file_path in files:
+				if deleted.get(file_path, time.timestamp() + 1) <= time.timestamp():
+					continue
+				version = index.find_version_at(file_path, timecode)
+				if version is None:
+					continue
+				name = html.escape(path.rsplitpath(file_path)[1])
+				timestamp = version.timestamp.strftime("%Y/%m/%d %H:%M")
+				rows.append(f"<li><a href=\"{self.__link('file', file_path, at=at)}\">{name}</a> {timestamp} {version.size} bytes"
+							f" <a href=\"{self.__link('history', file_path)}\">history</a></li>")
+			self.__send_html(f"{directory or '/'} at {time.strftime('%Y/%m/%d %H:%M')}", "\n".join(rows), has_body)
+	
+	def __setup(self):
+		self.__server = None
+		self.__thread = None
+
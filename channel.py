@@ -0,0 +1,128 @@
+"""
+/* --------------------------------
+   Status channel
+
+ - single writer ring buffer of status records on shared memory
+ - the engine worker process writes, the GUI process polls without any lock between processes
+ - a reader that falls behind more than the ring loses the oldest records, and counts them
+-------------------------------- */
+"""
+import json
+from multiprocessing import shared_memory
+import os
+import struct
+import threading
+import time
+
+
+class StatusChannel:
+	"""
+	ring buffer of json records, created by the reader and attached by the writer
+	"""
+	def __init__(self, name=None, slot_count=256, slot_size=1024):
+		"""
+		creates a new channel when name is None, otherwise attaches the existing one
+		"""
+		self.__setup(name, slot_count, slot_size)
+	
+	@property
+	def heartbeat(self):
+		"""
+		time.time() of the last beat of the writer, 0 before the first one
+		"""
+		return self.__HEADER.unpack_from(self.__memory.buf, 0)[3]
+	
+	@property
+	def lost(self):
+		return self.__lost
+	
+	@property
+	def name(self):
+		return self.__memory.name
+	
+	@property
+	def pending(self):
+		return self.__HEADER.unpack_from(self.__memory.buf, 0)[4]
+	
+	def beat(self, pending=0):
+		with self.__lock:
+			struct.pack_into("<dQ", self.__memory.buf, self.__HEADER_BEAT_OFFSET, time.time(), pending)
+	
+	def close(self):
+		if self.__memory is None:
+			return
+		
+		self.__memory.close()
+		if self.__is_owner:
+			self.__memory.unlink()
+		self.__memory = None
+	
+	def read(self):
+		"""
+		returns the records written since the last read
+		"""
+		ret = []
+		buffer = self.__memory.buf
+		sequence = self.__HEADER.unpack_from(buffer, 0)[2]
+		start = max(self.__cursor, sequence - self.__slot_count)
+		self.__lost += start - self.__cursor
+		for number in range(start, sequence):
+			offset = self.__slot_offset(number)
+			slot_sequence, length = self.__SLOT_HEADER.unpack_from(buffer, offset)
+			if slot_sequence != number + 1:
+				self.__lost += 1
+				continue
+			payload = bytes(buffer[offset + self.__SLOT_HEADER.size:offset + self.__SLOT_HEADER.size + length])
+			
+			# the writer may have lapped the slot while copying
+			if self.__SLOT_HEADER.unpack_from(buffer, offset)[0] != number + 1:
+				self.__lost += 1
+				continue
+			ret.append(json.loads(payload))
+		
+		self.__cursor = sequence
+		return ret
+	
+	def write(self, record):
+		payload = json.dumps(record).encode()
+		if len(payload) > self.__slot_size - self.__SLOT_HEADER.size:
+			# too long path, readers take it as "something has changed"
+			payload = json.dumps(dict(record, path=None)).encode()
+		
+		with self.__lock:
+			buffer = self.__memory.buf
+			number = self.__HEADER.unpack_from(buffer, 0)[2]
+			offset = self.__slot_offset(number)
+			self.__SLOT_HEADER.pack_into(buffer, offset, 0, len(payload))
+			buffer[offset + self.__SLOT_HEADER.size:offset + self.__SLOT_HEADER.size + len(payload)] = payload
+			self.__SLOT_HEADER.pack_into(buffer, offset, number + 1, len(payload))
+			struct.pack_into("<Q", buffer, self.__HEADER_SEQUENCE_OFFSET, number + 1)
+	
+	# slot_count, slot_size, sequence, heartbeat, pending
+	__HEADER = struct.Struct("<IIQdQ")
+	__HEADER_SEQUENCE_OFFSET = 8
+	__HEADER_BEAT_OFFSET = 16
+	
+	# sequence + 1 of the record, 0 while writing, and payload length
+	__SLOT_HEADER = struct.Struct("<QI")
+	
+	def __setup(self, name, slot_count, slot_size):
+		self.__lock = threading.Lock()
+		self.__is_owner = name is None
+		self.__lost = 0
+		if self.__is_owner:
+			self.__memory = shared_memory.SharedMemory(create=True, size=self.__HEADER.size + slot_count * slot_size)
+			self.__HEADER.pack_into(self.__memory.buf, 0, slot_count, slot_size, 0, 0.0, 0)
+		else:
+			self.__memory = shared_memory.SharedMemory(name)
+			if os.name == "posix":
+				# the creator unlinks it, not the resource tracker of this process
+				from multiprocessing import resource_tracker
+				resource_tracker.unregister(self.__memory._name, "shared_memory")
+			slot_count, slot_size = self.__HEADER.unpack_from(self.__memory.buf, 0)[:2]
+		self.__slot_count = slot_count
+		self.__slot_size = slot_size
+		self.__cursor = self.__HEADER.unpack_from(self.__memory.buf, 0)[2]
+	
+	def __slot_offset(self, number):
+		return self.__HEADER.size + (number % self.__slot_count) * self.__slot_size
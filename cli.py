@@ -0,0 +1,377 @@
+"""
+/* --------------------------------
+   Command line interface
+
+ - lists, shows and restores versions straight from the version index, without the GUI
+ - imports no Qt, so that it answers in a moment even on a repository with millions of versions
+ - "python -m backup_breadcrumb aggregate|browse|log|show|restore|restore-tree|export|layout|stats|verify ..."
+-------------------------------- */
+"""
+from argparse import ArgumentParser
+import configparser
+import os
+import shutil
+import sqlite3
+import sys
+
+import aggregate
+from browse import BrowseServer, DEFAULT_ADDRESS, DEFAULT_PORT
+from export import Exporter, FORMATS
+from index import VersionIndex
+from layout import Layout, Migration
+import path
+import protocol
+from scrub import Scrubber
+from snapshot import Snapshot, TreeRestore, parse_time
+import transfer
+
+
+class Cli:
+	"""
+	1 run of the command line
+	"""
+	class ArgumentParser(ArgumentParser):
+		def __init__(self, *args, **kwargs):
+			super().__init__(*args, **kwargs)
+			self.__setup()
+		
+		def __setup(self):
+			self.prog = "backup_breadcrumb"
+			self.add_argument("--repository", metavar="DIR_PATH",
+								help="repository root, taken from config.ini by default")
+			commands = self.add_subparsers(dest="command", required=True, parser_class=ArgumentParser)
+			
+			parser = commands.add_parser("aggregate", help="collect versions pushed by other machines until interrupted")
+			parser.add_argument("root", metavar="DIR_PATH",
+								help="directory the contents and manifests of every machine are kept in")
+			parser.add_argument("--address", default="0.0.0.0",
+								help="address to listen on, every interface by default")
+			parser.add_argument("--port", type=int, default=aggregate.DEFAULT_PORT,
+								help=f"port to listen on, {aggregate.DEFAULT_PORT} by default")
+			
+			parser = commands.add_parser("browse", help="serve versions over http until interrupted")
+			parser.add_argument("--address", default=DEFAULT_ADDRESS,
+								help=f"address to listen on, {DEFAULT_ADDRESS} by default")
+			parser.add_argument("--port", type=int, default=DEFAULT_PORT,
+								help=f"port to listen on, {DEFAULT_PORT} by default")
+			
+			parser = commands.add_parser("export", help="write an archive of a directory as it was at a time")
+			parser.add_argument("directory", metavar="DIR_PATH")
+			parser.add_argument("time",
+								help="timecode listed by log, or ISO 8601 time like \"2024-05-01 14:00\"")
+			parser.add_argument("-o", "--output", default="-", metavar="FILE_PATH",
+								help="archive file, \"-\" means stdout")
+			parser.add_argument("-f", "--format", choices=FORMATS, default=None,
+								help="archive format, guessed from the output extension by default")
+			
+			parser = commands.add_parser("layout", help="print the repository layout, or convert the repository to another one")
+			parser.add_argument("name", nargs="?", choices=Layout.NAMES,
+								help="layout to convert to, while no backup process is running")
+			
+			parser = commands.add_parser("log", help="list versions of files, newest first")
+			parser.add_argument("patterns", nargs="+", metavar="PATH",
+								help="file path, or glob pattern like \"C:/work/*.txt\"")
+			parser.add_argument("-n", "--max-count", type=int, default=0, metavar="COUNT",
+								help="list only the latest COUNT versions of each file")
+			
+			parser = commands.add_parser("show", help="write the content of a version to stdout")
+			parser.add_argument("file_path", metavar="PATH")
+			parser.add_argument("timecode", nargs="?",
+								help="timecode listed by log, the latest version by default")
+			
+			parser = commands.add_parser("restore", help="restore a version")
+			parser.add_argument("file_path", metavar="PATH")
+			parser.add_argument("timecode",
+								help="timecode listed by log")
+			parser.add_argument("--to", metavar="FILE_PATH",
+								help="write the version to FILE_PATH instead of the original path")
+			
+			parser = commands.add_parser("restore-tree", help="restore every file under a directory as it was at a time")
+			parser.add_argument("directory", metavar="DIR_PATH")
+			parser.add_argument("time",
+								help="timecode listed by log, or ISO 8601 time like \"2024-05-01 14:00\"")
+			parser.add_argument("--dry-run", action="store_true",
+								help="only print the plan")
+			parser.add_argument("-j", "--jobs", type=int, default=None, metavar="COUNT",
+								help="count of files restored in parallel")
+			
+			commands.add_parser("stats", help="counts of files and versions in the repository")
+			
+			parser = commands.add_parser("verify", help="check every version against its content hash")
+			parser.add_argument("directory", nargs="?", metavar="DIR_PATH",
+								help="check only versions of files under DIR_PATH")
+			parser.add_argument("-j", "--jobs", type=int, default=None, metavar="COUNT",
+								help="count of hashing processes, all cores by default")
+			parser.add_argument("--bytes-per-second", type=int, default=0, metavar="BYTES",
+								help="limit of reads, unlimited by default")
+	
+	def __init__(self, base_directory):
+		"""
+		base_directory has config.ini, and relative repository root is resolved from it
+		"""
+		self.__base_directory = base_directory
+		self.__setup()
+	
+	def run(self, argv):
+		args = self.ArgumentParser().parse_args(argv)
+		if args.command == "aggregate":
+			# serves a store of its own, no repository is opened
+			return self.__aggregate(args)
+		
+		repository_root = args.repository or self.__find_repository_root()
+		try:
+			# browse and verify record content hashes on the index, layout moves versions
+			self.__index = VersionIndex(repository_root, read_only=args.command not in ("browse", "layout", "verify"))
+		except sqlite3.Error as ex:
+			print(f"no version index in {repository_root}: {ex}", file=sys.stderr)
+			return 1
+		
+		self.__repository_root = repository_root
+		try:
+			commands = {
+				"browse" :			self.__browse,
+				"export" :			self.__export,
+				"layout" :			self.__layout,
+				"log" :				self.__log,
+				"show" :			self.__show,
+				"restore" :			self.__restore,
+				"restore-tree" :	self.__restore_tree,
+				"stats" :			self.__stats,
+				"verify" :			self.__verify,
+			}
+			return commands[args.command](args)
+		except BrokenPipeError:
+			# the reader has gone, e.g. "| head"
+			sys.stderr.close()
+			return 0
+		finally:
+			self.__index.close()
+	
+	__ARCHIVE_EXTENSIONS = ((".tar.gz", "tgz"), (".tgz", "tgz"), (".zip", "zip"))
+	
+	__CONFIG_FILE_NAME = "config.ini"
+	
+	__DEFAULT_REPOSITORY_ROOT = "repository"
+	
+	__FORMAT_TIMESTAMP = "%Y/%m/%d %H:%M"
+	
+	__REQUEST_TIMEOUT = 300.0
+	
+	def __aggregate(self, args):
+		server = aggregate.AggregationServer(args.root, args.address, args.port)
+		print(f"collecting into {args.root} on {args.address}:{args.port}", file=sys.stderr)
+		try:
+			server.serve_forever()
+		except KeyboardInterrupt:
+			pass
+		return 0
+	
+	def __browse(self, args):
+		server = BrowseServer(self.__index, args.address, args.port)
+		print(f"serving on http://{args.address}:{args.port}/", file=sys.stderr)
+		try:
+			server.serve_forever()
+		except KeyboardInterrupt:
+			pass
+		return 0
+	
+	def __export(self, args):
+		format = args.format
+		if format is None:
+			format = "tar"
+			for extension, value in Cli.__ARCHIVE_EXTENSIONS:
+				if args.output.lower().endswith(extension):
+					format = value
+					break
+		
+		snapshot = Snapshot(self.__index, Cli.__normalize(args.directory), parse_time(args.time))
+		exporter = Exporter(format)
+		if args.output == "-":
+			exporter.export(snapshot, sys.stdout.buffer)
+			sys.stdout.buffer.flush()
+		else:
+			with open(args.output, "wb") as file:
+				exporter.export(snapshot, file)
+		print(f"{exporter.files} files, {exporter.bytes} bytes", file=sys.stderr)
+		return 0
+	
+	def __find_repository_root(self):
+		ret = Cli.__DEFAULT_REPOSITORY_ROOT
+		config = configparser.ConfigParser(interpolation=None, strict=False)
+		try:
+			config.read(os.path.join(self.__base_directory, Cli.__CONFIG_FILE_NAME), encoding="utf-8")
+			value = config.get("Application", "repository", fallback="")
+		except configparser.Error:
+			value = ""
+		
+		# QSettings quotes and escapes values on its own way
+		value = value.strip()
+		if len(value) >= 2 and value[0] == value[-1] == "\"":
+			value = value[1:-1]
+		value = value.replace("\\\\", "\\")
+		if value:
+			ret = value
+		return os.path.join(self.__base_directory, ret)
+	
+	def __find_version(self, file_path, timecode):
+		versions = [version for version in self.__index.find_versions(file_path) if not version.is_reversion]
+		if not versions:
+			return None
+		if timecode is None:
+			return versions[-1]
+		for version in versions:
+			if version.timecode == timecode:
+				return version
+		return None
+	
+	def __layout(self, args):
+		layout = Layout.load(self.__repository_root)
+		if args.name is None:
+			if layout.migrating_to is None:
+				print(layout.name)
+			else:
+				print(f"{layout.name} (migrating to {layout.migrating_to})")
+			return 0
+		
+		try:
+			protocol.request({"command" : "stats"})
+			print("stop the running backup process first, versions may not be stored while they are moved", file=sys.stderr)
+			return 1
+		except ConnectionRefusedError:
+			pass
+		
+		migration = Migration(self.__repository_root, self.__index, args.name)
+		try:
+			failures = migration.run(lambda moved: print(f"{moved} versions moved", file=sys.stderr))
+		except ValueError as ex:
+			print(ex, file=sys.stderr)
+			return 1
+		if failures:
+			print(f"{failures} versions failed, run the same command again to resume", file=sys.stderr)
+		return 1 if failures else 0
+	
+	def __log(self, args):
+		write = sys.stdout.write
+		for pattern in args.patterns:
+			pattern = Cli.__normalize(pattern)
+			current_path = None
+			versions = []
+			for version in self.__index.find_versions_matching(pattern):
+				if version.path != current_path:
+					self.__write_versions(write, versions, args.max_count)
+					current_path = version.path
+					versions = []
+				versions.append(version)
+			self.__write_versions(write, versions, args.max_count)
+		sys.stdout.flush()
+		return 0
+	
+	@staticmethod
+	def __normalize(file_path):
+		return path.normalize(os.path.abspath(file_path))
+	
+	def __repository_file_path(self, version):
+		return self.__index.repository_file_path(version)
+	
+	def __restore(self, args):
+		file_path = Cli.__normalize(args.file_path)
+		version = self.__find_version(file_path, args.timecode)
+		if version is None:
+			print(f"no such version: {args.file_path} {args.timecode}", file=sys.stderr)
+			return 1
+		
+		if args.to is None:
+			# the running process keeps the reversion bookkeeping
+			try:
+				result = protocol.request({"command" : "restore", "path" : os.path.abspath(args.file_path), "timecode" : version.timecode}, timeout=Cli.__REQUEST_TIMEOUT)
+				if "error" in result:
+					print(result["error"], file=sys.stderr)
+					return 1
+				return 0
+			except ConnectionRefusedError:
+				pass
+		
+		destination = args.to or os.path.abspath(args.file_path)
+		os.makedirs(os.path.dirname(os.path.abspath(destination)), exist_ok=True)
+		transfer.copy(self.__repository_file_path(version), destination, drops_source_cache=True)
+		return 0
+	
+	def __restore_tree(self, args):
+		snapshot = Snapshot(self.__index, Cli.__normalize(args.directory), parse_time(args.time))
+		restore = TreeRestore(snapshot, self.__repository_root, args.jobs)
+		if args.dry_run:
+			for step in restore.plan():
+				print(f"{step.action:<8}{step.item.version.timecode}  {step.item.path}")
+			return 0
+		
+		restored = []
+		def progress(step, error, done, total):
+			if error is None:
+				restored.append(step.item.path)
+				print(f"[{done}/{total}] restored {step.item.path}", file=sys.stderr)
+			else:
+				print(f"[{done}/{total}] FAILED {step.item.path}: {error}", file=sys.stderr)
+		
+		failures = restore.run(progress)
+		if failures:
+			print(f"{failures} files failed, run the same command again to resume", file=sys.stderr)
+		
+		# versions held by the running process are stale now
+		if restored:
+			try:
+				protocol.request([{"command" : "expire", "path" : file_path} for file_path in restored], timeout=Cli.__REQUEST_TIMEOUT)
+			except ConnectionRefusedError:
+				pass
+		return 1 if failures else 0
+	
+	def __setup(self):
+		self.__index = None
+		self.__repository_root = None
+	
+	def __show(self, args):
+		version = self.__find_version(Cli.__normalize(args.file_path), args.timecode)
+		if version is None:
+			print(f"no such version: {args.file_path} {args.timecode or ''}", file=sys.stderr)
+			return 1
+		
+		with open(self.__repository_file_path(version), "rb") as file:
+			shutil.copyfileobj(file, sys.stdout.buffer, transfer.CHUNK_SIZE)
+		sys.stdout.buffer.flush()
+		return 0
+	
+	def __stats(self, args):
+		statistics = self.__index.statistics()
+		for key, value in statistics.items():
+			print(f"{key:<16}{value}")
+		return 0
+	
+	def __verify(self, args):
+		if args.directory is None:
+			versions = self.__index.find_versions_matching("*")
+		else:
+			versions = self.__index.find_versions_under(Cli.__normalize(args.directory))
+		throttle = transfer.Throttle(args.bytes_per_second) if args.bytes_per_second else None
+		scrubber = Scrubber(self.__index, args.jobs, throttle)
+		
+		def progress(result):
+			if result.status not in (Scrubber.OK, Scrubber.RECORDED):
+				print(f"{result.status:<12}{result.version.timecode}  {result.version.path}")
+		
+		problems = scrubber.verify(versions, progress)
+		counts = ", ".join(f"{count} {status}" for status, count in scrubber.metrics.items())
+		print(counts, file=sys.stderr)
+		return 1 if problems else 0
+	
+	@staticmethod
+	def __write_versions(write, versions, max_count):
+		if max_count:
+			versions = versions[-max_count:]
+		for version in reversed(versions):
+			timestamp = version.timestamp.strftime(Cli.__FORMAT_TIMESTAMP)
+			mark = "R" if version.is_reversion else " "
+			size = version.size if version.size is not None else "-"
+			write(f"{version.timecode}  {mark}  {timestamp}  {size:>12}  {version.path}\n")
+
+
+def main(argv, base_directory):
+	return Cli(base_directory).run(argv)
@@ -0,0 +1,160 @@
+"""
+/* --------------------------------
+   Headless daemon
+
+ - runs engine.Engine targets and the store pipeline without QApplication
+ - imports no Qt widgets, so that it works on servers without any display
+ - process command line option and requests of protocol by second more launch or scripts like the GUI build
+ - with --worker, serves a GUI process in split mode instead of the singleton, see remote.WorkerProcess
+-------------------------------- */
+"""
+from concurrent.futures import Future
+import logging
+import signal
+import time
+
+from PySide6.QtCore import QCoreApplication, QSettings, QTimer, Signal
+
+from channel import StatusChannel
+from engine import Engine
+from remote import CommandReceiver
+from singleton import MultipleSingletonsError, Singleton
+
+
+class Daemon(QCoreApplication):
+	def __init__(self, *args, **kwargs):
+		super().__init__(*args, **kwargs)
+		self.__setup()
+	
+	@property
+	def config(self):
+		return self.__config
+	
+	@property
+	def engine(self):
+		return self.__engine
+	
+	def execute(self, request):
+		"""
+		returns the response to a request of protocol
+		"""
+		if "argv" in request:
+			self.process(request["argv"])
+			return {"results" : []}
+		
+		results = []
+		for command in request.get("commands", []):
+			try:
+				results.append(self.__engine.execute(command))
+			except Exception as ex:
+				results.append({"error" : str(ex)})
+		return {"results" : results}
+	
+	def process(self, argv):
+		arguments = " ".join(argv)
+		logging.info("EXECUTE: %s", arguments)
+		
+		if len(argv) > 1:
+			args = self.__parser.parse_args(argv[1:])
+			if args.remove_targets:
+				for desc in args.remove_targets:
+					self.__engine.close_target(desc)
+			if args.add_targets:
+				for desc in args.add_targets:
+					self.__engine.open_target(desc)
+	
+	def start(self):
+		self.__config = QSettings("config.ini", QSettings.IniFormat)
+		self.__engine.restore(self.__config)
+		self.__engine.start()
+		
+		if self.__receiver is not None:
+			self.__receiver.start()
+			self.__beat_timer = QTimer(self)
+			self.__beat_timer.timeout.connect(self.__beat)
+			self.__beat_timer.start(1000)
+			self.__beat()
+		
+		# lets python signal handlers run while the event loop is waiting
+		self.__signal_timer = QTimer(self)
+		self.__signal_timer.timeout.connect(lambda: None)
+		self.__signal_timer.start(500)
+		signal.signal(signal.SIGINT, self.__on_signal)
+		signal.signal(signal.SIGTERM, self.__on_signal)
+	
+	def stop(self):
+		if self.__is_stopped:
+			return
+		self.__is_stopped = True
+		
+		self.__engine.stop()
+		if self.__receiver is not None:
+			# config belongs to the GUI process
+			self.__receiver.stop()
+			self.__channel.close()
+		elif self.__config is not None:
+			self.__engine.store(self.__config)
+			self.__config.sync()
+		
+		self.quit()
+	
+	__dispatcher = Signal(object, object)
+	
+	__REQUEST_TIMEOUT = 300.0
+	
+	def __beat(self):
+		retry_queue = self.__engine.retry_queue
+		self.__channel.beat(len(retry_queue) if retry_queue is not None else 0)
+		# the tray icon and the window of the GUI process show the lag of this worker
+		self.__channel.write({"event" : "status", "time" : time.time(), **self.__engine.status})
+	
+	def __on_command(self, command):
+		name = command.get("command")
+		if name == "sync":
+			self.__engine.synchronize(command["targets"])
+		elif name == "expire":
+			self.__engine.expire(command.get("path"))
+		elif name in ("stop", "closed"):
+			self.stop()
+	
+	def __on_dispatched(self, request, future):
+		try:
+			future.set_result(self.execute(request))
+		except Exception as ex:
+			future.set_exception(ex)
+	
+	def __on_file_stored(self, file_path, is_stored):
+		self.__channel.write({"event" : "stored" if is_stored else "failed", "path" : file_path, "time" : time.time()})
+	
+	def __on_signal(self, signum, frame):
+		logging.info("SIGNAL: %s", signum)
+		QTimer.singleShot(0, self.stop)
+	
+	def __receive(self, request):
+		# on a connection thread of the singleton, so that the request is executed on the event loop
+		future = Future()
+		self.__dispatcher.emit(request, future)
+		return future.result(self.__REQUEST_TIMEOUT)
+	
+	def __setup(self):
+		self.__config = None
+		self.__engine = Engine(self)
+		self.__parser = Engine.ArgumentParser()
+		self.__signal_timer = None
+		self.__beat_timer = None
+		self.__is_stopped = False
+		
+		args, unknown = self.__parser.parse_known_args(self.arguments()[1:])
+		if args.worker:
+			# the GUI process holds the singleton
+			self.__singleton = None
+			self.__channel = StatusChannel(args.status)
+			self.__receiver = CommandReceiver(args.worker, self)
+			self.__receiver.commandReceived.connect(self.__on_command)
+			self.__engine.fileStored.connect(self.__on_file_stored)
+		else:
+			self.__singleton = Singleton()
+			self.__channel = None
+			self.__receiver = None
+			self.__dispatcher.connect(self.__on_dispatched)
+			self.__singleton.handle(self.__receive)
@@ -0,0 +1,262 @@
+"""
+/* --------------------------------
+   Diagnostics of the running process
+
+ - profiles and memory snapshots are taken on demand by the "profile" and "tracemalloc" commands of protocol, without a restart
+ - the sampling profiler reads the stacks of every thread from its own thread, and writes them collapsed, 1 line per stack, for flame graph tools
+ - cProfile traces the thread the commands are executed on, the event loop, and writes pstats
+ - files are written beside the log file, named after it with the time they have been taken
+ - imports no Qt
+-------------------------------- */
+"""
+import collections
+import cProfile
+import datetime
+import logging
+import os
+import sys
+import threading
+import tracemalloc
+
+
+class SamplingProfiler:
+	"""
+	counts of the stacks of every thread, sampled every interval seconds
+	"""
+	def __init__(self, interval=0.01):
+		self.__interval = interval
+		self.__setup()
+	
+	@property
+	def samples(self):
+		with self.__lock:
+			return self.__samples
+	
+	def dump(self, file_path):
+		"""
+		writes "thread;file:function;... count" lines, the most sampled stacks first
+		"""
+		with self.__lock:
+			counts = self.__counts.most_common()
+		with open(file_path, "w", encoding="utf-8") as file:
+			for stack, count in counts:
+				file.write(f"{';'.join(stack)} {count}\n")
+	
+	def start(self):
+		if self.__thread is not None:
+			return
+		
+		self.__stop_event.clear()
+		self.__thread = threading.Thread(target=self.__run, name="SamplingProfiler", daemon=True)
+		self.__thread.start()
+	
+	def stop(self):
+		if self.__thread is None:
+			return
+		
+		self.__stop_event.set()
+		self.__thread.join()
+		self.__thread = None
+	
+	def __run(self):
+		own = threading.get_ident()
+		while not self.__stop_event.wait(self.__interval):
+			names = {thread.ident : thread.name for thread in threading.enumerate()}
+			stacks = []
+			for ident, frame in sys._current_frames().items():
+				if ident == own:
+					continue
+				stack = []
+				while frame is not None:
+					stack.append(f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}")
+					frame = frame.f_back
+				stack.append(names.get(ident, str(ident)))
+				stacks.append(tuple(reversed(stack)))
+			
+			with self.__lock:
+				self.__counts.update(stacks)
+				self.__samples += 1
+	
+	def __setup(self):
+		self.__lock = threading.Lock()
+		self.__counts = collections.Counter()
+		self.__samples = 0
+		self.__stop_event = threading.Event()
+		self.__thread = None
+
+
+class Diagnostics:
+	"""
+	profilers and tracemalloc of the process, driven by commands
+	"""
+	def __init__(self, file_prefix):
+		"""
+		files are written as file_prefix-TIME.EXTENSION
+		"""
+		self.__file_prefix = file_prefix
+		self.__setup()
+	
+	CPROFILE = "cprofile"
+	SAMPLING = "sampling"
+	
+	KINDS = (CPROFILE, SAMPLING)
+	
+	def execute(self, command):
+		"""
+		executes a "profile" or "tracemalloc" command, "action" tells what to do
+		"""
+		name = command.get("command")
+		action = command.get("action")
+		if name == "profile":
+			if action == "start":
+				return self.start_profile(command.get("kind", Diagnostics.SAMPLING), float(command.get("interval", Diagnostics.__SAMPLING_INTERVAL)))
+			if action == "dump":
+				return self.dump_profile()
+			if action == "stop":
+				return self.stop_profile()
+		if name == "tracemalloc":
+			if action == "start":
+				return self.start_tracemalloc(int(command.get("frames", Diagnostics.__TRACEMALLOC_FRAMES)))
+			if action == "snapshot":
+				return self.take_snapshot(int(command.get("limit", Diagnostics.__TOP_LIMIT)))
+			if action == "stop":
+				return self.stop_tracemalloc()
+		raise ValueError(f"unknown action of {name}: {action}")
+	
+	def dump_profile(self):
+		"""
+		writes the profile so far, and keeps profiling
+		"""
+		with self.__lock:
+			if self.__profiler is None:
+				raise ValueError("not profiling")
+			return self.__dump()
+	
+	def start_profile(self, kind=SAMPLING, interval=0.01):
+		with self.__lock:
+			if self.__profiler is not None:
+				raise ValueError(f"already profiling: {self.__kind}")
+			if kind == Diagnostics.SAMPLING:
+				self.__profiler = SamplingProfiler(interval)
+				self.__profiler.start()
+			elif kind == Diagnostics.CPROFILE:
+				self.__profiler = cProfile.Profile()
+				self.__profiler.enable()
+			else:
+				raise ValueError(f"unknown profiler: {kind}")
+			self.__kind = kind
+		logging.info("PROFILE: %s started", kind)
+		return {"profiling" : kind}
+	
+	def start_tracemalloc(self, frames=10):
+		if tracemalloc.is_tracing():
+			raise ValueError("already tracing")
+		tracemalloc.start(frames)
+		self.__snapshot = None
+		logging.info("TRACEMALLOC: started with %s frames", frames)
+		return {"tracing" : True}
+	
+	def stop(self):
+		"""
+		writes what is running before the process exits
+		"""
+		with self.__lock:
+			if self.__profiler is not None:
+				self.__dump()
+				self.__stop_profiler()
+		if tracemalloc.is_tracing():
+			tracemalloc.stop()
+			self.__snapshot = None
+	
+	def stop_profile(self):
+		with self.__lock:
+			if self.__profiler is None:
+				raise ValueError("not profiling")
+			ret = self.__dump()
+			self.__stop_profiler()
+		logging.info("PROFILE: stopped")
+		return ret
+	
+	def stop_tracemalloc(self):
+		if not tracemalloc.is_tracing():
+			raise ValueError("not tracing")
+		tracemalloc.stop()
+		self.__snapshot = None
+		logging.info("TRACEMALLOC: stopped")
+		return {"tracing" : False}
+	
+	def take_snapshot(self, limit=20):
+		"""
+		writes a snapshot, and returns the lines allocating most, and growing most since the last snapshot
+		"""
+		if not tracemalloc.is_tracing():
+			raise ValueError("not tracing, start it first")
+		
+		snapshot = tracemalloc.take_snapshot().filter_traces((
+			tracemalloc.Filter(False, tracemalloc.__file__),
+			# counts of the sampling profiler
+			tracemalloc.Filter(False, __file__),
+			tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+		))
+		file_path = self.__file_path(Diagnostics.__SNAPSHOT_EXTENSION)
+		snapshot.dump(file_path)
+		current, peak = tracemalloc.get_traced_memory()
+		
+		ret = {
+			"file" :	file_path,
+			"current" :	current,
+			"peak" :	peak,
+			"top" :		[str(statistic) for statistic in snapshot.statistics("lineno")[:limit]],
+		}
+		if self.__snapshot is not None:
+			ret["growth"] = [str(difference) for difference in snapshot.compare_to(self.__snapshot, "lineno")[:limit]]
+		self.__snapshot = snapshot
+		logging.info("TRACEMALLOC: %s", file_path)
+		return ret
+	
+	# extensions of the files written
+	__CPROFILE_EXTENSION = ".prof"
+	__SAMPLING_EXTENSION = ".stacks.txt"
+	__SNAPSHOT_EXTENSION = ".tracemalloc"
+	
+	__FORMAT_TIME = "%Y%m%d-%H%M%S-%f"
+	
+	# seconds between samples, short enough for stores of small files, long enough to cost little
+	__SAMPLING_INTERVAL = 0.01
+	
+	# frames kept of each allocation, more of them cost memory of every traced block
+	__TRACEMALLOC_FRAMES = 10
+	
+	__TOP_LIMIT = 20
+	
+	def __dump(self):
+		if self.__kind == Diagnostics.SAMPLING:
+			file_path = self.__file_path(Diagnostics.__SAMPLING_EXTENSION)
+			self.__profiler.dump(file_path)
+			ret = {"file" : file_path, "samples" : self.__profiler.samples}
+		else:
+			# the stats are made with the profiler disabled, and it goes on afterwards
+			file_path = self.__file_path(Diagnostics.__CPROFILE_EXTENSION)
+			self.__profiler.dump_stats(file_path)
+			self.__profiler.enable()
+			ret = {"file" : file_path}
+		logging.info("PROFILE: %s", file_path)
+		return ret
+	
+	def __file_path(self, extension):
+		os.makedirs(os.path.dirname(os.path.abspath(self.__file_prefix)), exist_ok=True)
+		return f"{self.__file_prefix}-{datetime.datetime.now().strftime(Diagnostics.__FORMAT_TIME)}{extension}"
+	
+	def __stop_profiler(self):
+		if self.__kind == Diagnostics.SAMPLING:
+			self.__profiler.stop()
+		else:
+			self.__profiler.disable()
+		self.__profiler = None
+		self.__kind = None
+	
+	def __setup(self):
+		self.__lock = threading.Lock()
+		self.__profiler = None
+		self.__kind = None
+		self.__snapshot = None
@@ -0,0 +1,229 @@
+"""
+/* --------------------------------
+   Durability of copies
+
+ - fsync policy of journaled copies: none, per file, or group commit
+ - group commit lets stores go on at once, and syncs a burst of copies, their directories and their index updates together
+ - a group is committed when its window has passed or it has gathered enough copies
+-------------------------------- */
+"""
+import logging
+import os
+import threading
+import time
+
+
+class Durability:
+	"""
+	fsync policy shared by every copy of the engine
+	"""
+	NONE = "none"
+	FILE = "file"
+	GROUP = "group"
+	
+	MODES = (NONE, FILE, GROUP)
+	
+	def __init__(self, mode=GROUP, window=0.05, max_files=256):
+		"""
+		window is the seconds a group waits for more copies, max_files commits the group earlier
+		"""
+		if mode not in Durability.MODES:
+			raise ValueError(f"unknown durability mode: {mode}")
+		self.__mode = mode
+		self.__window = window
+		self.__max_files = max_files
+		self.__setup()
+	
+	@property
+	def max_files(self):
+		return self.__max_files
+	
+	@max_files.setter
+	def max_files(self, value):
+		self.__max_files = value
+	
+	@property
+	def metrics(self):
+		with self.__condition:
+			return {
+				"groups" :		self.__groups,
+				"files" :		self.__files,
+				"fsyncs" :		self.__fsyncs,
+				"pending" :		len(self.__pending),
+			}
+	
+	@property
+	def mode(self):
+		return self.__mode
+	
+	@mode.setter
+	def mode(self, value):
+		if value not in Durability.MODES:
+			raise ValueError(f"unknown durability mode: {value}")
+		self.flush()
+		self.__mode = value
+	
+	@property
+	def window(self):
+		return self.__window
+	
+	@window.setter
+	def window(self, value):
+		self.__window = value
+	
+	def defer(self, file_path, callback, abort=None, drops_cache=False, on_group=None):
+		"""
+		syncs file_path later with its group, and then calls callback on the committing thread
+		
+		callback renames the synced copy into place, so that the directory is synced after it, abort is called instead when the sync failed
+		on_group is called once per group after the callbacks, however many copies gave the same one, e.g. to commit their index rows together
+		"""
+		if self.__mode != Durability.GROUP:
+			self.sync(file_path, drops_cache)
+			try:
+				callback()
+			finally:
+				if on_group is not None:
+					on_group()
+			self.sync_directory(os.path.dirname(file_path))
+			return
+		
+		with self.__condition:
+			if self.__thread is None:
+				self.__is_running = True
+				self.__thread = threading.Thread(target=self.__run, name="Durability", daemon=True)
+				self.__thread.start()
+			if not self.__pending:
+				# the committing thread waits for the first copy of a group without a deadline
+				self.__deadline = time.monotonic() + self.__window
+				self.__condition.notify_all()
+			self.__pending.append((file_path, callback, abort, drops_cache, on_group))
+			if len(self.__pending) >= self.__max_files:
+				self.__condition.notify_all()
+	
+	def flush(self):
+		"""
+		blocks until every deferred copy has been committed
+		"""
+		with self.__condition:
+			if self.__thread is None:
+				return
+			self.__deadline = time.monotonic()
+			self.__condition.notify_all()
+			while self.__pending or self.__is_committing:
+				self.__condition.wait()
+	
+	def stop(self):
+		self.flush()
+		with self.__condition:
+			if self.__thread is None:
+				return
+			self.__is_running = False
+			self.__condition.notify_all()
+			thread = self.__thread
+			self.__thread = None
+		thread.join()
+	
+	def sync(self, file_path, drops_cache=False):
+		"""
+		drops_cache drops the pages of file_path afterwards, where posix_fadvise is available
+		"""
+		if self.__mode == Durability.NONE:
+			return
+		
+		# reopened for writing, since Windows flushes only files opened so
+		with open(file_path, "rb+") as file:
+			os.fsync(file.fileno())
+			if drops_cache and hasattr(os, "posix_fadvise"):
+				# only clean pages are dropped, so that it waits until the sync has written them back
+				os.posix_fadvise(file.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+		with self.__condition:
+			self.__fsyncs += 1
+	
+	def sync_directory(self, directory):
+		"""
+		makes renames in directory durable, Windows has no way to sync a directory and journals its metadata anyway
+		"""
+		if self.__mode == Durability.NONE or os.name == "nt":
+			return
+		
+		descriptor = os.open(directory or os.curdir, os.O_RDONLY)
+		try:
+			os.fsync(descriptor)
+		finally:
+			os.close(descriptor)
+		with self.__condition:
+			self.__fsyncs += 1
+	
+	def __commit(self, group):
+		directories = set()
+		ready = []
+		on_groups = []
+		for file_path, callback, abort, drops_cache, on_group in group:
+			try:
+				self.sync(file_path, drops_cache)
+				ready.append(callback)
+				if on_group is not None and on_group not in on_groups:
+					on_groups.append(on_group)
+				directories.add(os.path.dirname(file_path))
+			except OSError as ex:
+				logging.error("ERROR: %s", ex)
+				if abort is not None:
+					abort()
+		
+		# renamed only after the whole group is on disk
+		for callback in ready:
+			try:
+				callback()
+			except Exception as ex:
+				logging.error("ERROR: %s", ex)
+		
+		for on_group in on_groups:
+			try:
+				on_group()
+			except Exception as ex:
+				logging.error("ERROR: %s", ex)
+		
+		for directory in directories:
+			try:
+				self.sync_directory(directory)
+			except OSError as ex:
+				logging.error("ERROR: %s", ex)
+		
+		with self.__condition:
+			self.__groups += 1
+			self.__files += len(group)
+	
+	def __run(self):
+		with self.__condition:
+			while self.__is_running or self.__pending:
+				if not self.__pending:
+					self.__condition.wait()
+					continue
+				
+				timeout = self.__deadline - time.monotonic()
+				if timeout > 0 and len(self.__pending) < self.__max_files and self.__is_running:
+					self.__condition.wait(timeout)
+					continue
+				
+				group = self.__pending
+				self.__pending = []
+				self.__is_committing = True
+				self.__condition.release()
+				try:
+					self.__commit(group)
+				finally:
+					self.__condition.acquire()
+					self.__is_committing = False
+					self.__condition.notify_all()
+	
+	def __setup(self):
+		self.__condition = threading.Condition()
+		self.__pending = []
+		self.__deadline = 0.0
+		self.__thread = None
+		self.__is_running = False
+		self.__is_committing = False
+		self.__groups = 0
+		self.__files = 0
+		self.__fsyncs = 0
@@ -0,0 +1,987 @@
+"""
+/* --------------------------------
+   Backup engine
+
+ - management of work.File objects
+ - management of work.Work(target) objects
+ - own the version index, the retry queue, the copy throttle, the scrubber, the replicators and the background pool
+ - stores to different shards run in parallel, 1 lane per shard, and stores to the same shard one after another
+ - imports no Qt widgets, so that it runs with or without the GUI
+ - a passive engine only keeps targets and reads the repository, another process does the backup work
+-------------------------------- */
+"""
+from argparse import ArgumentParser, SUPPRESS
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+from PySide6.QtCore import QObject, Signal
+
+import aggregate
+from diagnose import Diagnostics
+from durability import Durability
+import journal
+import logs
+import metrics
+import path
+from replicate import Replicator
+from retry import RetryQueue
+from shard import Shards
+from storage import Repository, StoragePolicy
+import transfer
+import work
+
+
+_EVENTS = metrics.REGISTRY.counter("bb_events_total", "file system events of targets", ("type",))
+_EVENT_LOG = logging.getLogger(logs.EVENTS)
+_EVENT_DURABLE_SECONDS = metrics.REGISTRY.histogram("bb_event_durable_seconds", "latency from a file system event to its version in place and indexed")
+
+
+class Engine(QObject):
+	"""
+	file watch works and the store pipeline
+	"""
+	class ArgumentParser(ArgumentParser):
+		def __init__(self, *args, **kwargs):
+			super().__init__(*args, **kwargs)
+			self.__setup()
+		
+		def __setup(self):
+			self.add_argument("-a", "--add", action="append", dest="add_targets", metavar="DIR_PATH",
+								help="add new backup target")
+			self.add_argument("-r", "--remove", action="append", dest="remove_targets", metavar="DIR_PATH",
+								help="remove backup target")
+			self.add_argument("--headless", action="store_true",
+								help="run the backup engine only, without any window or tasktray icon")
+			self.add_argument("--split", action="store_true",
+								help="run the backup engine in a worker process apart from the window")
+			self.add_argument("--worker", metavar="ADDRESS",
+								help=SUPPRESS)
+			self.add_argument("--status", metavar="NAME",
+								help=SUPPRESS)
+	
+	def __init__(self, parent=None):
+		super().__init__(parent)
+		self.__setup()
+	
+	fileRestored = Signal(str)
+	fileStored = Signal(str, bool)
+	targetsChanged = Signal()
+	
+	# states of the store pipeline
+	IDLE = "idle"
+	BUSY = "busy"
+	BEHIND = "behind"
+	
+	@property
+	def durability(self):
+		return self.__durability
+	
+	@property
+	def index(self):
+		return self.repository.index
+	
+	@property
+	def is_passive(self):
+		return self.__is_passive
+	
+	@is_passive.setter
+	def is_passive(self, value):
+		self.__is_passive = value
+	
+	@property
+	def journal(self):
+		return self.repository.journal
+	
+	@property
+	def layout(self):
+		return self.repository.layout
+	
+	@property
+	def log_file_path(self):
+		return self.__log_file_path
+	
+	@log_file_path.setter
+	def log_file_path(self, value):
+		self.__log_file_path = value
+	
+	@property
+	def pool(self):
+		return self.__pool
+	
+	@property
+	def repository(self):
+		"""
+		storage.Repository shared by targets without their own repository root
+		"""
+		if self.__repository is None:
+			shards = Shards([self.__repository_root, *self.__shard_roots], self.__shard_policy)
+			self.__repository = Repository(self.__repository_root, self.__durability, self.__throttle, self.__storage, shards, self)
+			self.__repository.journal_file_name = self.__journal_file_name()
+		return self.__repository
+	
+	@property
+	def repository_root(self):
+		return self.__repository_root
+	
+	@repository_root.setter
+	def repository_root(self, value):
+		if value == self.__repository_root:
+			return
+		
+		self.__repository_root = value
+		if self.__repository is not None:
+			self.__repository.close()
+			self.__repository = None
+	
+	@property
+	def retry_file_path(self):
+		return self.__retry_file_path
+	
+	@retry_file_path.setter
+	def retry_file_path(self, value):
+		self.__retry_file_path = value
+	
+	@property
+	def retry_queue(self):
+		return self.__retry_queue
+	
+	@property
+	def shards(self):
+		return self.repository.shards
+	
+	@property
+	def status(self):
+		"""
+		lag of the store pipeline, read from the metrics registry
+		
+		state is BEHIND when an event has waited for its version longer than behind seconds, BUSY while anything is queued or waiting
+		"""
+		values = metrics.REGISTRY.snapshot()
+		ret = {key : values.get(name, 0) for key, name in Engine.__STATUS_METRICS}
+		ret["copied_bytes"] = values.get("bb_copied_bytes_total", {}).get(f"kind={journal.Journal.STORE}", 0)
+		if ret["oldest_pending_seconds"] >= self.__behind_seconds:
+			ret["state"] = Engine.BEHIND
+		elif ret["queued"] or ret["oldest_pending_seconds"] or ret["durability_pending"]:
+			ret["state"] = Engine.BUSY
+		else:
+			ret["state"] = Engine.IDLE
+		return ret
+	
+	@property
+	def storage(self):
+		"""
+		storage.StoragePolicy inherited by every target
+		"""
+		return self.__storage
+	
+	@property
+	def targets_file_path(self):
+		return self.__targets_file_path
+	
+	@targets_file_path.setter
+	def targets_file_path(self, value):
+		self.__targets_file_path = value
+	
+	@property
+	def throttle(self):
+		return self.__throttle
+	
+	def add_target(self):
+		ret = self.__create_target()
+		self.__targets.append(ret)
+		self.targetsChanged.emit()
+		return ret
+	
+	def close_target(self, desc):
+		target = self.find_target(desc)
+		if target is not None:
+			self.remove_target(target)
+		return target
+	
+	def execute(self, command):
+		"""
+		executes 1 command of protocol, and returns its result
+		"""
+		name = command.get("command")
+		if name == "add":
+			target = self.open_target(command["path"])
+			return {"target" : target.root}
+		if name == "expire":
+			self.expire(command.get("path"))
+			return {}
+		if name in ("profile", "tracemalloc"):
+			if self.__diagnostics is None:
+				# written beside the log file
+				self.__diagnostics = Diagnostics(os.path.splitext(self.log_file_path or sys.argv[0])[0])
+			return self.__diagnostics.execute(command)
+		if name == "metrics":
+			return {"text" : metrics.REGISTRY.render(), "values" : metrics.REGISTRY.snapshot()}
+		if name == "remove":
+			target = self.close_target(command["path"])
+			return {"removed" : target is not None}
+		if name == "restore":
+			file = self.inquiry(command["path"], True)
+			if file is None:
+				raise ValueError(f"no versions: {command['path']}")
+			return {"restored" : self.restore_file(file, command["timecode"])}
+		if name == "stats":
+			return {
+				"targets" :			len(self.__targets),
+				"active_targets" :	sum(1 for target in self.__targets if target.is_active),
+				"tracked_files" :	len(self.__files),
+				"ignore_hits" :		{target.root : target.ignore_rules.hits for target in self.__targets if target.ignore_rules},
+				"retry" :			self.__retry_queue.metrics if self.__retry_queue is not None else None,
+				"scrub" :			self.__scrubber.metrics if self.__scrubber is not None else None,
+				"durability" :		self.__durability.metrics,
+				"replication" :		self.__replicator.metrics if self.__replicator is not None else None,
+				"aggregation" :		self.__aggregator.metrics if self.__aggregator is not None else None,
+				"status" :			self.status,
+			}
+		if name == "targets":
+			return {"targets" : self.serialize()}
+		if name == "versions":
+			versions = self.find_versions(command["path"])
+			return {"versions" : [version._asdict() for version in versions]}
+		raise ValueError(f"unknown command: {name}")
+	
+	def expire(self, file_path=None):
+		"""
+		drops the tracked file, or all of them without file_path, to reload versions on next inquiry
+		"""
+		if file_path is None:
+			self.__files.clear()
+		else:
+			self.__files.pop(work.File.normalize(file_path), None)
+	
+	def find_target(self, root):
+		if root.endswith("..."):
+			root = root[:-3]
+		
+		for target in self.__targets:
+			if path.equals(target.root, root):
+				return target
+		
+		return None
+	
+	def find_versions(self, file_path):
+		"""
+		versions of file_path known to the index of its repository, deleted files included
+		"""
+		return self.__find_repository(file_path).index.find_versions(work.File.normalize(file_path))
+	
+	def get_deleted_files(self, directory):
+		directory = path.normalize_dir_expression(work.File.normalize(directory))
+		for ret in self.__find_repository(directory).index.find_deleted_files(directory):
+			yield ret
+	
+	def get_targets(self):
+		for ret in self.__targets:
+			yield ret
+	
+	def inquiry(self, file_path, is_deleted=False):
+		ret = None
+		repository = self.__find_repository(file_path)
+		if os.path.isfile(file_path) or (is_deleted and repository.index.is_deleted(work.File.normalize(file_path))):
+			file_path = work.File.normalize(file_path)
+			if file_path in self.__files:
+				ret = self.__files[file_path]
+			else:
+				ret = work.File(file_path, repository)
+				self.__files[file_path] = ret
+		
+		return ret
+	
+	def move_target(self, from_, to):
+		moved = self.__targets.pop(from_)
+		self.__targets.insert(to, moved)
+		self.targetsChanged.emit()
+	
+	def on_created(self, event):
+		file_path = event.src_path
+		if self.__is_in_repository(file_path) or journal.is_temporary(file_path):
+			return
+		_EVENT_LOG.info("CREATED: %s", file_path)
+		_EVENTS.inc("created")
+		file = self.inquiry(file_path)
+		if file is not None:
+			self.__note_event(file.path)
+			self.store_file(file)
+	
+	def on_deleted(self, event):
+		file_path = event.src_path
+		if self.__is_in_repository(file_path) or journal.is_temporary(file_path):
+			return
+		_EVENT_LOG.info("DELETED: %s", file_path)
+		_EVENTS.inc("deleted")
+		if event.is_directory:
+			directory = path.normalize_dir_expression(work.File.normalize(file_path))
+			self.__find_repository(directory).index.bury_directory(directory)
+			for file_path in [file_path for file_path in self.__files if file_path.startswith(directory)]:
+				del self.__files[file_path]
+			with self.__pending_lock:
+				for file_path in [file_path for file_path in self.__event_times if file_path.startswith(directory)]:
+					del self.__event_times[file_path]
+		else:
+			file_path = work.File.normalize(file_path)
+			self.__find_repository(file_path).index.bury(file_path)
+			self.__files.pop(file_path, None)
+			self.__forget_event(file_path)
+	
+	def on_modified(self, event):
+		file_path = event.src_path
+		if self.__is_in_repository(file_path) or journal.is_temporary(file_path):
+			return
+		_EVENT_LOG.info("MODIFIED: %s", file_path)
+		_EVENTS.inc("modified")
+		file = self.inquiry(file_path)
+		if file is not None:
+			self.__note_event(file.path)
+			self.store_file(file)
+	
+	def on_moved(self, event):
+		if getattr(event, "is_synthetic", False):
+			# contents of a moved directory have been relocated with the directory itself
+			return
+		
+		file_path = event.dest_path
+		if self.__is_in_repository(file_path) or journal.is_temporary(file_path):
+			return
+		_EVENT_LOG.info("MOVED_TO: %s", file_path)
+		_EVENTS.inc("moved")
+		if event.is_directory:
+			self.__relocate_directory(event.src_path, file_path)
+			return
+		
+		file = self.__relocate(event.src_path, file_path)
+		if file is not None:
+			self.__note_event(file.path)
+			self.store_file(file)
+	
+	def open_target(self, desc):
+		ret = self.find_target(desc)
+		if ret is None:
+			ret = self.add_target()
+			ret.root = desc
+			ret.activate()
+		return ret
+	
+	def remove_target(self, target):
+		self.__targets.remove(target)
+		target.deactivate()
+		target.deleteLater()
+		self.targetsChanged.emit()
+	
+	def restore(self, config):
+		config.beginGroup("Application")
+		
+		repository_root = config.value("repository")
+		if repository_root:
+			self.__repository_root = repository_root
+		
+		targets_file_path = config.value("targets")
+		if targets_file_path:
+			self.__targets_file_path = targets_file_path
+		
+		log_file_path = config.value("log")
+		if log_file_path:
+			self.__log_file_path = log_file_path
+		
+		retry_file_path = config.value("retry")
+		if retry_file_path:
+			self.__retry_file_path = retry_file_path
+		
+		config.endGroup()
+		
+		config.beginGroup("Throttle")
+		self.__throttle.bytes_per_second = int(config.value("bytes_per_second", 0))
+		self.__throttle.operations_per_second = int(config.value("operations_per_second", 0))
+		drops_cache = config.value("drops_cache")
+		if drops_cache is not None:
+			self.__throttle.drops_cache = str(drops_cache).lower() == "true"
+		config.endGroup()
+		
+		config.beginGroup("Browse")
+		self.__browse_address = config.value("address", self.__browse_address)
+		self.__browse_port = int(config.value("port", 0))
+		config.endGroup()
+		
+		config.beginGroup("Durability")
+		self.__durability.mode = config.value("mode", self.__durability.mode)
+		self.__durability.window = int(config.value("window", int(self.__durability.window * 1000))) / 1000
+		self.__durability.max_files = int(config.value("max_files", self.__durability.max_files))
+		config.endGroup()
+		
+		config.beginGroup("Scrub")
+		self.__scrub_interval = int(config.value("interval", self.__scrub_interval))
+		self.__scrub_throttle.bytes_per_second = int(config.value("bytes_per_second", self.__scrub_throttle.bytes_per_second))
+		config.endGroup()
+		
+		config.beginGroup("Replication")
+		self.__replica_root = config.value("path", self.__replica_root)
+		self.__replica_kind = config.value("kind", self.__replica_kind)
+		self.__replication_interval = int(config.value("interval", self.__replication_interval))
+		self.__replication_throttle.bytes_per_second = int(config.value("bytes_per_second", self.__replication_throttle.bytes_per_second))
+		config.endGroup()
+		
+		config.beginGroup("Aggregation")
+		self.__aggregation_address = config.value("address", self.__aggregation_address)
+		self.__aggregation_port = int(config.value("port", self.__aggregation_port))
+		self.__aggregation_name = config.value("name", self.__aggregation_name)
+		self.__aggregation_throttle.bytes_per_second = int(config.value("bytes_per_second", self.__aggregation_throttle.bytes_per_second))
+		config.endGroup()
+		
+		config.beginGroup("Shards")
+		# an empty list is stored as @Invalid(), which is read back as None
+		roots = config.value("roots") or []
+		# QSettings gives a single value as a plain string
+		self.__shard_roots = [roots] if isinstance(roots, str) else list(roots)
+		self.__shard_policy = config.value("policy", self.__shard_policy)
+		config.endGroup()
+		
+		config.beginGroup("Storage")
+		self.__storage.compresses = str(config.value("compression", self.__storage.compresses)).lower() == "true"
+		self.__storage.deduplicates = str(config.value("dedup", self.__storage.deduplicates)).lower() == "true"
+		config.endGroup()
+		
+		config.beginGroup("Metrics")
+		self.__metrics_file_path = config.value("file", self.__metrics_file_path)
+		self.__metrics_interval = int(config.value("interval", self.__metrics_interval))
+		self.__behind_seconds = int(config.value("behind", self.__behind_seconds))
+		config.endGroup()
+		
+		config.beginGroup("Log")
+		self.__log_max_bytes = int(config.value("max_bytes", self.__log_max_bytes))
+		self.__log_backup_count = int(config.value("backups", self.__log_backup_count))
+		self.__log_is_json = str(config.value("json", self.__log_is_json)).lower() == "true"
+		self.__log_event_interval = float(config.value("event_interval", self.__log_event_interval))
+		config.endGroup()
+	
+	def restore_file(self, file, timecode):
+		ret = file.restore(timecode, self.__find_throttle(file.path))
+		if ret:
+			self.fileRestored.emit(file.path)
+		return ret
+	
+	def revert(self, target, ):
+		self.__targets.remove(target)
+		target.deactivate()
+		self.targetsChanged.emit()
+	
+	def serialize(self):
+		ret = {}
+		for target in self.__targets:
+			root = target.root
+			if root:
+				ret[root] = target.serialize()
+		return ret
+	
+	def start(self):
+		if self.log_file_path:
+			# the passive engine of split mode writes a file of its own, so that each file is rotated by 1 process
+			log_file_path = self.log_file_path
+			if self.__is_passive:
+				root, extension = os.path.splitext(log_file_path)
+				log_file_path = root + Engine.__PASSIVE_LOG_SUFFIX + extension
+			self.__log_pipeline = logs.LogPipeline(log_file_path, self.__log_max_bytes, self.__log_backup_count, self.__log_is_json, self.__log_event_interval)
+			self.__log_pipeline.start()
+		
+		# copies interrupted by the last crash are finished or thrown away before anything else is copied,
+		# each process recovers only the journal it writes
+		replayed, discarded = self.journal.recover()
+		if replayed or discarded:
+			logging.info("RECOVERED: %s replayed, %s discarded", len(replayed), len(discarded))
+		
+		if not self.__is_passive:
+			# readers of the index find the other roots there
+			try:
+				self.shards.save()
+			except OSError as ex:
+				logging.error("ERROR: %s", ex)
+			
+			self.__retry_queue = RetryQueue(self.__retry_store, self.__pool, self.retry_file_path)
+			self.__retry_queue.start()
+		
+		if self.__browse_port and not self.__is_passive:
+			# read-only browsing of versions, served from the same index
+			from browse import BrowseServer
+			self.__browse_server = BrowseServer(self.index, self.__browse_address, self.__browse_port)
+			try:
+				self.__browse_server.start()
+			except OSError as ex:
+				logging.error("ERROR: %s", ex)
+				self.__browse_server = None
+		
+		if self.__scrub_interval and not self.__is_passive:
+			# 1 hashing process, paced apart from the store throttle
+			from scrub import Scrubber
+			self.__scrubber = Scrubber(self.index, 1, self.__scrub_throttle)
+			self.__scrubber.start(self.__scrub_interval)
+		
+		if self.__replica_root and not self.__is_passive:
+			# new versions of the shared repository are streamed to the replica in the background
+			try:
+				replica = Replicator.open_replica(self.__replica_kind, self.__replica_root, self.__durability)
+			except ValueError as ex:
+				logging.error("ERROR: %s", ex)
+			else:
+				self.__replicator = Replicator(self.index, replica, self.__replication_throttle)
+				self.__replicator.start(self.__replication_interval)
+		
+		if self.__aggregation_address and not self.__is_passive:
+			# pushed to the aggregation server of the shop, contents shared with other machines are sent once
+			replica = aggregate.AggregateReplica(self.__aggregation_address, self.__aggregation_port, self.__aggregation_name or None)
+			self.__aggregator = Replicator(self.index, replica, self.__aggregation_throttle)
+			self.__aggregator.start(self.__replication_interval)
+		
+		if not self.__is_passive:
+			# read only when collected, so that the store pipeline pays nothing for them
+			metrics.REGISTRY.gauge("bb_store_queue_depth", "stores queued or copying", function=lambda: self.__queued)
+			metrics.REGISTRY.gauge("bb_oldest_pending_event_seconds", "age of the oldest event whose version is not stored yet", function=self.__oldest_pending_age)
+			metrics.REGISTRY.gauge("bb_tracked_files", "files tracked in memory", function=lambda: len(self.__files))
+			metrics.REGISTRY.gauge("bb_active_targets", "targets watching", function=lambda: sum(1 for target in self.__targets if target.is_active))
+			metrics.REGISTRY.gauge("bb_retry_pending", "stores waiting for a retry", function=lambda: self.__retry_queue.metrics["pending"] if self.__retry_queue is not None else 0)
+			metrics.REGISTRY.gauge("bb_durability_pending", "copies waiting for their group commit", function=lambda: self.__durability.metrics["pending"])
+			if self.__metrics_file_path:
+				metrics.REGISTRY.start(self.__metrics_file_path, self.__metrics_interval)
+		
+		self.__deserialize(self.targets_file_path)
+	
+	def stop(self):
+		if not self.__is_passive:
+			self.__serialize(self.targets_file_path)
+		for target in self.__targets:
+			target.deactivate()
+		
+		if self.__retry_queue is not None:
+			self.__retry_queue.stop()
+		self.__pool.shutdown(cancel_futures=True)
+		for lane in self.__lanes.values():
+			lane.shutdown(cancel_futures=True)
+		self.__lanes = {}
+		
+		# copies waiting for their group are put in place before the journal is closed
+		self.__durability.stop()
+		metrics.REGISTRY.stop()
+		
+		if self.__scrubber is not None:
+			self.__scrubber.stop()
+			self.__scrubber = None
+		
+		if self.__replicator is not None:
+			self.__replicator.stop()
+			self.__replicator = None
+		
+		if self.__aggregator is not None:
+			self.__aggregator.stop()
+			self.__aggregator = None
+		
+		if self.__browse_server is not None:
+			self.__browse_server.stop()
+			self.__browse_server = None
+		
+		for repository in self.__repositories.values():
+			repository.close()
+		self.__repositories = {}
+		if self.__repository is not None:
+			self.__repository.close()
+			self.__repository = None
+		
+		if self.__diagnostics is not None:
+			self.__diagnostics.stop()
+			self.__diagnostics = None
+		
+		# the last lines are written before the engine is gone
+		if self.__log_pipeline is not None:
+			self.__log_pipeline.stop()
+			self.__log_pipeline = None
+	
+	def store(self, config):
+		config.beginGroup("Application")
+		config.setValue("repository", self.__repository_root)
+		config.setValue("targets", self.__targets_file_path)
+		config.setValue("log", self.__log_file_path)
+		config.setValue("retry", self.__retry_file_path)
+		config.endGroup()
+		
+		config.beginGroup("Throttle")
+		config.setValue("bytes_per_second", self.__throttle.bytes_per_second)
+		config.setValue("operations_per_second", self.__throttle.operations_per_second)
+		config.setValue("drops_cache", self.__throttle.drops_cache)
+		config.endGroup()
+		
+		config.beginGroup("Browse")
+		config.setValue("address", self.__browse_address)
+		config.setValue("port", self.__browse_port)
+		config.endGroup()
+		
+		config.beginGroup("Durability")
+		config.setValue("mode", self.__durability.mode)
+		config.setValue("window", int(self.__durability.window * 1000))
+		config.setValue("max_files", self.__durability.max_files)
+		config.endGroup()
+		
+		config.beginGroup("Scrub")
+		config.setValue("interval", self.__scrub_interval)
+		config.setValue("bytes_per_second", self.__scrub_throttle.bytes_per_second)
+		config.endGroup()
+		
+		config.beginGroup("Replication")
+		config.setValue("path", self.__replica_root)
+		config.setValue("kind", self.__replica_kind)
+		config.setValue("interval", self.__replication_interval)
+		config.setValue("bytes_per_second", self.__replication_throttle.bytes_per_second)
+		config.endGroup()
+		
+		config.beginGroup("Aggregation")
+		config.setValue("address", self.__aggregation_address)
+		config.setValue("port", self.__aggregation_port)
+		config.setValue("name", self.__aggregation_name)
+		config.setValue("bytes_per_second", self.__aggregation_throttle.bytes_per_second)
+		config.endGroup()
+		
+		config.beginGroup("Shards")
+		config.setValue("roots", self.__shard_roots)
+		config.setValue("policy", self.__shard_policy)
+		config.endGroup()
+		
+		config.beginGroup("Storage")
+		config.setValue("compression", self.__storage.compresses)
+		config.setValue("dedup", self.__storage.deduplicates)
+		config.endGroup()
+		
+		config.beginGroup("Metrics")
+		config.setValue("file", self.__metrics_file_path)
+		config.setValue("interval", self.__metrics_interval)
+		config.setValue("behind", self.__behind_seconds)
+		config.endGroup()
+		
+		config.beginGroup("Log")
+		config.setValue("max_bytes", self.__log_max_bytes)
+		config.setValue("backups", self.__log_backup_count)
+		config.setValue("json", self.__log_is_json)
+		config.setValue("event_interval", self.__log_event_interval)
+		config.endGroup()
+	
+	def store_file(self, file, throttle=None):
+		"""
+		stores a new version of file, and schedules a retry when the copy failed on a locked file
+		
+		with several shards, the copy is queued on the lane of its shard and True is returned at once
+		"""
+		if throttle is None:
+			throttle = self.__find_throttle(file.path)
+		with self.__pending_lock:
+			self.__queued += 1
+		if len(self.shards) > 1 or self.__repositories:
+			self.__lane_of(file.repository_root).submit(self.__store_file, file, throttle)
+			return True
+		return self.__store_file(file, throttle)
+	
+	def synchronize(self, data):
+		"""
+		makes targets the same as serialized data, unchanged targets keep watching as they are
+		"""
+		targets = []
+		for desc, value in data.items():
+			target = self.find_target(desc)
+			if target is None:
+				target = self.__create_target()
+				self.__targets.append(target)
+				target.deserialize(desc, value)
+			elif target.serialize() != value:
+				target.deserialize(desc, value)
+			targets.append(target)
+		
+		for target in self.__targets:
+			if target not in targets:
+				target.deactivate()
+				target.deleteLater()
+		
+		self.__targets = targets
+		self.targetsChanged.emit()
+	
+	__SCRUB_BYTES_PER_SECOND = 4 * 1024 * 1024
+	
+	# seconds an event may wait for its version before the backup is behind
+	__BEHIND_SECONDS = 120
+	
+	# the log file is rotated at 10 MB, and 5 old ones are kept
+	__LOG_BACKUP_COUNT = 5
+	__LOG_MAX_BYTES = 10 * 1024 * 1024
+	
+	# seconds between lines of the same event on the same path
+	__LOG_EVENT_INTERVAL = 5.0
+	
+	# journal of the restores of a passive engine, the worker of split mode writes the journal of the repository
+	__PASSIVE_JOURNAL_FILE_NAME = ".bb.window.journal"
+	
+	# inserted before the extension of the log file of a passive engine
+	__PASSIVE_LOG_SUFFIX = ".window"
+	
+	# seconds between writes of the metrics file
+	__METRICS_INTERVAL = 15
+	
+	# new versions are looked for once a minute, besides the stores of this engine
+	__REPLICATION_INTERVAL = 60
+	
+	# every version is verified again once a week
+	__SCRUB_INTERVAL = 7 * 24 * 60 * 60
+	
+	# status keys and the metrics they are read from
+	__STATUS_METRICS = (
+		("queued",					"bb_store_queue_depth"),
+		("oldest_pending_seconds",	"bb_oldest_pending_event_seconds"),
+		("stored",					"bb_stores_total"),
+		("failed",					"bb_store_failures_total"),
+		("retry_pending",			"bb_retry_pending"),
+		("durability_pending",		"bb_durability_pending"),
+		("active_targets",			"bb_active_targets"),
+	)
+	
+	def __create_target(self):
+		ret = work.Work(self)
+		ret.on_created_handler = self.on_created
+		ret.on_deleted_handler = self.on_deleted
+		ret.on_modified_handler = self.on_modified
+		ret.on_moved_handler = self.on_moved
+		ret.activeChanged.connect(self.targetsChanged)
+		ret.ignoreChanged.connect(self.targetsChanged)
+		ret.recursiveChanged.connect(self.targetsChanged)
+		ret.rootChanged.connect(self.targetsChanged)
+		ret.repositoryChanged.connect(self.targetsChanged)
+		# tracked files are bound to the repository they have been found in
+		ret.repositoryChanged.connect(self.expire)
+		return ret
+	
+	def __deserialize(self, file_path):
+		try:
+			with open(file_path, "r") as file:
+				data = json.load(file)
+				for desc, value in data.items():
+					# listed before activation, so that the files found on activation go to the repository of the target
+					target = self.__create_target()
+					self.__targets.append(target)
+					target.deserialize(desc, value)
+		except Exception as ex:
+			logging.error("ERROR: %s", ex)
+	
+	def __find_throttle(self, file_path):
+		for target in self.__targets:
+			if target.root and file_path.startswith(path.normalize_dir_expression(work.File.normalize(target.root))):
+				return target.throttle
+		return self.__throttle
+	
+	def __find_repository(self, file_path):
+		"""
+		repository of the target that has file_path, the shared one by default
+		"""
+		file_path = work.File.normalize(file_path)
+		for target in self.__targets:
+			if target.repository_root and target.root and file_path.startswith(path.normalize_dir_expression(work.File.normalize(target.root))):
+				return self.__open_repository(target.repository_root)
+		return self.repository
+	
+	def __find_storage(self, file_path):
+		for target in self.__targets:
+			if target.root and file_path.startswith(path.normalize_dir_expression(work.File.normalize(target.root))):
+				return target.storage
+		return self.__storage
+	
+	def __forget_event(self, file_path):
+		# nothing is left to store for the event
+		with self.__pending_lock:
+			self.__event_times.pop(file_path, None)
+	
+	def __is_in_repository(self, file_path):
+		if self.repository.contains(file_path):
+			return True
+		for target in self.__targets:
+			if target.repository_root and self.__open_repository(target.repository_root).contains(file_path):
+				return True
+		return False
+	
+	def __journal_file_name(self):
+		# the window of split mode restores while the worker stores, so that each truncates and recovers only its own records
+		return Engine.__PASSIVE_JOURNAL_FILE_NAME if self.__is_passive else Repository.JOURNAL_FILE_NAME
+	
+	def __lane_of(self, repository_root):
+		# 1 lane per volume root, so that a disk is written by 1 thread at a time
+		key = os.path.normcase(os.path.abspath(repository_root))
+		with self.__lanes_lock:
+			ret = self.__lanes.get(key)
+			if ret is None:
+				ret = ThreadPoolExecutor(1, thread_name_prefix=f"Lane{len(self.__lanes)}")
+				self.__lanes[key] = ret
+		return ret
+	
+	def __note_event(self, file_path):
+		with self.__pending_lock:
+			self.__event_times.setdefault(file_path, time.monotonic())
+	
+	def __oldest_pending_age(self):
+		with self.__pending_lock:
+			oldest = min(self.__event_times.values(), default=None)
+		return time.monotonic() - oldest if oldest is not None else 0.0
+	
+	def __on_durable(self, event_time):
+		_EVENT_DURABLE_SECONDS.observe(time.monotonic() - event_time)
+	
+	def __open_repository(self, repository_root):
+		key = os.path.normcase(os.path.abspath(repository_root))
+		if key == os.path.normcase(os.path.abspath(self.__repository_root)):
+			return self.repository
+		
+		with self.__lanes_lock:
+			ret = self.__repositories.get(key)
+			if ret is not None:
+				return ret
+			ret = Repository(repository_root, self.__durability, self.__throttle, self.__storage, parent=self)
+			ret.journal_file_name = self.__journal_file_name()
+			self.__repositories[key] = ret
+		
+		# the same as the shared repository on start
+		replayed, discarded = ret.journal.recover()
+		if replayed or discarded:
+			logging.info("RECOVERED: %s %s replayed, %s discarded", repository_root, len(replayed), len(discarded))
+		return ret
+	
+	def __relocate(self, file_path, to):
+		# a copy renamed into place is a modification of to
+		if self.__is_in_repository(file_path) or journal.is_temporary(file_path):
+			return self.inquiry(to)
+		
+		if not os.path.isfile(to):
+			return None
+		
+		file_path = work.File.normalize(file_path)
+		to = work.File.normalize(to)
+		if file_path in self.__files:
+			ret = self.__files.pop(file_path)
+		else:
+			ret = work.File(file_path, self.__find_repository(file_path))
+		ret.relocate(to)
+		self.__files[to] = ret
+		return ret
+	
+	def __relocate_directory(self, directory_path, to):
+		if self.__is_in_repository(directory_path):
+			return
+		
+		repository = self.__find_repository(directory_path)
+		work.File.relocate_directory(repository.shards, directory_path, to, repository.index, repository.layout)
+		
+		# tracked files of both sides are reloaded from the repository on next inquiry
+		prefixes = (path.normalize_dir_expression(work.File.normalize(directory_path)), path.normalize_dir_expression(work.File.normalize(to)))
+		for file_path in [file_path for file_path in self.__files if file_path.startswith(prefixes)]:
+			del self.__files[file_path]
+	
+	def __retry_store(self, file_path):
+		file = self.inquiry(file_path)
+		if file is None:
+			# nothing to keep anymore
+			self.__forget_event(work.File.normalize(file_path))
+			return True
+		
+		ret = self.__store(file, self.__find_throttle(file.path))
+		if not ret and isinstance(file.last_error, FileNotFoundError) and not os.path.exists(file.path):
+			# removed since the inquiry, nothing to keep anymore either
+			self.__forget_event(file.path)
+			return True
+		return ret
+	
+	def __serialize(self, file_path):
+		data = self.serialize()
+		
+		try:
+			with open(file_path, "w") as file:
+				json.dump(data, file, indent=2)
+		except Exception as ex:
+			logging.error("ERROR: %s", ex)
+	
+	def __store(self, file, throttle):
+		# events so far are settled by this store, the latency counts from the first of them
+		with self.__pending_lock:
+			event_time = self.__event_times.pop(file.path, None)
+		on_durable = functools.partial(self.__on_durable, event_time) if event_time is not None else None
+		
+		ret = file.store(throttle, self.__find_storage(file.path), on_durable)
+		if ret:
+			self.__wake_replicators(file)
+		elif event_time is not None:
+			# still waiting, for the retry
+			with self.__pending_lock:
+				self.__event_times.setdefault(file.path, event_time)
+		self.fileStored.emit(file.path, ret)
+		return ret
+	
+	def __store_file(self, file, throttle):
+		try:
+			ret = self.__store(file, throttle)
+			if not ret:
+				self.__retry_queue.push(file.path, file.last_error)
+			return ret
+		finally:
+			with self.__pending_lock:
+				self.__queued -= 1
+	
+	def __wake_replicators(self, file):
+		# versions of the other repositories are not replicated
+		if self.__find_repository(file.path) is not self.repository:
+			return
+		for replicator in (self.__replicator, self.__aggregator):
+			if replicator is not None:
+				replicator.wake()
+	
+	def __setup(self):
+		self.__repository_root = "repository"
+		self.__targets_file_path = "target.json"
+		self.__log_file_path = os.path.splitext(sys.argv[0])[0] + ".log"
+		self.__retry_file_path = "retry.json"
+		self.__log_pipeline = None
+		self.__diagnostics = None
+		self.__log_max_bytes = Engine.__LOG_MAX_BYTES
+		self.__log_backup_count = Engine.__LOG_BACKUP_COUNT
+		self.__log_is_json = False
+		self.__log_event_interval = Engine.__LOG_EVENT_INTERVAL
+		self.__retry_queue = None
+		self.__is_passive = False
+		self.__pool = ThreadPoolExecutor(thread_name_prefix="Engine")
+		self.__throttle = transfer.Throttle()
+		self.__durability = Durability()
+		self.__targets = []
+		self.__files = {}
+		self.__storage = StoragePolicy()
+		self.__repository = None
+		self.__repositories = {}
+		self.__shard_roots = []
+		self.__shard_policy = Shards.HASH
+		self.__lanes = {}
+		self.__lanes_lock = threading.Lock()
+		self.__pending_lock = threading.Lock()
+		self.__queued = 0
+		self.__event_times = {}
+		self.__metrics_file_path = ""
+		self.__metrics_interval = Engine.__METRICS_INTERVAL
+		self.__behind_seconds = Engine.__BEHIND_SECONDS
+		self.__browse_address = "127.0.0.1"
+		self.__browse_port = 0
+		self.__browse_server = None
+		self.__scrub_interval = Engine.__SCRUB_INTERVAL
+		self.__scrub_throttle = transfer.Throttle(Engine.__SCRUB_BYTES_PER_SECOND)
+		self.__scrubber = None
+		self.__replica_root = ""
+		self.__replica_kind = Replicator.DIRECTORY
+		self.__replication_interval = Engine.__REPLICATION_INTERVAL
+		self.__replication_throttle = transfer.Throttle()
+		self.__replicator = None
+		self.__aggregation_address = ""
+		self.__aggregation_port = aggregate.DEFAULT_PORT
+		self.__aggregation_name = ""
+		self.__aggregation_throttle = transfer.Throttle()
+		self.__aggregator = None
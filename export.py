@@ -0,0 +1,103 @@
+"""
+/* --------------------------------
+   Snapshot export
+
+ - streams a tar or zip of a snapshot.Snapshot straight from the repository versions
+ - writes on any file object including stdout, holds 1 chunk at a time and makes no temporary copies
+ - entries carry the original mtimes of the versions
+-------------------------------- */
+"""
+import datetime
+import os
+import shutil
+import tarfile
+import time
+import zipfile
+
+import path
+import transfer
+
+
+FORMATS = ("tar", "tgz", "zip")
+
+
+class Exporter:
+	"""
+	archive writer of snapshots
+	"""
+	def __init__(self, format="tar"):
+		if format not in FORMATS:
+			raise ValueError(f"unknown format: {format}")
+		self.__format = format
+		self.__setup()
+	
+	@property
+	def bytes(self):
+		return self.__bytes
+	
+	@property
+	def files(self):
+		return self.__files
+	
+	def export(self, snapshot, fileobj, progress=None):
+		"""
+		writes every item of snapshot under the name of its directory, progress is called with each item
+		"""
+		prefix = path.rstrippath(path.rsplitpath(snapshot.directory)[1]) or "snapshot"
+		directory_length = len(snapshot.directory)
+		if self.__format == "zip":
+			self.__export_zip(snapshot, fileobj, prefix, directory_length, progress)
+		else:
+			self.__export_tar(snapshot, fileobj, prefix, directory_length, progress)
+	
+	__TAR_MODES = {
+		"tar" :	"w|",
+		"tgz" :	"w|gz",
+	}
+	
+	# the oldest time that zip can express
+	__ZIP_EPOCH = datetime.datetime(1980, 1, 1).timestamp()
+	
+	def __export_tar(self, snapshot, fileobj, prefix, directory_length, progress):
+		with tarfile.open(fileobj=fileobj, mode=Exporter.__TAR_MODES[self.__format], bufsize=transfer.CHUNK_SIZE, copybufsize=transfer.CHUNK_SIZE, format=tarfile.PAX_FORMAT) as archive:
+			for item in snapshot:
+				try:
+					source = open(item.repository_file_path, "rb")
+				except OSError:
+					# the version has gone after the index was read
+					continue
+				with source:
+					info = tarfile.TarInfo(prefix + "/" + item.path[directory_length:])
+					info.size = os.fstat(source.fileno()).st_size
+					info.mtime = item.mtime if item.mtime is not None else time.time()
+					info.mode = 0o644
+					archive.addfile(info, source)
+				self.__count(item, info.size, progress)
+	
+	def __export_zip(self, snapshot, fileobj, prefix, directory_length, progress):
+		# zipfile writes data descriptors on unseekable streams, so that stdout works too
+		with zipfile.ZipFile(fileobj, "w", compression=zipfile.ZIP_DEFLATED, allowZip64=True) as archive:
+			for item in snapshot:
+				try:
+					source = open(item.repository_file_path, "rb")
+				except OSError:
+					continue
+				with source:
+					mtime = max(item.mtime if item.mtime is not None else time.time(), Exporter.__ZIP_EPOCH)
+					info = zipfile.ZipInfo(prefix + "/" + item.path[directory_length:], time.localtime(mtime)[:6])
+					info.compress_type = zipfile.ZIP_DEFLATED
+					info.external_attr = 0o644 << 16
+					with archive.open(info, "w", force_zip64=True) as destination:
+						shutil.copyfileobj(source, destination, transfer.CHUNK_SIZE)
+					size = source.tell()
+				self.__count(item, size, progress)
+	
+	def __count(self, item, size, progress):
+		self.__files += 1
+		self.__bytes += size
+		if progress is not None:
+			progress(item)
+	
+	def __setup(self):
+		self.__files = 0
+		self.__bytes = 0
@@ -4,6 +4,7 @@
 
  - there are form definitions that use QUiLoader to load .ui files
  - to keep valid reference direction thought of using PyUic, split widget classes om .ui file (forms -> ui_forms -> widgets)
+ - the status bar of the window follows Application.statusChanged, so that nothing is polled for it
 -------------------------------- */
 """
 
@@ -235,6 +236,10 @@ class Window(QMainWindow):
 			self.__splitter = self.findChild(QSplitter, Window.SPLITTER)
 		return self.__splitter
 	
+	@property
+	def status_panel(self):
+		return self.__status_panel
+	
 	@property
 	def target_pages(self):
 		if self.__target_pages is None:
@@ -366,6 +371,11 @@ class Window(QMainWindow):
 		file_path = self.file_tree.filePath(index)
 		self.add_target_page(file_path)
 	
+	def __on_status_changed(self, status):
+		# a hidden window is brought up to date when shown again
+		if self.isVisible():
+			self.__status_panel.set_status(status)
+	
 	def __setup(self):
 		self.__file_tree = None
 		self.__splitter = None
@@ -390,6 +400,11 @@ class Window(QMainWindow):
 		
 		if self.target_pages.count() == 0:
 			self.target_pages.addPage()
+		
+		self.__status_panel = StatusPanel(self)
+		self.statusBar().addPermanentWidget(self.__status_panel, 1)
+		self.__status_panel.set_status(self.application.status)
+		self.application.statusChanged.connect(self.__on_status_changed)
 	
 	def __setup_file_tree_context_menu(self):
 		self.__file_tree_context_menu = QMenu()
@@ -0,0 +1,143 @@
+"""
+/* --------------------------------
+   Ignore rules
+
+ - gitignore-style patterns compiled into a single matcher
+ - evaluated on relative paths only, so that no syscall is needed
+ - hits of each pattern are counted, and exported as bb_ignore_hits_total
+-------------------------------- */
+"""
+import os
+import re
+
+import metrics
+
+
+_HITS = metrics.REGISTRY.counter("bb_ignore_hits_total", "paths matched by each ignore pattern", ("pattern",))
+
+
+class IgnoreRules:
+	"""
+	gitignore-style path matcher
+	"""
+	def __init__(self, patterns=None):
+		self.__setup(patterns or [])
+	
+	def __bool__(self):
+		return self.__matcher is not None
+	
+	@property
+	def hits(self):
+		"""
+		{pattern : count of paths matched since the last reset_hits}
+		"""
+		return {pattern: count for pattern, count in zip(self.__patterns, self.__hits)}
+	
+	@property
+	def patterns(self):
+		return [*self.__patterns]
+	
+	def match(self, relative_path, is_directory=False):
+		"""
+		relative_path uses "/" or "\\" separators and is relative to the target root
+		"""
+		if self.__matcher is None:
+			return False
+		
+		subject = relative_path.replace("\\", "/").strip("/")
+		if is_directory:
+			subject += "/"
+		
+		m = self.__matcher.fullmatch(subject)
+		if m is None:
+			return False
+		
+		index = self.__group_indices[m.lastindex]
+		self.__hits[index] += 1
+		_HITS.inc(self.__patterns[index])
+		return not self.__negations[index]
+	
+	def reset_hits(self):
+		self.__hits = [0] * len(self.__patterns)
+	
+	@staticmethod
+	def __translate(pattern):
+		"""
+		returns the regular expression body of 1 gitignore line
+		"""
+		is_directory_only = pattern.endswith("/")
+		pattern = pattern.rstrip("/")
+		is_anchored = "/" in pattern
+		pattern = pattern.lstrip("/")
+		
+		ret = "" if is_anchored else "(?:.*/)?"
+		index = 0
+		length = len(pattern)
+		while index < length:
+			letter = pattern[index]
+			if letter == "*":
+				if pattern.startswith("**", index):
+					at_head = index == 0 or pattern[index - 1] == "/"
+					at_tail = index + 2 == length or pattern[index + 2] == "/"
+					if at_head and at_tail:
+						if index + 2 == length:
+							ret += ".*"
+						else:
+							ret += "(?:.*/)?"
+							index += 1
+						index += 2
+						continue
+				ret += "[^/]*"
+			elif letter == "?":
+				ret += "[^/]"
+			elif letter == "[":
+				end = pattern.find("]", index + 2)
+				if end == -1:
+					ret += re.escape(letter)
+				else:
+					body = pattern[index + 1:end]
+					if body.startswith("!"):
+						body = "^" + body[1:]
+					ret += "[" + body.replace("\\", "\\\\") + "]"
+					index = end
+			elif letter == "\\" and index + 1 < length:
+				index += 1
+				ret += re.escape(pattern[index])
+			else:
+				ret += re.escape(letter)
+			index += 1
+		
+		# a matched directory ignores everything below it
+		ret += "/(?:.*)?" if is_directory_only else "(?:/.*)?"
+		return ret
+	
+	def __setup(self, patterns):
+		self.__patterns = []
+		self.__negations = []
+		for line in patterns:
+			line = line.rstrip("\r\n")
+			if not line.startswith("\\ "):
+				line = line.rstrip(" ")
+			if line == "" or line.startswith("#"):
+				continue
+			self.__patterns.append(line)
+		self.reset_hits()
+		
+		self.__matcher = None
+		self.__group_indices = {}
+		if not self.__patterns:
+			return
+		
+		# alternatives are tried from left to right, so reversed order lets the last matching line win
+		alternatives = []
+		for index in reversed(range(len(self.__patterns))):
+			pattern = self.__patterns[index]
+			is_negation = pattern.startswith("!")
+			if is_negation or pattern.startswith("\\!") or pattern.startswith("\\#"):
+				pattern = pattern[1:]
+			self.__negations.insert(0, is_negation)
+			self.__group_indices[len(alternatives) + 1] = index
+			alternatives.append("(" + IgnoreRules.__translate(pattern) + ")")
+		
+		flags = re.IGNORECASE if os.path.normcase("A") == "a" else 0
+		self.__matcher = re.compile("|".join(alternatives), flags)
@@ -0,0 +1,490 @@
+"""
+/* --------------------------------
+   Version index
+
+ - catalog of every version stored in the repository
+ - keeps tombstones of deleted files, so their histories can be listed without walking the repository
+ - opened read only by the command line, that never imports Qt
+ - numbers every change of versions, so that replication resumes from the last sequence it has sent
+-------------------------------- */
+"""
+from collections import namedtuple
+import datetime
+from fnmatch import fnmatchcase
+import os
+import sqlite3
+import threading
+import time
+from urllib.request import pathname2url
+
+import path
+from shard import Shards
+
+
+class VersionIndex:
+	"""
+	sqlite database placed on the repository root
+	"""
+	class Entry(namedtuple("Entry", ("path", "key", "timecode", "reversion_timecode", "is_reversion", "repository_path", "mtime", "size", "hash", "shard"))):
+		"""
+		1 version row, compatible with work.File.Version as far as reading
+		"""
+		@property
+		def timestamp(self):
+			return datetime.datetime.fromtimestamp(self.mtime or 0)
+	
+	class Tombstone(namedtuple("Tombstone", ("path", "deleted"))):
+		"""
+		1 deleted file row
+		"""
+		@property
+		def timestamp(self):
+			return datetime.datetime.fromtimestamp(self.deleted)
+	
+	def __init__(self, repository_root, read_only=False):
+		self.__repository_root = repository_root
+		self.__read_only = read_only
+		self.__setup()
+	
+	FILE_NAME = ".bb.index"
+	
+	@property
+	def file_path(self):
+		return self.__file_path
+	
+	@property
+	def repository_root(self):
+		return self.__repository_root
+	
+	@property
+	def sequence(self):
+		"""
+		sequence of the last change of versions, rows changed later get greater ones
+		"""
+		with self.__lock:
+			try:
+				row = self.__connection.execute("SELECT value FROM counters WHERE name = 'sequence'").fetchone()
+			except sqlite3.OperationalError:
+				# read only index made by an older version
+				row = None
+			if row is None:
+				row = self.__connection.execute("SELECT coalesce(max(sequence), 0) FROM versions").fetchone()
+		return row[0]
+	
+	@property
+	def shards(self):
+		"""
+		shard.Shards that the repository paths of rows are relative to, loaded from the repository root by default
+		"""
+		return self.__shards
+	
+	@shards.setter
+	def shards(self, value):
+		self.__shards = value
+	
+	def bury(self, file_path):
+		with self.__lock:
+			self.__connection.execute("UPDATE files SET deleted = ? WHERE path = ? AND deleted IS NULL", (time.time(), file_path))
+			self.__connection.commit()
+	
+	def bury_directory(self, directory):
+		directory = path.normalize_dir_expression(directory)
+		with self.__lock:
+			self.__connection.execute(f"UPDATE files SET deleted = ? WHERE {VersionIndex.__PREFIX_CONDITION} AND deleted IS NULL", (time.time(), directory, directory + VersionIndex.__PREFIX_END))
+			self.__connection.commit()
+	
+	def close(self):
+		with self.__lock:
+			self.__connection.close()
+	
+	def commit(self):
+		"""
+		commits rows recorded without commits
+		"""
+		with self.__lock:
+			self.__connection.commit()
+	
+	def count_changes(self, after):
+		"""
+		count of versions changed after the sequence
+		"""
+		with self.__lock:
+			row = self.__connection.execute("SELECT count(*) FROM versions WHERE sequence > ?", (after,)).fetchone()
+		return row[0]
+	
+	def find_changes(self, after, limit):
+		"""
+		returns (sequence, Entry) of versions changed after the sequence, in the order of their changes
+		"""
+		with self.__lock:
+			rows = self.__connection.execute(f"SELECT sequence, {VersionIndex.__ENTRY_COLUMNS} FROM versions WHERE sequence > ? ORDER BY sequence LIMIT ?", (after, limit)).fetchall()
+		return [(row[0], self.Entry(*row[1:])) for row in rows]
+	
+	def find_children(self, directory):
+		"""
+		returns paths of the files directly in directory, and names of its subdirectories, both known to the index
+		
+		empty directory means the root, which has drives, or "/" alone on posix
+		"""
+		if directory:
+			directory = path.normalize_dir_expression(directory)
+		with self.__lock:
+			files = [row[0] for row in self.__connection.execute("SELECT path FROM files WHERE directory = ? ORDER BY path", (directory,))]
+			directories = set()
+			start = directory
+			while True:
+				# skips to the next subdirectory on the index, instead of reading every row under directory
+				row = self.__connection.execute("SELECT directory FROM files WHERE directory > ? AND directory < ? ORDER BY directory LIMIT 1", (start, directory + VersionIndex.__PREFIX_END)).fetchone()
+				if row is None:
+					break
+				name = path.lsplitpath(row[0][len(directory):])[0]
+				directories.add(path.rstrippath(name))
+				start = directory + name + VersionIndex.__PREFIX_END
+		return files, sorted(directories)
+	
+	def find_deleted_files(self, directory):
+		directory = path.normalize_dir_expression(directory)
+		with self.__lock:
+			rows = self.__connection.execute("SELECT path, deleted FROM files WHERE directory = ? AND deleted IS NOT NULL ORDER BY path", (directory,)).fetchall()
+		return [self.Tombstone(*row) for row in rows]
+	
+	def find_deleted_files_under(self, directory):
+		"""
+		deleted files of directory and all of its subdirectories
+		"""
+		directory = path.normalize_dir_expression(directory)
+		with self.__lock:
+			rows = self.__connection.execute(f"SELECT path, deleted FROM files WHERE {VersionIndex.__PREFIX_CONDITION} AND deleted IS NOT NULL ORDER BY path", (directory, directory + VersionIndex.__PREFIX_END)).fetchall()
+		return [self.Tombstone(*row) for row in rows]
+	
+	def find_shard(self, file_path):
+		"""
+		returns the shard that holds the versions of file_path, or None for a file without versions
+		"""
+		with self.__lock:
+			row = self.__connection.execute("SELECT shard FROM versions WHERE path = ? LIMIT 1", (file_path,)).fetchone()
+		return row[0] if row else None
+	
+	def find_version_by_hash(self, hash):
+		"""
+		returns any version with the content hash, or None
+		"""
+		with self.__lock:
+			row = self.__connection.execute(f"SELECT {VersionIndex.__ENTRY_COLUMNS} FROM versions WHERE hash = ? LIMIT 1", (hash,)).fetchone()
+		return self.Entry(*row) if row else None
+	
+	def find_versions(self, file_path):
+		with self.__lock:
+			rows = self.__connection.execute(f"SELECT {VersionIndex.__ENTRY_COLUMNS} FROM versions WHERE path = ? ORDER BY key", (file_path,)).fetchall()
+		return [self.Entry(*row) for row in rows]
+	
+	def find_version_at(self, file_path, timecode):
+		"""
+		returns the last version stored until timecode, or None
+		"""
+		with self.__lock:
+			row = self.__connection.execute(f"SELECT {VersionIndex.__ENTRY_COLUMNS} FROM versions WHERE path = ? AND timecode <= ? ORDER BY key DESC LIMIT 1", (file_path, timecode)).fetchone()
+		return self.Entry(*row) if row else None
+	
+	def find_versions_matching(self, pattern):
+		"""
+		yields versions of the paths that match the glob pattern, path by path in order
+		
+		only the range of the literal prefix of pattern is read
+		"""
+		prefix = pattern
+		for letter in "*?[":
+			position = prefix.find(letter)
+			if position != -1:
+				prefix = prefix[:position]
+		
+		if prefix == pattern:
+			for ret in self.find_versions(pattern):
+				yield ret
+			return
+		
+		for ret in self.__iterate_versions(prefix):
+			if fnmatchcase(ret.path, pattern):
+				yield ret
+	
+	def find_versions_to_verify(self, before, limit):
+		"""
+		returns versions never verified or verified before the time, the least recently verified first
+		"""
+		with self.__lock:
+			rows = self.__connection.execute(f"SELECT {VersionIndex.__ENTRY_COLUMNS} FROM versions WHERE verified IS NULL OR verified < ? ORDER BY verified LIMIT ?", (before, limit)).fetchall()
+		return [self.Entry(*row) for row in rows]
+	
+	def find_versions_under(self, directory):
+		"""
+		yields versions of every file under directory, path by path in order
+		"""
+		for ret in self.__iterate_versions(path.normalize_dir_expression(directory)):
+			yield ret
+	
+	def forget(self, file_path, key, commits=True):
+		with self.__lock:
+			self.__connection.execute("DELETE FROM versions WHERE path = ? AND key = ?", (file_path, key))
+			if commits:
+				self.__connection.commit()
+	
+	def is_deleted(self, file_path):
+		with self.__lock:
+			row = self.__connection.execute("SELECT deleted FROM files WHERE path = ?", (file_path,)).fetchone()
+		return row is not None and row[0] is not None
+	
+	def record(self, file_path, version, commits=True):
+		"""
+		adds or replaces the row of version, and revives file_path if it has been deleted
+		
+		without commits, the row is committed by the next commit, e.g. the one of its group
+		"""
+		row = self.__version_row(file_path, version)
+		# a hash taken on the way of the copy verifies it, so that the scrubber does not read it again first
+		verified = time.time() if row[-2] is not None else None
+		with self.__lock:
+			self.__insert_file(file_path, True)
+			self.__connection.execute(f"INSERT OR REPLACE INTO versions ({VersionIndex.__ENTRY_COLUMNS}, verified, sequence) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", row + (verified, self.__next_sequence(1)))
+			if commits:
+				self.__connection.commit()
+	
+	def record_placements(self, placements):
+		"""
+		points rows of (file_path, version) pairs to their moved versions in 1 transaction, hashes and verifications are kept
+		
+		a version with a hash replaces the recorded one
+		"""
+		rows = [self.__version_row(file_path, version) for file_path, version in placements]
+		with self.__lock:
+			for file_path in {row[0] for row in rows}:
+				self.__insert_file(file_path, False)
+			first = self.__next_sequence(len(rows))
+			rows = [row + (first + number,) for number, row in enumerate(rows)]
+			self.__connection.executemany(f"INSERT INTO versions ({VersionIndex.__ENTRY_COLUMNS}, sequence) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+											"ON CONFLICT (path, key) DO UPDATE SET repository_path = excluded.repository_path, shard = excluded.shard, mtime = excluded.mtime, size = excluded.size, "
+											"hash = coalesce(excluded.hash, hash), sequence = excluded.sequence", rows)
+			self.__connection.commit()
+	
+	def register(self, file_path, versions):
+		"""
+		catches up with versions found in the repository, writes nothing when already known
+		"""
+		# only the shards the versions have been found on are caught up, rows of file_path on the others are kept
+		shards = sorted({self.__shards.relativize(version.repository_file_path)[0] for version in versions})
+		condition = f"path = ? AND shard IN ({', '.join('?' * len(shards))})" if shards else "path = ?"
+		with self.__lock:
+			row = self.__connection.execute(f"SELECT count(*) FROM versions WHERE {condition}", (file_path, *shards)).fetchone()
+		if row[0] == len(versions):
+			return
+		
+		rows = [self.__version_row(file_path, version) for version in versions]
+		with self.__lock:
+			# hashes recorded on store outlive the rescan
+			hashes = dict(self.__connection.execute("SELECT key, hash FROM versions WHERE path = ? AND hash IS NOT NULL", (file_path,)).fetchall())
+			first = self.__next_sequence(len(rows))
+			rows = [row[:-2] + (row[-2] or hashes.get(row[1]), row[-1], first + number) for number, row in enumerate(rows)]
+			self.__insert_file(file_path, False)
+			self.__connection.execute(f"DELETE FROM versions WHERE {condition}", (file_path, *shards))
+			self.__connection.executemany(f"INSERT OR REPLACE INTO versions ({VersionIndex.__ENTRY_COLUMNS}, sequence) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+			self.__connection.commit()
+	
+	def relocate(self, file_path, to):
+		"""
+		drops rows of file_path, the moved versions are registered again under to
+		"""
+		with self.__lock:
+			self.__connection.execute("DELETE FROM versions WHERE path = ?", (file_path,))
+			self.__connection.execute("DELETE FROM files WHERE path = ?", (file_path,))
+			self.__connection.commit()
+	
+	def relocate_directory(self, directory, to, repository_directory, repository_to):
+		"""
+		rewrites every row under directory in 1 transaction
+		"""
+		directory = path.normalize_dir_expression(directory)
+		to = path.normalize_dir_expression(to)
+		repository_directory = self.__relativize(path.normalize_dir_expression(repository_directory))
+		repository_to = self.__relativize(path.normalize_dir_expression(repository_to))
+		with self.__lock:
+			# moved rows are changes as well
+			rowids = [row[0] for row in self.__connection.execute(f"SELECT rowid FROM versions WHERE {VersionIndex.__PREFIX_CONDITION}", (directory, directory + VersionIndex.__PREFIX_END))]
+			# the destination keeps its other histories and tombstones, only the same (path, key) is replaced by the moved one
+			self.__connection.execute(f"UPDATE OR REPLACE versions SET path = ? || substr(path, ?), repository_path = ? || substr(repository_path, ?) WHERE {VersionIndex.__PREFIX_CONDITION}",
+										(to, len(directory) + 1, repository_to, len(repository_directory) + 1, directory, directory + VersionIndex.__PREFIX_END))
+			self.__connection.execute(f"UPDATE OR REPLACE files SET path = ? || substr(path, ?), directory = ? || substr(directory, ?) WHERE {VersionIndex.__PREFIX_CONDITION}",
+										(to, len(directory) + 1, to, len(directory) + 1, directory, directory + VersionIndex.__PREFIX_END))
+			first = self.__next_sequence(len(rowids))
+			self.__connection.executemany("UPDATE versions SET sequence = ? WHERE rowid = ?", [(first + number, rowid) for number, rowid in enumerate(rowids)])
+			self.__connection.commit()
+	
+	def relocate_versions(self, file_path, to, versions):
+		"""
+		points rows of versions of file_path to to and their moved contents in 1 transaction, hashes and verifications are kept
+		
+		rows of to, and rows of file_path not in versions, stay as they are
+		"""
+		rows = [self.__version_row(to, version) for version in versions]
+		with self.__lock:
+			self.__insert_file(to, True)
+			first = self.__next_sequence(len(rows))
+			self.__connection.executemany("UPDATE versions SET path = ?, repository_path = ?, shard = ?, sequence = ? WHERE path = ? AND key = ?",
+											[(to, row[5], row[-1], first + number, file_path, row[1]) for number, row in enumerate(rows)])
+			if self.__connection.execute("SELECT count(*) FROM versions WHERE path = ?", (file_path,)).fetchone()[0] == 0:
+				self.__connection.execute("DELETE FROM files WHERE path = ?", (file_path,))
+			self.__connection.commit()
+	
+	def repository_file_path(self, version):
+		"""
+		path of the content of an Entry, on the root of its shard
+		"""
+		# mirrors of posix roots start with separators, which would make the join absolute
+		return os.path.join(self.__shards.root_of(version.shard), path.strip_root(version.repository_path))
+	
+	def revive(self, file_path):
+		with self.__lock:
+			self.__connection.execute("UPDATE files SET deleted = NULL WHERE path = ?", (file_path,))
+			self.__connection.commit()
+	
+	def set_hash(self, file_path, key, hash):
+		with self.__lock:
+			self.__connection.execute("UPDATE versions SET hash = ? WHERE path = ? AND key = ?", (hash, file_path, key))
+			self.__connection.commit()
+	
+	def set_verified(self, rows):
+		"""
+		rows are (time, hash, path, key), hash is None when it has not changed
+		"""
+		with self.__lock:
+			self.__connection.executemany("UPDATE versions SET verified = ?, hash = coalesce(?, hash) WHERE path = ? AND key = ?", rows)
+			self.__connection.commit()
+	
+	def statistics(self):
+		with self.__lock:
+			files, deleted_files = self.__connection.execute("SELECT count(*), count(deleted) FROM files").fetchone()
+			versions, reversions, size = self.__connection.execute("SELECT count(*), total(is_reversion), total(size) FROM versions").fetchone()
+		return {
+			"files" :			files,
+			"deleted_files" :	deleted_files,
+			"versions" :		versions,
+			"reversions" :		int(reversions),
+			"size" :			int(size),
+		}
+	
+	# column, declaration and the value of rows made before it
+	__ADDED_COLUMNS = (
+		("hash",		"TEXT",							"NULL"),
+		("verified",	"REAL",							"NULL"),
+		("shard",		"INTEGER NOT NULL DEFAULT 0",	"0"),
+		("sequence",	"INTEGER",						"rowid"),
+	)
+	
+	__BATCH_SIZE = 1000
+	
+	__ENTRY_COLUMNS = "path, key, timecode, reversion_timecode, is_reversion, repository_path, mtime, size, hash, shard"
+	
+	__PREFIX_CONDITION = "path >= ? AND path < ?"
+	
+	__PREFIX_END = "\uffff"
+	
+	__SCHEMA = """
+		CREATE TABLE IF NOT EXISTS files (
+			path				TEXT PRIMARY KEY,
+			directory			TEXT NOT NULL,
+			deleted				REAL
+		);
+		CREATE INDEX IF NOT EXISTS files_directory ON files (directory);
+		CREATE TABLE IF NOT EXISTS versions (
+			path				TEXT NOT NULL,
+			key					TEXT NOT NULL,
+			timecode			TEXT,
+			reversion_timecode	TEXT,
+			is_reversion		INTEGER NOT NULL DEFAULT 0,
+			repository_path		TEXT NOT NULL,
+			mtime				REAL,
+			size				INTEGER,
+			hash				TEXT,
+			verified			REAL,
+			shard				INTEGER NOT NULL DEFAULT 0,
+			sequence			INTEGER,
+			UNIQUE (path, key)
+		);
+		CREATE TABLE IF NOT EXISTS counters (
+			name				TEXT PRIMARY KEY,
+			value				INTEGER NOT NULL
+		);
+	"""
+	
+	def __insert_file(self, file_path, revives):
+		directory, name = path.rsplitpath(file_path)
+		if revives:
+			self.__connection.execute("INSERT INTO files (path, directory) VALUES (?, ?) ON CONFLICT (path) DO UPDATE SET deleted = NULL", (file_path, directory))
+		else:
+			self.__connection.execute("INSERT OR IGNORE INTO files (path, directory) VALUES (?, ?)", (file_path, directory))
+	
+	def __iterate_versions(self, prefix):
+		# rows are fetched in batches, so that the whole table is never loaded
+		with self.__lock:
+			cursor = self.__connection.execute(f"SELECT {VersionIndex.__ENTRY_COLUMNS} FROM versions WHERE {VersionIndex.__PREFIX_CONDITION} ORDER BY path, key", (prefix, prefix + VersionIndex.__PREFIX_END))
+		while True:
+			with self.__lock:
+				rows = cursor.fetchmany(VersionIndex.__BATCH_SIZE)
+			if not rows:
+				break
+			for row in rows:
+				yield self.Entry(*row)
+	
+	def __next_sequence(self, count):
+		"""
+		takes count sequences and returns the first one, called in the transaction of the rows
+		"""
+		self.__connection.execute("UPDATE counters SET value = value + ? WHERE name = 'sequence'", (count,))
+		return self.__connection.execute("SELECT value FROM counters WHERE name = 'sequence'").fetchone()[0] - count + 1
+	
+	def __relativize(self, file_path):
+		return self.__shards.relativize(file_path)[1]
+	
+	def __setup(self):
+		self.__lock = threading.RLock()
+		self.__shards = Shards.load(self.__repository_root)
+		self.__file_path = os.path.join(self.__repository_root, VersionIndex.FILE_NAME)
+		if self.__read_only:
+			# never creates nor migrates anything
+			uri = "file:" + pathname2url(os.path.abspath(self.__file_path)) + "?mode=ro"
+			self.__connection = sqlite3.connect(uri, uri=True, check_same_thread=False)
+			columns = [row[1] for row in self.__connection.execute("PRAGMA table_info(versions)")]
+			missings = [f"{value} AS {column}" for column, declaration, value in VersionIndex.__ADDED_COLUMNS if column not in columns]
+			if columns and missings:
+				# index made by an older version, shadowed by a view on the temporary schema instead of migrated
+				self.__connection.execute(f"CREATE TEMP VIEW versions AS SELECT *, {', '.join(missings)} FROM main.versions")
+			return
+		
+		os.makedirs(self.__repository_root, exist_ok=True)
+		self.__connection = sqlite3.connect(self.__file_path, check_same_thread=False)
+		self.__connection.execute("PRAGMA journal_mode = WAL")
+		self.__connection.execute("PRAGMA synchronous = NORMAL")
+		self.__connection.executescript(VersionIndex.__SCHEMA)
+		columns = [row[1] for row in self.__connection.execute("PRAGMA table_info(versions)")]
+		for column, declaration, value in VersionIndex.__ADDED_COLUMNS:
+			if column not in columns:
+				# index made by an older version
+				self.__connection.execute(f"ALTER TABLE versions ADD COLUMN {column} {declaration}")
+				if value != "NULL":
+					self.__connection.execute(f"UPDATE versions SET {column} = {value}")
+		self.__connection.execute("CREATE INDEX IF NOT EXISTS versions_verified ON versions (verified)")
+		self.__connection.execute("CREATE INDEX IF NOT EXISTS versions_hash ON versions (hash)")
+		self.__connection.execute("CREATE INDEX IF NOT EXISTS versions_sequence ON versions (sequence)")
+		# sequences never go back, even when the last changed rows are deleted
+		self.__connection.execute("INSERT OR IGNORE INTO counters (name, value) SELECT 'sequence', coalesce(max(sequence), 0) FROM versions")
+		self.__connection.commit()
+	
+	def __version_row(self, file_path, version):
+		mtime = None
+		size = None
+		try:
+			stat = os.stat(version.repository_file_path)
+			mtime = stat.st_mtime
+			size = stat.st_size
+		except OSError:
+			pass
+		shard, repository_path = self.__shards.relativize(version.repository_file_path)
+		return (file_path, version.key, version.timecode, version.reversion_timecode, int(version.is_reversion), repository_path, mtime, size, getattr(version, "hash", None), shard)
@@ -0,0 +1,202 @@
+"""
+/* --------------------------------
+   Write-ahead journal of copies
+
+ - every store and restore is copied to a temporary file beside the destination, synced, and renamed into place at once
+ - syncs follow a durability.Durability, copies with on_durable are renamed later with their group
+ - operations are journaled before they start, so that a crash never leaves a torn version nor a torn working file
+ - recover on startup renames synced copies into place and removes the rest
+ - 1 journal file has 1 writer process, the window of split mode journals to a file of its own
+-------------------------------- */
+"""
+from collections import namedtuple
+import functools
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+
+from durability import Durability
+import metrics
+import transfer
+
+
+TEMPORARY_EXTENSION = ".bb-writing"
+
+_COPIED_BYTES = metrics.REGISTRY.counter("bb_copied_bytes_total", "bytes copied by stores and restores", ("kind",))
+_COPY_SECONDS = metrics.REGISTRY.histogram("bb_copy_seconds", "duration of copies, without their syncs", ("kind",))
+
+
+def is_temporary(file_path):
+	return file_path.endswith(TEMPORARY_EXTENSION)
+
+
+class Journal:
+	"""
+	append-only log of copies in progress
+	"""
+	Operation = namedtuple("Operation", ("id", "kind", "source", "destination", "temporary"))
+	
+	STORE = "store"
+	RESTORE = "restore"
+	
+	def __init__(self, file_path, durability=None):
+		"""
+		durability is a durability.Durability, every copy is synced on its own by default
+		"""
+		self.__file_path = file_path
+		self.__durability = durability or Durability(Durability.FILE)
+		self.__setup()
+	
+	@property
+	def file_path(self):
+		return self.__file_path
+	
+	def close(self):
+		with self.__lock:
+			if self.__file is not None:
+				self.__file.close()
+				self.__file = None
+	
+	def copy(self, kind, source, destination, throttle=None, drops_source_cache=False, drops_destination_cache=False, digest=None, on_durable=None, on_abort=None, on_group=None):
+		"""
+		works like transfer.copy, but destination is replaced only with a complete and synced copy
+		
+		with on_durable, returns as soon as the copy is written, and on_durable is called once it is in place
+		on_abort is called instead when it could not be put in place, on_group once per group as durability.Durability.defer does
+		drops_destination_cache drops the pages of the copy once it has been synced
+		"""
+		drops_destination_cache = drops_destination_cache and transfer.is_dropping_cache(throttle)
+		operation = self.__begin(kind, source, destination)
+		try:
+			started = time.perf_counter()
+			ret = transfer.copy(source, operation.temporary, throttle, drops_source_cache, digest)
+			_COPY_SECONDS.observe(time.perf_counter() - started, kind)
+			_COPIED_BYTES.inc(kind, amount=ret)
+			if on_durable is None:
+				self.__durability.sync(operation.temporary, drops_destination_cache)
+				self.__promote(operation)
+		except BaseException:
+			self.__abort(operation)
+			raise
+		
+		if on_durable is None:
+			self.__end(operation)
+			self.__durability.sync_directory(os.path.dirname(destination))
+		else:
+			self.__durability.defer(operation.temporary, functools.partial(self.__commit, operation, on_durable, on_abort), functools.partial(self.__abort, operation, on_abort), drops_destination_cache, on_group)
+		return ret
+	
+	def recover(self):
+		"""
+		finishes operations interrupted by a crash, returns the operations renamed into place and the ones discarded
+		"""
+		replayed = []
+		discarded = []
+		with self.__lock:
+			for operation, is_ready in self.__read().values():
+				if not os.path.exists(operation.temporary):
+					continue
+				try:
+					if is_ready:
+						os.replace(operation.temporary, operation.destination)
+						replayed.append(operation)
+						logging.info("REPLAYED: %s %s", operation.kind, operation.destination)
+					else:
+						os.remove(operation.temporary)
+						discarded.append(operation)
+						logging.info("DISCARDED: %s %s", operation.kind, operation.destination)
+				except OSError as ex:
+					logging.error("ERROR: %s", ex)
+			self.__truncate()
+		return replayed, discarded
+	
+	__BEGIN = "begin"
+	__READY = "ready"
+	__DONE = "done"
+	
+	# the journal is emptied when it has grown over this and nothing is in progress
+	__TRUNCATE_SIZE = 1024 * 1024
+	
+	def __abort(self, operation, on_abort=None):
+		if os.path.exists(operation.temporary):
+			os.remove(operation.temporary)
+		self.__end(operation)
+		if on_abort is not None:
+			on_abort()
+	
+	def __append(self, record):
+		# called with the lock held
+		if self.__file is None:
+			os.makedirs(os.path.dirname(os.path.abspath(self.__file_path)), exist_ok=True)
+			self.__file = open(self.__file_path, "a", encoding="utf-8")
+		self.__file.write(json.dumps(record) + "\n")
+		# survives a crash of this process, the copies themselves are synced
+		self.__file.flush()
+	
+	def __begin(self, kind, source, destination):
+		operation = self.Operation(f"{os.getpid()}.{next(self.__ids)}", kind, source, destination, destination + TEMPORARY_EXTENSION)
+		# running as soon as its record is written, so that an operation ending meanwhile never truncates it away
+		with self.__lock:
+			self.__append({"state" : Journal.__BEGIN, **operation._asdict()})
+			self.__running.add(operation.id)
+		return operation
+	
+	def __commit(self, operation, on_durable, on_abort):
+		try:
+			self.__promote(operation)
+		except BaseException:
+			self.__abort(operation, on_abort)
+			raise
+		self.__end(operation)
+		on_durable()
+	
+	def __end(self, operation):
+		self.__write({"id" : operation.id, "state" : Journal.__DONE})
+		with self.__lock:
+			self.__running.discard(operation.id)
+			if not self.__running and self.__file is not None and self.__file.tell() >= Journal.__TRUNCATE_SIZE:
+				self.__truncate()
+	
+	def __promote(self, operation):
+		self.__write({"id" : operation.id, "state" : Journal.__READY})
+		os.replace(operation.temporary, operation.destination)
+	
+	def __read(self):
+		ret = {}
+		try:
+			with open(self.__file_path, "r", encoding="utf-8") as file:
+				for line in file:
+					try:
+						record = json.loads(line)
+					except ValueError:
+						# torn last line
+						break
+					state = record.pop("state", None)
+					if state == Journal.__BEGIN:
+						ret[record["id"]] = (self.Operation(**record), False)
+					elif state == Journal.__READY and record["id"] in ret:
+						ret[record["id"]] = (ret[record["id"]][0], True)
+					elif state == Journal.__DONE:
+						ret.pop(record["id"], None)
+		except FileNotFoundError:
+			pass
+		return ret
+	
+	def __truncate(self):
+		if self.__file is not None:
+			self.__file.close()
+		os.makedirs(os.path.dirname(os.path.abspath(self.__file_path)), exist_ok=True)
+		self.__file = open(self.__file_path, "w", encoding="utf-8")
+	
+	def __write(self, record):
+		with self.__lock:
+			self.__append(record)
+	
+	def __setup(self):
+		self.__lock = threading.Lock()
+		self.__file = None
+		self.__running = set()
+		self.__ids = itertools.count(1)
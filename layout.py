@@ -0,0 +1,327 @@
+"""
+/* --------------------------------
+   Repository layouts
+
+ - mirror: versions beside each other in a mirror of the source directory, as the repository has always been
+ - file: 1 subdirectory per file in a mirror of the source directory, under .bb.files
+ - hashed: 1 subdirectory per file fanned out by the hash of its path, under .bb.hashed, so that no directory grows large
+ - the layout of a repository is kept in .bb.layout on its root, Migration converts a repository in place and resumes when interrupted
+-------------------------------- */
+"""
+from collections import namedtuple
+import hashlib
+import json
+import logging
+import os
+import re
+
+import path
+
+
+SUBEXTENSION_REPOSITORY = ".bb"
+
+
+class Layout:
+	"""
+	placement of versions under a repository root
+	"""
+	MIRROR = "mirror"
+	FILE = "file"
+	HASHED = "hashed"
+	
+	NAMES = (MIRROR, FILE, HASHED)
+	
+	FILE_NAME = ".bb.layout"
+	
+	def __init__(self, name=MIRROR, migrating_to=None):
+		if name not in Layout.NAMES:
+			raise ValueError(f"unknown layout: {name}")
+		self.__name = name
+		self.__migrating_to = migrating_to
+	
+	@property
+	def is_per_file(self):
+		return self.__name != Layout.MIRROR
+	
+	@property
+	def is_tree(self):
+		"""
+		source directories are mirrored, so that a single rename moves a whole tree
+		"""
+		return self.__name != Layout.HASHED
+	
+	@property
+	def migrating_to(self):
+		return self.__migrating_to
+	
+	@property
+	def name(self):
+		return self.__name
+	
+	def directory_of(self, repository_root, directory):
+		"""
+		mirror of directory, only tree layouts have it
+		"""
+		return self.namespace(repository_root) + enrepository(path.normalize_dir_expression(directory))
+	
+	def holds(self, repository_path):
+		"""
+		repository_path relative to the repository root is placed by this layout
+		"""
+		repository_path = repository_path.replace("\\", "/")
+		if self.__name == Layout.MIRROR:
+			return not repository_path.startswith(tuple(Layout.__NAMESPACES.values()))
+		return repository_path.startswith(Layout.__NAMESPACES[self.__name])
+	
+	@staticmethod
+	def load(repository_root):
+		try:
+			with open(os.path.join(repository_root, Layout.FILE_NAME), "r", encoding="utf-8") as file:
+				data = json.load(file)
+		except FileNotFoundError:
+			return Layout()
+		return Layout(data["layout"], data.get("migrating_to"))
+	
+	def namespace(self, repository_root):
+		ret = path.normalize_dir_expression(repository_root)
+		if self.__name != Layout.MIRROR:
+			ret += Layout.__NAMESPACES[self.__name]
+		return ret
+	
+	def save(self, repository_root):
+		data = {"layout" : self.__name}
+		if self.__migrating_to is not None:
+			data["migrating_to"] = self.__migrating_to
+		
+		os.makedirs(repository_root, exist_ok=True)
+		file_path = os.path.join(repository_root, Layout.FILE_NAME)
+		with open(file_path + ".tmp", "w", encoding="utf-8") as file:
+			json.dump(data, file)
+		os.replace(file_path + ".tmp", file_path)
+	
+	def version_directory(self, repository_root, file_path):
+		"""
+		directory expression that holds the versions of file_path
+		"""
+		if self.__name == Layout.MIRROR:
+			return self.directory_of(repository_root, path.rsplitpath(file_path)[0])
+		if self.__name == Layout.FILE:
+			directory, name = path.rsplitpath(file_path)
+			return self.directory_of(repository_root, directory) + name + "/"
+		
+		# leading slashes collapse in mirrors as well, so that posix roots hash the same however often they have been normalized
+		digest = hashlib.sha1(file_path.lstrip("/").encode("utf-8")).hexdigest()
+		return self.namespace(repository_root) + f"{digest[:2]}/{digest[2:4]}/{digest}/"
+	
+	__NAMESPACES = {
+		FILE :		".bb.files/",
+		HASHED :	".bb.hashed/",
+	}
+
+
+class Migration:
+	"""
+	in-place conversion of a repository to another layout
+	"""
+	Version = namedtuple("Version", ("key", "repository_file_path", "timecode", "reversion_timecode", "is_reversion"))
+	
+	def __init__(self, repository_root, index, to):
+		"""
+		no other process may store into the repository while it runs
+		"""
+		self.__repository_root = repository_root
+		self.__index = index
+		self.__to = Layout(to)
+		self.__setup()
+	
+	@property
+	def moved(self):
+		return self.__moved
+	
+	def run(self, progress=None):
+		"""
+		moves every version, and returns the count of failures
+		
+		progress is called with the count of moved versions from time to time
+		"""
+		layout = Layout.load(self.__repository_root)
+		if layout.migrating_to is not None and layout.migrating_to != self.__to.name:
+			raise ValueError(f"the interrupted migration to {layout.migrating_to} has to be finished first")
+		if layout.name == self.__to.name:
+			return 0
+		
+		# marked first, so that stores keep the source layout and an interrupted run is resumed
+		self.__source = Layout(layout.name)
+		Layout(layout.name, self.__to.name).save(self.__repository_root)
+		self.__recover()
+		
+		failures = 0
+		for items in (self.__iterate_index(), self.__iterate_tree()):
+			batch = []
+			for item in items:
+				batch.append(item)
+				if len(batch) >= Migration.__BATCH_SIZE:
+					failures += self.__move(batch)
+					batch = []
+					if progress is not None:
+						progress(self.__moved)
+			# moved before walking, so that no version is met twice
+			failures += self.__move(batch)
+		if progress is not None:
+			progress(self.__moved)
+		
+		if failures == 0:
+			self.__to.save(self.__repository_root)
+			self.__remove_empty_directories()
+		return failures
+	
+	__BATCH_FILE_NAME = ".bb.layout.batch"
+	
+	__BATCH_SIZE = 1000
+	
+	__PATTERN = re.compile(r"^(.*)(\.bb\.\d+(?:\.\d+)?)(\.[^.]*)?$")
+	
+	def __iterate_index(self):
+		"""
+		yields (file_path, version) of the indexed versions in the source layout, the index knows their exact paths
+		"""
+		for entry in self.__index.find_versions_matching("*"):
+			if not self.__source.holds(entry.repository_path):
+				continue
+			repository_file_path = self.__index.repository_file_path(entry)
+			if os.path.isfile(repository_file_path):
+				yield entry.path, self.__version(entry.key, repository_file_path)
+	
+	def __iterate_tree(self):
+		"""
+		yields (file_path, version) of the versions the index has not caught up with, only tree layouts tell their paths
+		"""
+		if not self.__source.is_tree:
+			return
+		
+		for root in self.__index.shards.roots:
+			for ret in self.__walk(self.__source.namespace(root)):
+				yield ret
+	
+	def __move(self, batch):
+		if not batch:
+			return 0
+		
+		# written ahead, so that versions moved just before a crash are indexed on resume
+		moves = []
+		for file_path, version in batch:
+			file_name = path.rsplitpath(version.repository_file_path.replace("\\", "/"))[1]
+			# versions stay on their shard
+			root = self.__index.shards.root_of(self.__index.shards.relativize(version.repository_file_path)[0])
+			moves.append((file_path, version, self.__to.version_directory(root, file_path) + file_name))
+		batch_file_path = os.path.join(self.__repository_root, Migration.__BATCH_FILE_NAME)
+		with open(batch_file_path, "w", encoding="utf-8") as file:
+			json.dump([[file_path, *version, destination] for file_path, version, destination in moves], file)
+		
+		failures = 0
+		placements = []
+		for file_path, version, destination in moves:
+			try:
+				os.makedirs(os.path.dirname(destination), exist_ok=True)
+				os.replace(version.repository_file_path, destination)
+			except OSError as ex:
+				logging.error("ERROR: %s", ex)
+				failures += 1
+				continue
+			placements.append((file_path, version._replace(repository_file_path=destination)))
+		
+		self.__index.record_placements(placements)
+		os.remove(batch_file_path)
+		self.__moved += len(placements)
+		return failures
+	
+	def __recover(self):
+		batch_file_path = os.path.join(self.__repository_root, Migration.__BATCH_FILE_NAME)
+		try:
+			with open(batch_file_path, "r", encoding="utf-8") as file:
+				moves = json.load(file)
+		except FileNotFoundError:
+			return
+		except ValueError:
+			# torn before any version was moved
+			os.remove(batch_file_path)
+			return
+		
+		placements = []
+		for file_path, *fields, destination in moves:
+			if os.path.isfile(destination):
+				placements.append((file_path, self.Version(*fields)._replace(repository_file_path=destination)))
+		self.__index.record_placements(placements)
+		os.remove(batch_file_path)
+	
+	def __remove_empty_directories(self):
+		for root in self.__index.shards.roots:
+			namespace = self.__source.namespace(root)
+			for current_directory, directories, file_names in os.walk(namespace, topdown=False):
+				if os.path.normpath(current_directory) == os.path.normpath(root):
+					continue
+				if os.path.relpath(current_directory, namespace).startswith(SUBEXTENSION_REPOSITORY):
+					continue
+				try:
+					os.rmdir(current_directory)
+				except OSError:
+					# still has files of the repository
+					pass
+	
+	def __version(self, key, repository_file_path):
+		sections = key.split(".")
+		return self.Version(key, repository_file_path, sections[2], sections[3] if len(sections) >= 4 else sections[2], len(sections) >= 4)
+	
+	def __walk(self, namespace):
+		for current_directory, directories, file_names in os.walk(namespace):
+			relative_directory = os.path.relpath(current_directory, namespace).replace("\\", "/")
+			if relative_directory == os.curdir:
+				# files of the repository itself, and the namespaces of the other layouts
+				directories[:] = [directory for directory in directories if not directory.startswith(SUBEXTENSION_REPOSITORY)]
+				continue
+			
+			directory = derepository(path.normalize_dir_expression(relative_directory))
+			if not os.path.isabs(directory):
+				# roots of posix paths are mirrored without their slashes
+				directory = "/" + directory
+			for file_name in file_names:
+				m = Migration.__PATTERN.match(file_name)
+				if m is None:
+					continue
+				if self.__source.name == Layout.FILE:
+					file_path = path.normalize(directory)
+				else:
+					file_path = path.normalize(directory + m.group(1) + (m.group(3) or ""))
+				yield file_path, self.__version(m.group(2), path.implode(current_directory, file_name))
+	
+	def __setup(self):
+		self.__source = None
+		self.__moved = 0
+
+
+def derepository(file_path):
+	"""
+	source path of a path mirrored in the repository
+	"""
+	head, tail = path.lsplitpath(file_path)
+	if head.endswith("/"):
+		tail = head[-1] + tail
+		head = head[:-1]
+	if head.startswith("@"):
+		head = head[1:] + ":"
+	ret = head + tail
+	return ret
+
+
+def enrepository(file_path):
+	"""
+	mirrored path of a source path in the repository, drives are mirrored as "@c"
+	"""
+	head, tail = path.lsplitpath(file_path)
+	if head.endswith("/"):
+		tail = head[-1] + tail
+		head = head[:-1]
+	if head.endswith(":"):
+		head = "@" + head[:-1]
+	ret = head + tail
+	return ret
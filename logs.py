@@ -0,0 +1,164 @@
+"""
+/* --------------------------------
+   Logging pipeline
+
+ - a record is only put on a queue by the thread that logs it, 1 listener thread formats and writes it, so that a storm of events never waits for the log file
+ - messages are formatted on the listener, callers pass arguments instead of formatting them, e.g. logging.info("CREATED: %s", file_path)
+ - lines of the same event on the same path are written once per interval, the next line written tells how many have been dropped
+ - the log file is rotated by size, and lines may be json objects for log shippers
+ - imports no Qt
+-------------------------------- */
+"""
+import datetime
+import json
+import logging
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+import queue
+import threading
+import time
+
+import metrics
+
+
+# logger of the lines of file system events, rate limited per path
+EVENTS = "events"
+
+_SUPPRESSED_LINES = metrics.REGISTRY.counter("bb_suppressed_log_lines_total", "event lines dropped by the rate limit of the log")
+
+
+class EventFilter(logging.Filter):
+	"""
+	drops lines of the events logger repeated on the same path within interval seconds
+	"""
+	def __init__(self, interval):
+		super().__init__()
+		self.__interval = interval
+		self.__setup()
+	
+	def filter(self, record):
+		if record.name != EVENTS or not isinstance(record.args, tuple) or not record.args:
+			return True
+		
+		key = (record.msg, record.args[0])
+		now = time.monotonic()
+		with self.__lock:
+			last, suppressed = self.__lines.get(key, (None, 0))
+			if last is not None and now - last < self.__interval:
+				self.__lines[key] = (last, suppressed + 1)
+				_SUPPRESSED_LINES.inc()
+				return False
+			
+			self.__lines[key] = (now, 0)
+			if len(self.__lines) > EventFilter.__MAX_LINES:
+				self.__prune(now)
+		
+		if suppressed:
+			record.msg = f"{record.msg} (%s dropped)"
+			record.args = (*record.args, suppressed)
+		return True
+	
+	# paths remembered at most, older ones are forgotten first
+	__MAX_LINES = 4096
+	
+	def __prune(self, now):
+		# their dropped counts are lost, the lines themselves have been written once
+		for key in [key for key, (last, suppressed) in self.__lines.items() if now - last >= self.__interval]:
+			del self.__lines[key]
+		while len(self.__lines) > EventFilter.__MAX_LINES:
+			del self.__lines[next(iter(self.__lines))]
+	
+	def __setup(self):
+		self.__lock = threading.Lock()
+		self.__lines = {}
+
+
+class JsonFormatter(logging.Formatter):
+	"""
+	1 json object per line
+	"""
+	def format(self, record):
+		data = {
+			"time" :	_format_time(record),
+			"level" :	record.levelname,
+			"logger" :	record.name,
+			"thread" :	record.threadName,
+			"message" :	record.getMessage(),
+		}
+		if record.exc_info:
+			data["exception"] = self.formatException(record.exc_info)
+		return json.dumps(data, ensure_ascii=False)
+
+
+class TextFormatter(logging.Formatter):
+	"""
+	the level, the logger, the time the record was made and the message, as the lines have always been
+	"""
+	def format(self, record):
+		ret = f"{record.levelname}:{record.name}:{_format_time(record)} {record.getMessage()}"
+		if record.exc_info:
+			ret += "\n" + self.formatException(record.exc_info)
+		return ret
+
+
+class LogPipeline:
+	"""
+	queue handler on the root logger, and the listener that writes the log file
+	"""
+	def __init__(self, file_path, max_bytes=0, backup_count=0, is_json=False, event_interval=0.0):
+		"""
+		the log file is rotated at max_bytes with backup_count old files, never with 0
+		"""
+		self.__file_path = file_path
+		self.__max_bytes = max_bytes
+		self.__backup_count = backup_count
+		self.__is_json = is_json
+		self.__event_interval = event_interval
+		self.__setup()
+	
+	@property
+	def file_path(self):
+		return self.__file_path
+	
+	def start(self):
+		if self.__listener is not None:
+			return
+		
+		file_handler = RotatingFileHandler(self.__file_path, maxBytes=self.__max_bytes, backupCount=self.__backup_count, encoding="utf-8", delay=True)
+		file_handler.setFormatter(JsonFormatter() if self.__is_json else TextFormatter())
+		records = queue.SimpleQueue()
+		self.__handler = self.__LazyQueueHandler(records)
+		if self.__event_interval:
+			self.__handler.addFilter(EventFilter(self.__event_interval))
+		self.__listener = QueueListener(records, file_handler)
+		self.__listener.start()
+		
+		root = logging.getLogger()
+		root.addHandler(self.__handler)
+		root.setLevel(logging.INFO)
+	
+	def stop(self):
+		"""
+		writes the records left on the queue, and closes the log file
+		"""
+		if self.__listener is None:
+			return
+		
+		logging.getLogger().removeHandler(self.__handler)
+		self.__listener.stop()
+		for handler in self.__listener.handlers:
+			handler.close()
+		self.__listener = None
+		self.__handler = None
+	
+	class __LazyQueueHandler(QueueHandler):
+		def prepare(self, record):
+			# the listener is in the same process, so that the record is formatted there as it is
+			return record
+	
+	def __setup(self):
+		self.__handler = None
+		self.__listener = None
+
+
+def _format_time(record):
+	return str(datetime.datetime.fromtimestamp(record.created))
@@ -0,0 +1,315 @@
+"""
+/* --------------------------------
+   Metrics registry
+
+ - counters, gauges and histograms of the running process, cheap enough to stay on in the store pipeline
+ - an observation is 1 lock and a few additions, gauges with a function are read only when collected
+ - exported as the text format of Prometheus, to a file written from time to time and by the "metrics" command of protocol
+ - modules take their metrics from REGISTRY at import, imports no Qt
+-------------------------------- */
+"""
+import bisect
+import logging
+import math
+import os
+import threading
+
+
+class Counter:
+	"""
+	count that only goes up, 1 per combination of label values
+	"""
+	KIND = "counter"
+	
+	def __init__(self, name, help, labels=()):
+		self.__name = name
+		self.__help = help
+		self.__labels = tuple(labels)
+		self.__lock = threading.Lock()
+		self.__values = {}
+	
+	@property
+	def help(self):
+		return self.__help
+	
+	@property
+	def labels(self):
+		return self.__labels
+	
+	@property
+	def name(self):
+		return self.__name
+	
+	def collect(self):
+		"""
+		returns {label values : value}
+		"""
+		with self.__lock:
+			return dict(self.__values)
+	
+	def inc(self, *labels, amount=1):
+		with self.__lock:
+			self.__values[labels] = self.__values.get(labels, 0) + amount
+
+
+class Gauge:
+	"""
+	value that goes up and down, set on change or read from function on collect
+	"""
+	KIND = "gauge"
+	
+	def __init__(self, name, help, labels=(), function=None):
+		"""
+		function returns the value, or {label values : value} with labels
+		"""
+		self.__name = name
+		self.__help = help
+		self.__labels = tuple(labels)
+		self.__function = function
+		self.__lock = threading.Lock()
+		self.__values = {}
+	
+	@property
+	def help(self):
+		return self.__help
+	
+	@property
+	def labels(self):
+		return self.__labels
+	
+	@property
+	def name(self):
+		return self.__name
+	
+	def collect(self):
+		if self.__function is not None:
+			value = self.__function()
+			return value if isinstance(value, dict) else {() : value}
+		with self.__lock:
+			return dict(self.__values)
+	
+	def set(self, value, *labels):
+		with self.__lock:
+			self.__values[labels] = value
+
+
+class Histogram:
+	"""
+	counts of observations under each bucket bound, with their sum
+	"""
+	KIND = "histogram"
+	
+	# seconds, from a fast copy to a slow scan
+	DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 60.0, 300.0)
+	
+	def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+		self.__name = name
+		self.__help = help
+		self.__labels = tuple(labels)
+		self.__buckets = tuple(sorted(buckets))
+		self.__lock = threading.Lock()
+		self.__values = {}
+	
+	@property
+	def buckets(self):
+		return self.__buckets
+	
+	@property
+	def help(self):
+		return self.__help
+	
+	@property
+	def labels(self):
+		return self.__labels
+	
+	@property
+	def name(self):
+		return self.__name
+	
+	def collect(self):
+		"""
+		returns {label values : (counts of each bucket and +Inf, not cumulative, sum)}
+		"""
+		with self.__lock:
+			return {labels : ([*counts], total[0]) for labels, (counts, total) in self.__values.items()}
+	
+	def observe(self, value, *labels):
+		position = bisect.bisect_left(self.__buckets, value)
+		with self.__lock:
+			state = self.__values.get(labels)
+			if state is None:
+				state = self.__values[labels] = ([0] * (len(self.__buckets) + 1), [0.0])
+			state[0][position] += 1
+			state[1][0] += value
+
+
+class Registry:
+	"""
+	metrics by name, a metric asked again by the same name is the same one
+	"""
+	def __init__(self):
+		self.__setup()
+	
+	def counter(self, name, help, labels=()):
+		return self.__register(Counter(name, help, labels))
+	
+	def gauge(self, name, help, labels=(), function=None):
+		"""
+		a gauge with function replaces the one of the same name, so that a new owner of the value takes it over
+		"""
+		if function is not None:
+			with self.__lock:
+				self.__metrics.pop(name, None)
+		return self.__register(Gauge(name, help, labels, function))
+	
+	def histogram(self, name, help, labels=(), buckets=Histogram.DEFAULT_BUCKETS):
+		return self.__register(Histogram(name, help, labels, buckets))
+	
+	def render(self):
+		"""
+		text exposition format of Prometheus
+		"""
+		lines = []
+		for metric in self.__iterate():
+			try:
+				values = metric.collect()
+			except Exception as ex:
+				# a gauge whose owner is gone
+				logging.error("ERROR: %s %s", metric.name, ex)
+				continue
+			lines.append(f"# HELP {metric.name} {metric.help}")
+			lines.append(f"# TYPE {metric.name} {metric.KIND}")
+			for labels, value in sorted(values.items()):
+				if value is None:
+					continue
+				pairs = list(zip(metric.labels, labels))
+				if metric.KIND != Histogram.KIND:
+					lines.append(f"{metric.name}{_format_labels(pairs)} {_format_value(value)}")
+					continue
+				counts, total = value
+				cumulative = 0
+				for bound, count in zip((*metric.buckets, math.inf), counts):
+					cumulative += count
+					lines.append(f"{metric.name}_bucket{_format_labels(pairs + [('le', _format_value(bound))])} {cumulative}")
+				lines.append(f"{metric.name}_sum{_format_labels(pairs)} {_format_value(total)}")
+				lines.append(f"{metric.name}_count{_format_labels(pairs)} {cumulative}")
+		return "\n".join(lines) + "\n"
+	
+	def snapshot(self):
+		"""
+		returns values as plain data, {name : value} without labels, {name : {"label=value,..." : value}} with them
+		
+		a histogram is {"count" : ..., "sum" : ...}
+		"""
+		ret = {}
+		for metric in self.__iterate():
+			try:
+				values = metric.collect()
+			except Exception:
+				continue
+			if metric.KIND == Histogram.KIND:
+				values = {labels : {"count" : sum(counts), "sum" : total} for labels, (counts, total) in values.items()}
+			if metric.labels:
+				ret[metric.name] = {",".join(f"{name}={value}" for name, value in zip(metric.labels, labels)) : value for labels, value in values.items()}
+			else:
+				ret[metric.name] = values.get((), 0)
+		return ret
+	
+	def start(self, file_path, interval):
+		"""
+		writes the text format to file_path every interval seconds, for the textfile collector of node_exporter
+		"""
+		if self.__thread is not None:
+			return
+		
+		self.__file_path = file_path
+		self.__interval = interval
+		self.__stop_event.clear()
+		self.__thread = threading.Thread(target=self.__run, name="Metrics", daemon=True)
+		self.__thread.start()
+	
+	def stop(self):
+		if self.__thread is None:
+			return
+		
+		self.__stop_event.set()
+		self.__thread.join()
+		self.__thread = None
+		# the last values are left for the collector
+		self.write(self.__file_path)
+	
+	def write(self, file_path):
+		try:
+			with open(file_path + ".tmp", "w", encoding="utf-8") as file:
+				file.write(self.render())
+			os.replace(file_path + ".tmp", file_path)
+		except OSError as ex:
+			logging.error("ERROR: %s", ex)
+	
+	def __iterate(self):
+		with self.__lock:
+			metrics = list(self.__metrics.values())
+		return sorted(metrics, key=lambda metric: metric.name)
+	
+	def __register(self, metric):
+		with self.__lock:
+			known = self.__metrics.get(metric.name)
+			if known is not None:
+				if known.KIND != metric.KIND:
+					raise ValueError(f"{metric.name} is already a {known.KIND}")
+				return known
+			self.__metrics[metric.name] = metric
+			return metric
+	
+	def __run(self):
+		while not self.__stop_event.wait(self.__interval):
+			self.write(self.__file_path)
+	
+	def __setup(self):
+		self.__lock = threading.Lock()
+		self.__metrics = {}
+		self.__stop_event = threading.Event()
+		self.__thread = None
+		self.__file_path = None
+		self.__interval = None
+
+
+REGISTRY = Registry()
+
+
+def format_bytes(size):
+	"""
+	short text of a size, for the tray icon and the window
+	"""
+	for unit in ("B", "KB", "MB", "GB"):
+		if size < 1024:
+			return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+		size /= 1024
+	return f"{size:.1f} TB"
+
+
+def format_seconds(seconds):
+	"""
+	short text of a duration, for the tray icon and the window
+	"""
+	if seconds < 60:
+		return f"{seconds:.0f} s"
+	if seconds < 60 * 60:
+		return f"{seconds // 60:.0f} min"
+	return f"{seconds / (60 * 60):.1f} h"
+
+
+def _escape(value):
+	return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(pairs):
+	if not pairs:
+		return ""
+	return "{" + ",".join(f"{name}=\"{_escape(value)}\"" for name, value in pairs) + "}"
+
+
+def _format_value(value):
+	if value == math.inf:
+		return "+Inf"
+	return repr(value) if isinstance(value, float) else str(int(value))
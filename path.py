@@ -3,6 +3,9 @@
    File path process utilities
 -------------------------------- */
 """
+import os
+
+
 def explode(file_path):
 	ret = []
 	tail = file_path
@@ -52,6 +55,30 @@ def lsplitpath(file_path):
 	return file_path, ""
 
 
+def normalize(file_path):
+	sections = explode(os.path.normpath(file_path).lower())
+	
+	# the root is collapsed into 1 empty section, 2 of them for UNC, so that normalizing again gives the same path
+	root_count = 0
+	while root_count < len(sections) and not rstrippath(sections[root_count]).strip("/\\"):
+		root_count += 1
+	if root_count:
+		sections[:root_count] = ["", ""] if root_count >= 2 and os.name == "nt" else [""]
+		if len(sections) == 1:
+			return "/"
+	
+	for index in range(len(sections)):
+		sections[index] = rstrippath(sections[index])
+	return "/".join(sections)
+
+
+def strip_root(file_path):
+	"""
+	file_path without its leading separators, to be joined onto another root
+	"""
+	return file_path.lstrip("/\\")
+
+
 def normalize_dir_expression(file_path):
 	ret = file_path
 	if not is_dir_expression(ret):
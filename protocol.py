@@ -0,0 +1,98 @@
+"""
+/* --------------------------------
+   Command/query protocol on the singleton socket
+
+ - every message is 1 json object framed by its 4 bytes big endian length
+ - requests are {"argv" : [...]} from second more launch, or {"commands" : [{"command" : ..., ...}, ...]} as a batch
+ - responses are {"results" : [...]} in the order of the commands, a failed command results {"error" : message}
+ - imports no Qt, so that scripts can query the running process cheaply
+-------------------------------- */
+"""
+import json
+import socket
+import struct
+
+
+DEFAULT_ADDRESS = "127.0.0.1"
+DEFAULT_PORT = 1337
+MAX_MESSAGE_SIZE = 64 * 1024 * 1024
+
+
+class ProtocolError(Exception):
+	pass
+
+
+class Connection:
+	"""
+	persistent client connection, sends batches of commands and waits for their results
+	"""
+	def __init__(self, address=DEFAULT_ADDRESS, port=DEFAULT_PORT, timeout=30.0):
+		self.__socket = socket.create_connection((address, port), timeout)
+	
+	def __enter__(self):
+		return self
+	
+	def __exit__(self, ex_type, ex_value, trace):
+		self.close()
+	
+	def close(self):
+		if self.__socket is not None:
+			self.__socket.close()
+			self.__socket = None
+	
+	def request(self, commands):
+		"""
+		returns the results of commands, which is a list of dict or a dict of 1 command
+		"""
+		is_single = isinstance(commands, dict)
+		send(self.__socket, {"commands" : [commands] if is_single else list(commands)})
+		response = receive(self.__socket)
+		if response is None:
+			raise ProtocolError("connection closed")
+		if "error" in response:
+			raise ProtocolError(response["error"])
+		results = response.get("results", [])
+		return results[0] if is_single else results
+
+
+def receive(sock):
+	"""
+	returns None when the peer has closed the connection
+	"""
+	header = _receive_exactly(sock, _HEADER.size)
+	if header is None:
+		return None
+	
+	size, = _HEADER.unpack(header)
+	if size > MAX_MESSAGE_SIZE:
+		raise ProtocolError(f"too large message: {size} bytes")
+	payload = _receive_exactly(sock, size)
+	if payload is None:
+		raise ProtocolError("connection closed in the middle of a message")
+	return json.loads(payload)
+
+
+def request(commands, address=DEFAULT_ADDRESS, port=DEFAULT_PORT, timeout=30.0):
+	with Connection(address, port, timeout) as connection:
+		return connection.request(commands)
+
+
+def send(sock, message):
+	payload = json.dumps(message).encode()
+	sock.sendall(_HEADER.pack(len(payload)) + payload)
+
+
+_HEADER = struct.Struct(">I")
+
+
+def _receive_exactly(sock, size):
+	chunks = []
+	while size:
+		chunk = sock.recv(min(size, 1024 * 1024))
+		if not chunk:
+			if chunks:
+				raise ProtocolError("connection closed in the middle of a message")
+			return None
+		chunks.append(chunk)
+		size -= len(chunk)
+	return b"".join(chunks)
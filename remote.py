@@ -0,0 +1,220 @@
+"""
+/* --------------------------------
+   Engine worker process link
+
+ - WorkerProcess runs in the GUI process, launches the headless engine as a worker and sends it commands
+ - CommandReceiver runs in the worker process, and hands the commands over to the event loop
+ - commands go over multiprocessing.connection, live status comes back on channel.StatusChannel
+-------------------------------- */
+"""
+import logging
+from multiprocessing.connection import Client, Listener
+import os
+import secrets
+import subprocess
+import sys
+import threading
+import time
+
+from PySide6.QtCore import QObject, QTimer, Signal
+
+from channel import StatusChannel
+
+
+AUTHKEY_ENVIRONMENT = "BACKUP_BREADCRUMB_AUTHKEY"
+
+
+class WorkerProcess(QObject):
+	"""
+	the worker process seen from the GUI process
+	"""
+	def __init__(self, engine, parent=None):
+		"""
+		engine is the passive engine.Engine of the GUI process, its targets are mirrored to the worker
+		"""
+		super().__init__(parent)
+		self.__engine = engine
+		self.__setup()
+	
+	statusReceived = Signal(dict)
+	
+	@property
+	def channel(self):
+		return self.__channel
+	
+	@property
+	def is_connected(self):
+		with self.__lock:
+			return self.__connection is not None
+	
+	def send(self, command):
+		with self.__lock:
+			if self.__connection is None:
+				self.__commands.append(command)
+				return
+			try:
+				self.__connection.send(command)
+			except OSError as ex:
+				logging.error("ERROR: %s", ex)
+	
+	def start(self):
+		self.__channel = StatusChannel()
+		self.__authkey = secrets.token_bytes(32)
+		self.__listener = Listener(authkey=self.__authkey)
+		self.__is_stopping = False
+		self.__launch()
+		
+		self.__engine.fileRestored.connect(self.__on_file_restored)
+		self.__engine.targetsChanged.connect(self.__sync_timer.start)
+		self.__poll_timer.start()
+	
+	def stop(self, timeout=30):
+		self.__is_stopping = True
+		self.__poll_timer.stop()
+		self.__sync_timer.stop()
+		self.__sync()
+		self.send({"command" : "stop"})
+		
+		if self.__process is not None:
+			try:
+				self.__process.wait(timeout)
+			except subprocess.TimeoutExpired:
+				logging.error("ERROR: worker did not stop in %s seconds", timeout)
+				self.__process.kill()
+			self.__process = None
+		
+		with self.__lock:
+			if self.__connection is not None:
+				self.__connection.close()
+				self.__connection = None
+		self.__listener.close()
+		self.__poll()
+		self.__channel.close()
+	
+	__RELAUNCH_INTERVAL = 10.0
+	
+	def __accept(self):
+		try:
+			connection = self.__listener.accept()
+		except Exception as ex:
+			if not self.__is_stopping:
+				logging.error("ERROR: %s", ex)
+			return
+		
+		with self.__lock:
+			# the worker starts from the targets file, so that the current targets go first
+			commands = [{"command" : "sync", "targets" : self.__engine.serialize()}] + self.__commands
+			self.__commands = []
+			try:
+				for command in commands:
+					connection.send(command)
+			except OSError as ex:
+				logging.error("ERROR: %s", ex)
+			self.__connection = connection
+	
+	@staticmethod
+	def __command_line():
+		ret = [sys.executable]
+		if not getattr(sys, "frozen", False):
+			ret.append(os.path.abspath(sys.argv[0]))
+		return ret
+	
+	def __launch(self):
+		with self.__lock:
+			if self.__connection is not None:
+				self.__connection.close()
+				self.__connection = None
+		
+		args = self.__command_line() + ["--worker", self.__listener.address, "--status", self.__channel.name]
+		env = dict(os.environ)
+		env[AUTHKEY_ENVIRONMENT] = self.__authkey.hex()
+		creationflags = subprocess.CREATE_NO_WINDOW if os.name == "nt" else 0
+		self.__process = subprocess.Popen(args, env=env, creationflags=creationflags)
+		self.__launched_time = time.time()
+		logging.info("WORKER: %s", self.__process.pid)
+		
+		thread = threading.Thread(target=self.__accept, name="WorkerProcess", daemon=True)
+		thread.start()
+	
+	def __on_file_restored(self, file_path):
+		# versions of the worker are stale now
+		self.send({"command" : "expire", "path" : file_path})
+	
+	def __poll(self):
+		for record in self.__channel.read():
+			if record.get("event") == "stored":
+				self.__engine.expire(record.get("path"))
+			self.statusReceived.emit(record)
+		
+		if self.__is_stopping or self.__process is None:
+			return
+		if self.__process.poll() is not None:
+			logging.error("ERROR: worker exited with %s", self.__process.returncode)
+			if time.time() - self.__launched_time < self.__RELAUNCH_INTERVAL:
+				# it fails on startup, so that relaunching never helps
+				self.__process = None
+				return
+			self.__engine.expire()
+			self.__launch()
+	
+	def __setup(self):
+		self.__lock = threading.Lock()
+		self.__channel = None
+		self.__authkey = None
+		self.__listener = None
+		self.__process = None
+		self.__launched_time = 0.0
+		self.__connection = None
+		self.__commands = []
+		self.__is_stopping = False
+		
+		self.__poll_timer = QTimer(self)
+		self.__poll_timer.setInterval(250)
+		self.__poll_timer.timeout.connect(self.__poll)
+		
+		# bursts of target edits go to the worker at once
+		self.__sync_timer = QTimer(self)
+		self.__sync_timer.setSingleShot(True)
+		self.__sync_timer.setInterval(200)
+		self.__sync_timer.timeout.connect(self.__sync)
+	
+	def __sync(self):
+		self.send({"command" : "sync", "targets" : self.__engine.serialize()})
+
+
+class CommandReceiver(QObject):
+	"""
+	the GUI process seen from the worker process
+	"""
+	def __init__(self, address, parent=None):
+		super().__init__(parent)
+		self.__address = address
+		self.__setup()
+	
+	# emitted on the event loop thread, "closed" command is emitted when the GUI process has gone
+	commandReceived = Signal(dict)
+	
+	def start(self):
+		authkey = bytes.fromhex(os.environ.get(AUTHKEY_ENVIRONMENT, ""))
+		self.__connection = Client(self.__address, authkey=authkey)
+		self.__thread = threading.Thread(target=self.__receive, name="CommandReceiver", daemon=True)
+		self.__thread.start()
+	
+	def stop(self):
+		if self.__connection is not None:
+			self.__connection.close()
+			self.__connection = None
+	
+	def __receive(self):
+		connection = self.__connection
+		while True:
+			try:
+				command = connection.recv()
+			except (EOFError, OSError):
+				self.commandReceived.emit({"command" : "closed"})
+				return
+			self.commandReceived.emit(command)
+	
+	def __setup(self):
+		self.__connection = None
+		self.__thread = None
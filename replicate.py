@@ -0,0 +1,405 @@
+"""
+/* --------------------------------
+   Repository replication
+
+ - streams new versions to a secondary store in the background, so that a failed disk of the repository loses nothing stored before the last batch
+ - DirectoryReplica is another repository on a second path, with its own index, so that the command line and browsing read it as it is
+ - ObjectReplica stands in for an object store, contents are put once under their hashes and described by manifests of batches
+ - hashes of a batch are offered first, and only the contents the replica wants follow
+ - the sequence of the last sent change is kept on the replica, so that replication resumes after a restart, and a new replica starts over
+-------------------------------- */
+"""
+import abc
+from collections import namedtuple
+import json
+import logging
+import os
+import threading
+import time
+
+from durability import Durability
+from index import VersionIndex
+import journal
+import path
+import transfer
+
+
+class Replica(abc.ABC):
+	"""
+	secondary store, keeps the cursor of replication
+	"""
+	def __init__(self, root, durability=None):
+		self.__root = root
+		self.__durability = durability or Durability(Durability.FILE)
+	
+	def __str__(self):
+		return self.__root
+	
+	CURSOR_FILE_NAME = ".bb.replication"
+	
+	@property
+	def durability(self):
+		return self.__durability
+	
+	@property
+	def root(self):
+		return self.__root
+	
+	def close(self):
+		pass
+	
+	@abc.abstractmethod
+	def commit(self, entries, sequence):
+		"""
+		records entries sent up to sequence, after their contents have been put or placed
+		"""
+		pass
+	
+	def load_cursor(self, source):
+		"""
+		returns the sequence sent last from the repository root source, 0 for another source
+		"""
+		os.makedirs(self.__root, exist_ok=True)
+		try:
+			with open(os.path.join(self.__root, Replica.CURSOR_FILE_NAME), "r", encoding="utf-8") as file:
+				data = json.load(file)
+		except FileNotFoundError:
+			return 0
+		if data.get("source") != source:
+			return 0
+		return data["sequence"]
+	
+	@abc.abstractmethod
+	def place(self, entry):
+		"""
+		makes entry refer to the content the replica already has
+		"""
+		pass
+	
+	@abc.abstractmethod
+	def put(self, entry, source_file_path, throttle=None):
+		"""
+		copies the content of entry
+		"""
+		pass
+	
+	def save_cursor(self, source, sequence):
+		file_path = os.path.join(self.__root, Replica.CURSOR_FILE_NAME)
+		with open(file_path + ".tmp", "w", encoding="utf-8") as file:
+			json.dump({"source" : source, "sequence" : sequence}, file)
+		os.replace(file_path + ".tmp", file_path)
+	
+	@abc.abstractmethod
+	def want(self, hashes):
+		"""
+		returns the hashes of contents the replica does not have
+		"""
+		pass
+	
+	def _write(self, source_file_path, destination, throttle=None):
+		"""
+		copies beside destination, syncs, and renames into place, so that a content on the replica is never torn
+		"""
+		os.makedirs(os.path.dirname(destination), exist_ok=True)
+		temporary_file_path = destination + journal.TEMPORARY_EXTENSION
+		try:
+			ret = transfer.copy(source_file_path, temporary_file_path, throttle, drops_source_cache=True)
+			self.__durability.sync(temporary_file_path, transfer.is_dropping_cache(throttle))
+			os.replace(temporary_file_path, destination)
+		except BaseException:
+			if os.path.exists(temporary_file_path):
+				os.remove(temporary_file_path)
+			raise
+		return ret
+
+
+class DirectoryReplica(Replica):
+	"""
+	another repository, versions keep their repository paths on a single root
+	"""
+	Version = namedtuple("Version", ("key", "repository_file_path", "timecode", "reversion_timecode", "is_reversion", "hash"))
+	
+	def __init__(self, root, durability=None):
+		super().__init__(root, durability)
+		self.__setup()
+	
+	@property
+	def index(self):
+		if self.__index is None:
+			self.__index = VersionIndex(self.root)
+		return self.__index
+	
+	def close(self):
+		if self.__index is not None:
+			self.__index.close()
+			self.__index = None
+	
+	def commit(self, entries, sequence):
+		placements = []
+		for entry in entries:
+			version = self.Version(entry.key, self.__file_path_of(entry), entry.timecode, entry.reversion_timecode, entry.is_reversion, entry.hash)
+			placements.append((entry.path, version))
+		self.index.record_placements(placements)
+		self.__written.clear()
+	
+	def place(self, entry):
+		destination = self.__file_path_of(entry)
+		original_file_path = self.__written.get(entry.hash)
+		if original_file_path is None:
+			original_file_path = self.index.repository_file_path(self.index.find_version_by_hash(entry.hash))
+		if os.path.normcase(os.path.abspath(original_file_path)) == os.path.normcase(os.path.abspath(destination)):
+			return
+		
+		os.makedirs(os.path.dirname(destination), exist_ok=True)
+		temporary_file_path = destination + journal.TEMPORARY_EXTENSION
+		try:
+			os.link(original_file_path, temporary_file_path)
+			os.replace(temporary_file_path, destination)
+		except OSError:
+			# out of links, or a filesystem without them, so that the content is copied on the replica itself
+			if os.path.exists(temporary_file_path):
+				os.remove(temporary_file_path)
+			self._write(original_file_path, destination)
+	
+	def put(self, entry, source_file_path, throttle=None):
+		destination = self.__file_path_of(entry)
+		ret = self._write(source_file_path, destination, throttle)
+		self.__written[entry.hash] = destination
+		return ret
+	
+	def want(self, hashes):
+		return {hash for hash in hashes if hash not in self.__written and self.index.find_version_by_hash(hash) is None}
+	
+	def __file_path_of(self, entry):
+		# mirrors of posix roots start with separators, which would make the join absolute
+		return os.path.join(self.root, path.strip_root(entry.repository_path))
+	
+	def __setup(self):
+		self.__index = None
+		# contents put in the current batch, not indexed yet
+		self.__written = {}
+
+
+class ObjectReplica(Replica):
+	"""
+	stand-in of an object store, objects are put once and never renamed nor modified
+	"""
+	def __init__(self, root, durability=None, objects_root=None):
+		"""
+		objects are kept under objects_root, so that replicas of several sources share them, under root by default
+		"""
+		super().__init__(root, durability)
+		self.__objects_root = objects_root or root
+	
+	def commit(self, entries, sequence):
+		directory = os.path.join(self.root, ObjectReplica.__MANIFESTS)
+		os.makedirs(directory, exist_ok=True)
+		file_path = os.path.join(directory, f"{sequence:016d}.json")
+		with open(file_path + ".tmp", "w", encoding="utf-8") as file:
+			json.dump([entry._asdict() for entry in entries], file)
+		self.durability.sync(file_path + ".tmp")
+		os.replace(file_path + ".tmp", file_path)
+	
+	def object_path(self, hash):
+		return os.path.join(self.__objects_root, ObjectReplica.__OBJECTS, hash[:2], hash)
+	
+	def place(self, entry):
+		# objects are found by their hashes, so that nothing is to be done
+		pass
+	
+	def put(self, entry, source_file_path, throttle=None):
+		return self._write(source_file_path, self.object_path(entry.hash), throttle)
+	
+	def want(self, hashes):
+		return {hash for hash in hashes if not os.path.isfile(self.object_path(hash))}
+	
+	__MANIFESTS = "manifests"
+	
+	__OBJECTS = "objects"
+
+
+class Replicator:
+	"""
+	background sender of new versions to a replica
+	"""
+	DIRECTORY = "directory"
+	OBJECTS = "objects"
+	
+	KINDS = (DIRECTORY, OBJECTS)
+	
+	def __init__(self, index, replica, throttle=None, batch_size=256):
+		"""
+		replica is a DirectoryReplica, an ObjectReplica or any object with their methods, versions are sent batch_size at a time
+		"""
+		self.__index = index
+		self.__replica = replica
+		self.__throttle = throttle
+		self.__batch_size = batch_size
+		self.__setup()
+	
+	@property
+	def metrics(self):
+		"""
+		counts of sent versions, and the lag as versions not sent yet and seconds since the oldest of them appeared
+		"""
+		with self.__lock:
+			ret = dict(self.__counts)
+			cursor = self.__cursor
+			pending_since = self.__pending_since
+		ret["cursor"] = cursor
+		ret["lag"] = self.__index.count_changes(cursor) if cursor is not None else None
+		ret["lag_seconds"] = time.time() - pending_since if pending_since is not None and ret["lag"] else 0.0
+		return ret
+	
+	@staticmethod
+	def open_replica(kind, root, durability=None):
+		if kind == Replicator.DIRECTORY:
+			return DirectoryReplica(root, durability)
+		if kind == Replicator.OBJECTS:
+			return ObjectReplica(root, durability)
+		raise ValueError(f"unknown replica: {kind}")
+	
+	def replicate(self, progress=None):
+		"""
+		sends batches until the replica has caught up, returns the count of sent versions
+		
+		progress is called with the count of sent versions after each batch
+		"""
+		source = os.path.abspath(self.__index.repository_root)
+		with self.__lock:
+			if self.__cursor is None:
+				self.__cursor = self.__replica.load_cursor(source)
+				if self.__cursor > self.__index.sequence:
+					# the index has been made again, and every version is offered again
+					self.__cursor = 0
+			cursor = self.__cursor
+		
+		ret = 0
+		while not self.__stop_event.is_set():
+			changes = self.__index.find_changes(cursor, self.__batch_size)
+			if not changes:
+				with self.__lock:
+					self.__pending_since = None
+				break
+			with self.__lock:
+				if self.__pending_since is None:
+					self.__pending_since = time.time()
+			
+			entries = self.__send([entry for sequence, entry in changes])
+			cursor = changes[-1][0]
+			self.__replica.commit(entries, cursor)
+			self.__replica.save_cursor(source, cursor)
+			with self.__lock:
+				self.__cursor = cursor
+				self.__counts["versions"] += len(entries)
+			
+			ret += len(entries)
+			if progress is not None:
+				progress(ret)
+		return ret
+	
+	def start(self, interval):
+		"""
+		looks for new versions every interval seconds, and soon after wake
+		"""
+		if self.__thread is not None:
+			return
+		
+		self.__interval = interval
+		self.__stop_event.clear()
+		self.__thread = threading.Thread(target=self.__run, name="Replicator", daemon=True)
+		self.__thread.start()
+	
+	def stop(self):
+		if self.__thread is None:
+			return
+		
+		self.__stop_event.set()
+		self.__wake_event.set()
+		self.__thread.join()
+		self.__thread = None
+		self.__replica.close()
+	
+	def wake(self):
+		"""
+		tells that a version has been stored, called from any thread
+		"""
+		with self.__lock:
+			if self.__pending_since is None:
+				self.__pending_since = time.time()
+		self.__wake_event.set()
+	
+	# seconds after a wake to gather stores of the same burst into 1 batch
+	__GATHERING = 1.0
+	
+	# seconds to wait after a failure, so that an unplugged replica is not hammered
+	__RETRY_WAIT = 60.0
+	
+	def __is_forgotten(self, entry):
+		# a content missing while its version is still indexed fails the batch, so that the cursor never passes it
+		return all(version.key != entry.key for version in self.__index.find_versions(entry.path))
+	
+	def __run(self):
+		while not self.__stop_event.is_set():
+			try:
+				self.replicate()
+			except Exception as ex:
+				logging.error("ERROR: replication to %s %s", self.__replica, ex)
+				with self.__lock:
+					self.__counts["failures"] += 1
+				self.__stop_event.wait(Replicator.__RETRY_WAIT)
+				continue
+			
+			if self.__wake_event.wait(self.__interval):
+				self.__stop_event.wait(Replicator.__GATHERING)
+			self.__wake_event.clear()
+	
+	def __send(self, entries):
+		"""
+		offers the hashes of entries, and puts the wanted contents, returns the entries sent
+		"""
+		hashed = []
+		for entry in entries:
+			if entry.hash is None:
+				# registered from a rescan, hashed once here and kept on the index
+				try:
+					hash = transfer.hash_file(self.__index.repository_file_path(entry))
+				except FileNotFoundError:
+					if not self.__is_forgotten(entry):
+						raise
+					continue
+				self.__index.set_hash(entry.path, entry.key, hash)
+				entry = entry._replace(hash=hash)
+			hashed.append(entry)
+		
+		wanted = self.__replica.want({entry.hash for entry in hashed})
+		ret = []
+		for entry in hashed:
+			source_file_path = self.__index.repository_file_path(entry)
+			if entry.hash in wanted:
+				try:
+					size = self.__replica.put(entry, source_file_path, self.__throttle)
+				except FileNotFoundError:
+					if not self.__is_forgotten(entry):
+						raise
+					continue
+				wanted.discard(entry.hash)
+				with self.__lock:
+					self.__counts["uploaded"] += 1
+					self.__counts["bytes"] += size
+			else:
+				self.__replica.place(entry)
+				with self.__lock:
+					self.__counts["deduplicated"] += 1
+			ret.append(entry)
+		return ret
+	
+	def __setup(self):
+		self.__lock = threading.Lock()
+		self.__counts = {"versions" : 0, "uploaded" : 0, "deduplicated" : 0, "bytes" : 0, "failures" : 0}
+		self.__cursor = None
+		self.__pending_since = None
+		self.__stop_event = threading.Event()
+		self.__wake_event = threading.Event()
+		self.__thread = None
+		self.__interval = None
@@ -0,0 +1,191 @@
+"""
+/* --------------------------------
+   Retry queue
+
+ - keeps stores that failed on locked files and retries them later with exponential backoff
+ - persisted as json, so that pending retries survive restart
+-------------------------------- */
+"""
+import errno
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+
+class RetryQueue:
+	"""
+	persistent retry schedule of failed stores
+	"""
+	def __init__(self, handler, pool, file_path=None, max_attempts=5, base_delay=1.0, max_delay=300.0):
+		"""
+		handler is called on the pool with a file path and returns True on success
+		"""
+		self.__handler = handler
+		self.__pool = pool
+		self.__file_path = file_path
+		self.__max_attempts = max_attempts
+		self.__base_delay = base_delay
+		self.__max_delay = max_delay
+		self.__setup()
+	
+	def __len__(self):
+		with self.__condition:
+			return len(self.__entries)
+	
+	@property
+	def metrics(self):
+		with self.__condition:
+			finished = self.__succeeded + self.__failed
+			return {
+				"pending" :			len(self.__entries),
+				"retried" :			self.__retried,
+				"succeeded" :		self.__succeeded,
+				"failed" :			self.__failed,
+				"success_rate" :	self.__succeeded / finished if finished else None,
+			}
+	
+	@staticmethod
+	def is_transient(error):
+		"""
+		sharing violations and permission errors usually pass once the other process releases the file
+		"""
+		if isinstance(error, PermissionError):
+			return True
+		if getattr(error, "winerror", None) in RetryQueue.__TRANSIENT_WINERRORS:
+			return True
+		return isinstance(error, OSError) and error.errno in RetryQueue.__TRANSIENT_ERRNOS
+	
+	def push(self, file_path, error):
+		if not RetryQueue.is_transient(error):
+			with self.__condition:
+				self.__failed += 1
+			return False
+		
+		with self.__condition:
+			entry = self.__entries.get(file_path)
+			if entry is None:
+				entry = {"attempts" : 0, "due" : None, "error" : None}
+				self.__entries[file_path] = entry
+			entry["error"] = str(error)
+			if entry["due"] is None and file_path not in self.__running:
+				entry["due"] = time.time() + self.__delay(entry["attempts"])
+			self.__save()
+			self.__condition.notify()
+		return True
+	
+	def start(self):
+		if self.__thread is not None:
+			return
+		
+		self.__load()
+		self.__is_running = True
+		self.__thread = threading.Thread(target=self.__run, name="RetryQueue", daemon=True)
+		self.__thread.start()
+	
+	def stop(self):
+		if self.__thread is None:
+			return
+		
+		with self.__condition:
+			self.__is_running = False
+			self.__condition.notify()
+		self.__thread.join()
+		self.__thread = None
+		
+		with self.__condition:
+			self.__save()
+	
+	__TRANSIENT_ERRNOS = (errno.EACCES, errno.EAGAIN, errno.EBUSY, getattr(errno, "ETXTBSY", errno.EBUSY))
+	
+	# ERROR_SHARING_VIOLATION, ERROR_LOCK_VIOLATION
+	__TRANSIENT_WINERRORS = (32, 33)
+	
+	def __delay(self, attempts):
+		ret = min(self.__base_delay * (2 ** attempts), self.__max_delay)
+		return ret * random.uniform(0.5, 1.0)
+	
+	def __execute(self, file_path):
+		try:
+			is_succeeded = self.__handler(file_path)
+		except Exception as ex:
+			logging.error("ERROR: %s", ex)
+			is_succeeded = False
+		
+		with self.__condition:
+			self.__running.discard(file_path)
+			entry = self.__entries.get(file_path)
+			if entry is None:
+				return
+			
+			entry["attempts"] += 1
+			if is_succeeded:
+				del self.__entries[file_path]
+				self.__succeeded += 1
+			elif entry["attempts"] >= self.__max_attempts:
+				del self.__entries[file_path]
+				self.__failed += 1
+				logging.error("GIVE_UP: %s (%s)", file_path, entry['error'])
+			else:
+				entry["due"] = time.time() + self.__delay(entry["attempts"])
+			self.__save()
+			self.__condition.notify()
+	
+	def __load(self):
+		if not self.__file_path or not os.path.isfile(self.__file_path):
+			return
+		
+		try:
+			with open(self.__file_path, "r") as file:
+				data = json.load(file)
+		except Exception as ex:
+			logging.error("ERROR: %s", ex)
+			return
+		
+		now = time.time()
+		with self.__condition:
+			for file_path, entry in data.items():
+				entry["due"] = max(entry.get("due") or now, now)
+				self.__entries[file_path] = entry
+	
+	def __run(self):
+		with self.__condition:
+			while self.__is_running:
+				now = time.time()
+				timeout = None
+				for file_path, entry in self.__entries.items():
+					due = entry["due"]
+					if due is None:
+						continue
+					if due <= now:
+						entry["due"] = None
+						self.__running.add(file_path)
+						self.__retried += 1
+						self.__pool.submit(self.__execute, file_path)
+					elif timeout is None or due - now < timeout:
+						timeout = due - now
+				self.__condition.wait(timeout)
+	
+	def __save(self):
+		if not self.__file_path:
+			return
+		
+		temporary_file_path = self.__file_path + ".tmp"
+		try:
+			with open(temporary_file_path, "w") as file:
+				json.dump(self.__entries, file, indent=2)
+			os.replace(temporary_file_path, self.__file_path)
+		except Exception as ex:
+			logging.error("ERROR: %s", ex)
+	
+	def __setup(self):
+		self.__condition = threading.Condition()
+		self.__entries = {}
+		self.__running = set()
+		self.__thread = None
+		self.__is_running = False
+		self.__retried = 0
+		self.__succeeded = 0
+		self.__failed = 0
@@ -0,0 +1,190 @@
+"""
+/* --------------------------------
+   Repository scrubber
+
+ - verifies versions in the repository against the sha256 recorded on store, so that bit rot and torn copies are found before restore
+ - hashes on a process pool, and paces reads with a transfer.Throttle as an i/o budget
+ - runs incrementally in the background, the least recently verified versions first, or all at once from the command line
+-------------------------------- */
+"""
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import logging
+import os
+import signal
+import threading
+import time
+
+import transfer
+
+
+class Scrubber:
+	"""
+	verifier of repository versions
+	"""
+	Result = namedtuple("Result", ("version", "status", "hash"))
+	
+	OK = "ok"
+	RECORDED = "recorded"
+	CORRUPT = "corrupt"
+	MISSING = "missing"
+	UNREADABLE = "unreadable"
+	
+	def __init__(self, index, max_workers=None, throttle=None):
+		"""
+		max_workers is the count of hashing processes, all cores by default
+		"""
+		self.__index = index
+		self.__max_workers = max_workers
+		self.__throttle = throttle
+		self.__setup()
+	
+	@property
+	def metrics(self):
+		with self.__lock:
+			return dict(self.__counts)
+	
+	def start(self, interval):
+		"""
+		verifies every version again once interval seconds have passed since the last verification
+		"""
+		if self.__thread is not None:
+			return
+		
+		self.__interval = interval
+		self.__stop_event.clear()
+		self.__thread = threading.Thread(target=self.__run, name="Scrubber", daemon=True)
+		self.__thread.start()
+	
+	def stop(self):
+		if self.__thread is None:
+			return
+		
+		self.__stop_event.set()
+		self.__thread.join()
+		self.__thread = None
+	
+	def verify(self, versions, progress=None):
+		"""
+		hashes versions and records the results on the index, returns the results other than ok and recorded
+		
+		progress is called with each result
+		"""
+		with self.__create_pool() as pool:
+			return self.__verify(pool, versions, progress)
+	
+	__BATCH_SIZE = 256
+	
+	__IDLE_WAIT = 600.0
+	
+	__UPDATE_SIZE = 100
+	
+	__WINDOW_PER_WORKER = 4
+	
+	def __acquire(self, size):
+		if self.__throttle is None:
+			return
+		
+		# paid in chunks, so that stop is not kept waiting for a large file
+		while size > 0 and not self.__stop_event.is_set():
+			amount = min(size, transfer.CHUNK_SIZE)
+			self.__throttle.acquire_bytes(amount)
+			size -= amount
+	
+	def __create_pool(self):
+		return ProcessPoolExecutor(self.__max_workers, initializer=_ignore_interrupt)
+	
+	def __run(self):
+		# 1 pool for the life of the thread, so that hashing processes are not spawned again for every batch
+		pool = None
+		try:
+			while not self.__stop_event.is_set():
+				versions = self.__index.find_versions_to_verify(time.time() - self.__interval, Scrubber.__BATCH_SIZE)
+				if not versions:
+					self.__stop_event.wait(Scrubber.__IDLE_WAIT)
+					continue
+				
+				try:
+					if pool is None:
+						pool = self.__create_pool()
+					for result in self.__verify(pool, versions):
+						logging.error("%s: %s %s", result.status.upper(), result.version.path, result.version.key)
+				except Exception as ex:
+					logging.error("ERROR: %s", ex)
+					# made again for the next batch, since a broken pool never recovers
+					if pool is not None:
+						pool.shutdown(cancel_futures=True)
+						pool = None
+					self.__stop_event.wait(Scrubber.__IDLE_WAIT)
+		finally:
+			if pool is not None:
+				pool.shutdown()
+	
+	def __settle(self, version, future, results, updates, progress):
+		hash = None
+		try:
+			hash = future.result()
+		except FileNotFoundError:
+			if not any(known.key == version.key for known in self.__index.find_versions(version.path)):
+				# forgotten while it was being hashed
+				return
+			status = Scrubber.MISSING
+		except OSError:
+			status = Scrubber.UNREADABLE
+		else:
+			if version.hash is None:
+				status = Scrubber.RECORDED
+			elif hash == version.hash:
+				status = Scrubber.OK
+			else:
+				status = Scrubber.CORRUPT
+		
+		# every result is marked verified, so that a broken version is reported once per interval
+		updates.append((time.time(), hash if status == Scrubber.RECORDED else None, version.path, version.key))
+		if len(updates) >= Scrubber.__UPDATE_SIZE:
+			self.__index.set_verified(updates)
+			updates.clear()
+		
+		result = self.Result(version, status, hash)
+		with self.__lock:
+			self.__counts[status] += 1
+		if status not in (Scrubber.OK, Scrubber.RECORDED):
+			results.append(result)
+		if progress is not None:
+			progress(result)
+	
+	def __verify(self, pool, versions, progress=None):
+		ret = []
+		updates = []
+		window = (self.__max_workers or os.cpu_count() or 1) * Scrubber.__WINDOW_PER_WORKER
+		futures = {}
+		for version in versions:
+			if self.__stop_event.is_set():
+				break
+			
+			self.__acquire(version.size or 0)
+			repository_file_path = self.__index.repository_file_path(version)
+			futures[pool.submit(transfer.hash_file, repository_file_path)] = version
+			while len(futures) >= window:
+				done, _ = wait(futures, return_when=FIRST_COMPLETED)
+				for future in done:
+					self.__settle(futures.pop(future), future, ret, updates, progress)
+		
+		for future in wait(futures).done:
+			self.__settle(futures[future], future, ret, updates, progress)
+		
+		if updates:
+			self.__index.set_verified(updates)
+		return ret
+	
+	def __setup(self):
+		self.__lock = threading.Lock()
+		self.__counts = {status : 0 for status in (Scrubber.OK, Scrubber.RECORDED, Scrubber.CORRUPT, Scrubber.MISSING, Scrubber.UNREADABLE)}
+		self.__stop_event = threading.Event()
+		self.__thread = None
+		self.__interval = None
+
+
+def _ignore_interrupt():
+	# Ctrl-C stops the process that owns the pool, which shuts the workers down
+	signal.signal(signal.SIGINT, signal.SIG_IGN)
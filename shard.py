@@ -0,0 +1,129 @@
+"""
+/* --------------------------------
+   Sharded repository roots
+
+ - spreads versions over several repository roots, e.g. 1 per disk
+ - the first root is the repository itself, and keeps the index, the journal and the layout
+ - a file is placed on a shard once, by the hash of its path or weighted by free space, and the index remembers where
+ - the other roots are kept in .bb.shards on the first root, so that every reader of the index finds them
+-------------------------------- */
+"""
+import hashlib
+import json
+import os
+import random
+import shutil
+import threading
+import time
+
+import path
+
+
+class Shards:
+	"""
+	ordered repository roots and their placement policy
+	"""
+	HASH = "hash"
+	FREE_SPACE = "free_space"
+	
+	POLICIES = (HASH, FREE_SPACE)
+	
+	FILE_NAME = ".bb.shards"
+	
+	def __init__(self, roots, policy=HASH):
+		"""
+		roots are appended only, since the index refers to a shard by its position
+		"""
+		if policy not in Shards.POLICIES:
+			raise ValueError(f"unknown placement policy: {policy}")
+		self.__roots = list(roots)
+		self.__policy = policy
+		self.__setup()
+	
+	def __len__(self):
+		return len(self.__roots)
+	
+	@property
+	def policy(self):
+		return self.__policy
+	
+	@property
+	def roots(self):
+		return [*self.__roots]
+	
+	@staticmethod
+	def load(repository_root):
+		try:
+			with open(os.path.join(repository_root, Shards.FILE_NAME), "r", encoding="utf-8") as file:
+				data = json.load(file)
+		except FileNotFoundError:
+			return Shards([repository_root])
+		return Shards([repository_root, *data["roots"]], data.get("policy", Shards.HASH))
+	
+	def place(self, file_path):
+		"""
+		shard a file without versions is stored on
+		"""
+		if len(self.__roots) == 1:
+			return 0
+		if self.__policy == Shards.HASH:
+			# leading slashes are dropped as the layouts do
+			digest = hashlib.sha1(file_path.lstrip("/").encode("utf-8")).digest()
+			return int.from_bytes(digest[:8], "big") % len(self.__roots)
+		
+		weights = self.__free_spaces()
+		if not any(weights):
+			return 0
+		return random.choices(range(len(self.__roots)), weights)[0]
+	
+	def relativize(self, file_path):
+		"""
+		returns (shard, path relative to its root) of a path in the repository, or (0, file_path) when no root has it
+		"""
+		ret = (0, file_path)
+		length = -1
+		for shard, root in enumerate(self.__roots):
+			prefix = path.normalize_dir_expression(root)
+			# the deepest root wins, a shard may be placed inside another one
+			if file_path.startswith(prefix) and len(prefix) > length:
+				ret = (shard, file_path[len(prefix):])
+				length = len(prefix)
+		return ret
+	
+	def root_of(self, shard):
+		return self.__roots[shard]
+	
+	def save(self):
+		"""
+		writes the other roots onto the first one, nothing is written for a single root
+		"""
+		file_path = os.path.join(self.__roots[0], Shards.FILE_NAME)
+		if len(self.__roots) == 1 and not os.path.exists(file_path):
+			return
+		
+		os.makedirs(self.__roots[0], exist_ok=True)
+		with open(file_path + ".tmp", "w", encoding="utf-8") as file:
+			json.dump({"roots" : self.__roots[1:], "policy" : self.__policy}, file)
+		os.replace(file_path + ".tmp", file_path)
+	
+	# free spaces are measured again after this seconds
+	__FREE_SPACE_TTL = 10.0
+	
+	def __free_spaces(self):
+		with self.__lock:
+			if time.monotonic() >= self.__measured + Shards.__FREE_SPACE_TTL:
+				self.__free = []
+				for root in self.__roots:
+					try:
+						os.makedirs(root, exist_ok=True)
+						self.__free.append(shutil.disk_usage(root).free)
+					except OSError:
+						# an unplugged volume takes nothing new
+						self.__free.append(0)
+				self.__measured = time.monotonic()
+			return [*self.__free]
+	
+	def __setup(self):
+		self.__lock = threading.Lock()
+		self.__free = []
+		self.__measured = float("-inf")
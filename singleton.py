@@ -3,21 +3,86 @@
    Singleton component
 
  - to keep single process to manage 1 of the repository
+ - talks protocol with second more launches and scripts on the bound socket
 -------------------------------- */
 """
+import errno
+import logging
 import sys
+import threading
 
 from Socket_Singleton import MultipleSingletonsError, Socket_Singleton
 
+import protocol
+
 
 class Singleton(Socket_Singleton):
-	def __init__(self, address: str = "127.0.0.1", port: int = 1337, timeout: int = 0, client: bool = True, strict: bool = True, max_clients: int = 0):
-		super().__init__(address, port, timeout, client, strict, max_clients)
-		
+	def __init__(self, address: str = protocol.DEFAULT_ADDRESS, port: int = protocol.DEFAULT_PORT, timeout: int = 0, client: bool = True, strict: bool = True, max_clients: int = 0):
 		self.address = address
+		self.__handler = None
+		
+		try:
+			super().__init__(address, port, timeout, client, strict, max_clients)
+		except OSError as ex:
+			# Socket_Singleton only knows WSAEADDRINUSE, so treat EADDRINUSE of posix the same
+			if ex.errno != errno.EADDRINUSE:
+				raise
+			if client:
+				self._create_client()
+			if strict:
+				raise SystemExit
+			raise MultipleSingletonsError(f"already bound on {address}:{port}") from None
+	
+	def handle(self, handler):
+		"""
+		handler is called on a connection thread with a request, and returns the response
+		"""
+		self.__handler = handler
 	
 	def _create_client(self):
 		# idea by https://qiita.com/takavfx/items/3ce8a10d8d7b7759e58a
 		with self._sock as sock:
 			sock.connect((self.address, self.port))
-			sock.send(" ".join(sys.argv).encode())
+			sock.settimeout(self.__CLIENT_TIMEOUT)
+			protocol.send(sock, {"argv" : sys.argv})
+			try:
+				protocol.receive(sock)
+			except (OSError, protocol.ProtocolError):
+				pass
+	
+	def _create_server(self):
+		with self._sock as sock:
+			sock.listen()
+			while self._running:
+				connection, address = sock.accept()
+				if not self._running:
+					connection.close()
+					break
+				thread = threading.Thread(target=self.__serve, args=(connection,), name="Singleton", daemon=True)
+				thread.start()
+	
+	__CLIENT_TIMEOUT = 30.0
+	
+	def __serve(self, connection):
+		with connection:
+			while True:
+				try:
+					request = protocol.receive(connection)
+				except (OSError, ValueError, protocol.ProtocolError) as ex:
+					logging.error("ERROR: %s", ex)
+					return
+				if request is None:
+					return
+				
+				if self.__handler is None:
+					response = {"error" : "not ready"}
+				else:
+					try:
+						response = self.__handler(request)
+					except Exception as ex:
+						response = {"error" : str(ex)}
+				
+				try:
+					protocol.send(connection, response)
+				except OSError:
+					return
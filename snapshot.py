@@ -0,0 +1,195 @@
+"""
+/* --------------------------------
+   Point-in-time snapshot of a directory
+
+ - resolves the version of every file under a directory at a time from the version index
+ - TreeRestore restores a snapshot with a thread pool, journaled so that an interrupted run resumes
+ - imports no Qt, so that the command line can use it
+-------------------------------- */
+"""
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import datetime
+import hashlib
+import json
+import os
+import threading
+
+from journal import TEMPORARY_EXTENSION
+import path
+import transfer
+
+
+FORMAT_TIMECODE = "%y%m%d%H%M"
+
+
+def parse_time(text):
+	"""
+	accepts a timecode of versions (yymmddHHMM) or an ISO 8601 time
+	"""
+	if len(text) == 10 and text.isdigit():
+		return datetime.datetime.strptime(text, FORMAT_TIMECODE)
+	return datetime.datetime.fromisoformat(text)
+
+
+class Snapshot:
+	"""
+	files under a directory as they were at a time
+	"""
+	class Item(namedtuple("Item", ("path", "version", "repository_file_path"))):
+		"""
+		1 file of the snapshot, version is a index.VersionIndex.Entry
+		"""
+		@property
+		def mtime(self):
+			return self.version.mtime
+		
+		@property
+		def size(self):
+			return self.version.size
+	
+	def __init__(self, index, directory, time):
+		"""
+		directory is normalized by path.normalize, time is a datetime
+		"""
+		self.__index = index
+		self.__directory = path.normalize_dir_expression(directory)
+		self.__time = time
+		self.__timecode = time.strftime(FORMAT_TIMECODE)
+	
+	def __iter__(self):
+		"""
+		yields items path by path in order, files created after the time or deleted before it are not included
+		"""
+		deleted = {tombstone.path : tombstone.deleted for tombstone in self.__index.find_deleted_files_under(self.__directory)}
+		time = self.__time.timestamp()
+		current = None
+		for version in self.__index.find_versions_under(self.__directory):
+			if current is not None and version.path != current.path:
+				yield self.__item(current)
+				current = None
+			if version.timecode is None or version.timecode > self.__timecode:
+				continue
+			if deleted.get(version.path, time + 1) <= time:
+				continue
+			current = version
+		if current is not None:
+			yield self.__item(current)
+	
+	@property
+	def directory(self):
+		return self.__directory
+	
+	@property
+	def time(self):
+		return self.__time
+	
+	def __item(self, version):
+		return self.Item(version.path, version, self.__index.repository_file_path(version))
+
+
+class TreeRestore:
+	"""
+	restoration of a snapshot onto the original paths
+	"""
+	Step = namedtuple("Step", ("item", "action"))
+	
+	KEEP = "keep"
+	RESTORE = "restore"
+	
+	def __init__(self, snapshot, journal_directory, max_workers=None, throttle=None):
+		self.__snapshot = snapshot
+		self.__journal_directory = journal_directory
+		self.__max_workers = max_workers
+		self.__throttle = throttle
+		self.__setup()
+	
+	@property
+	def journal_file_path(self):
+		return self.__journal_file_path
+	
+	def plan(self):
+		"""
+		yields steps without touching anything, files that are already the same as the snapshot are kept
+		"""
+		for item in self.__snapshot:
+			yield self.Step(item, self.KEEP if TreeRestore.__is_same(item) else self.RESTORE)
+	
+	def run(self, progress=None):
+		"""
+		restores the snapshot, and returns the count of failures
+		
+		progress is called with (step, error, done count, total count) on each file, error is None on success
+		"""
+		finished = self.__load_journal()
+		steps = [step for step in self.plan() if step.action == self.RESTORE and step.item.path not in finished]
+		
+		failures = 0
+		done = 0
+		with open(self.__journal_file_path, "a", encoding="utf-8") as journal:
+			if journal.tell() == 0:
+				journal.write(json.dumps({"directory" : self.__snapshot.directory, "time" : self.__snapshot.time.isoformat()}) + "\n")
+				journal.flush()
+			
+			with ThreadPoolExecutor(self.__max_workers, thread_name_prefix="TreeRestore") as pool:
+				futures = {pool.submit(self.__restore, step.item) : step for step in steps}
+				for future in as_completed(futures):
+					step = futures[future]
+					error = future.exception()
+					done += 1
+					if error is None:
+						with self.__lock:
+							journal.write(json.dumps(step.item.path) + "\n")
+							journal.flush()
+					else:
+						failures += 1
+					if progress is not None:
+						progress(step, error, done, len(steps))
+		
+		if failures == 0:
+			# nothing to resume
+			os.remove(self.__journal_file_path)
+		return failures
+	
+	def __load_journal(self):
+		ret = set()
+		try:
+			with open(self.__journal_file_path, "r", encoding="utf-8") as journal:
+				journal.readline()
+				for line in journal:
+					try:
+						ret.add(json.loads(line))
+					except ValueError:
+						# torn last line of an interrupted run
+						break
+		except FileNotFoundError:
+			pass
+		return ret
+	
+	@staticmethod
+	def __is_same(item):
+		try:
+			stat = os.stat(item.path)
+		except OSError:
+			return False
+		return stat.st_size == item.size and item.mtime is not None and abs(stat.st_mtime - item.mtime) < 0.001
+	
+	def __restore(self, item):
+		# the original is replaced at once, so that an interruption never leaves a half written file
+		temporary_file_path = item.path + TEMPORARY_EXTENSION
+		os.makedirs(os.path.dirname(item.path), exist_ok=True)
+		try:
+			transfer.copy(item.repository_file_path, temporary_file_path, self.__throttle, drops_source_cache=True)
+			os.replace(temporary_file_path, item.path)
+		except BaseException:
+			if os.path.exists(temporary_file_path):
+				os.remove(temporary_file_path)
+			raise
+	
+	__JOURNAL_EXTENSION = ".journal"
+	
+	def __setup(self):
+		self.__lock = threading.Lock()
+		key = f"{self.__snapshot.directory}\n{self.__snapshot.time.isoformat()}".encode()
+		name = ".bb.restore." + hashlib.sha1(key).hexdigest()[:16] + TreeRestore.__JOURNAL_EXTENSION
+		self.__journal_file_path = os.path.join(self.__journal_directory, name)
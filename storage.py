@@ -0,0 +1,252 @@
+"""
+/* --------------------------------
+   Storage backends
+
+ - Repository is 1 repository root with its own version index, journal, layout and shards
+ - the engine has the shared one of config.ini, and a target may have its own, e.g. a fast disk for source trees and a large one for assets
+ - StoragePolicy tells how versions are written: compressed by the filesystem, and deduplicated by hard links
+ - both keep versions plain files, so that every reader of the repository works as it is
+-------------------------------- */
+"""
+import logging
+import os
+import threading
+
+from PySide6.QtCore import QObject
+
+from index import VersionIndex
+import journal
+from layout import Layout
+from shard import Shards
+
+
+class StoragePolicy:
+	"""
+	how versions are written, inherited from the parent policy when not specified
+	"""
+	def __init__(self, compresses=None, deduplicates=None, parent=None):
+		self.__compresses = compresses
+		self.__deduplicates = deduplicates
+		self.__parent = parent
+	
+	@property
+	def compresses(self):
+		"""
+		version directories are marked compressed, so that NTFS or btrfs compresses new versions transparently
+		"""
+		if self.__compresses is not None:
+			return self.__compresses
+		if self.__parent is not None:
+			return self.__parent.compresses
+		return False
+	
+	@compresses.setter
+	def compresses(self, value):
+		self.__compresses = value
+	
+	@property
+	def deduplicates(self):
+		"""
+		a version with the same content as another one on the same volume is replaced with a hard link to it
+		"""
+		if self.__deduplicates is not None:
+			return self.__deduplicates
+		if self.__parent is not None:
+			return self.__parent.deduplicates
+		return False
+	
+	@deduplicates.setter
+	def deduplicates(self, value):
+		self.__deduplicates = value
+	
+	@property
+	def parent(self):
+		return self.__parent
+	
+	@parent.setter
+	def parent(self, value):
+		self.__parent = value
+	
+	def deserialize(self, data):
+		self.__compresses = data.get("compression")
+		self.__deduplicates = data.get("dedup")
+	
+	def serialize(self):
+		ret = {}
+		if self.__compresses is not None:
+			ret["compression"] = self.__compresses
+		if self.__deduplicates is not None:
+			ret["dedup"] = self.__deduplicates
+		
+		return ret
+
+
+class Repository(QObject):
+	"""
+	1 repository root and everything kept on it
+	"""
+	def __init__(self, repository_root, durability, throttle, storage, shards=None, parent=None):
+		"""
+		shards are loaded from the repository root when not given
+		"""
+		super().__init__(parent)
+		self.__repository_root = repository_root
+		self.__durability = durability
+		self.__throttle = throttle
+		self.__storage = storage
+		self.__shards = shards
+		self.__setup()
+	
+	JOURNAL_FILE_NAME = ".bb.journal"
+	
+	@property
+	def index(self):
+		if self.__index is None:
+			self.__index = VersionIndex(self.__repository_root)
+			self.__index.shards = self.shards
+		return self.__index
+	
+	@property
+	def journal(self):
+		if self.__journal is None:
+			self.__journal = journal.Journal(os.path.join(self.__repository_root, self.__journal_file_name), self.__durability)
+		return self.__journal
+	
+	@property
+	def journal_file_name(self):
+		"""
+		name of the journal on the repository root, each process writing to the repository keeps its own
+		"""
+		return self.__journal_file_name
+	
+	@journal_file_name.setter
+	def journal_file_name(self, value):
+		self.__journal_file_name = value
+	
+	@property
+	def layout(self):
+		"""
+		placement of versions in the repository, the source layout is kept while a migration is unfinished
+		"""
+		if self.__layout is None:
+			self.__layout = Layout(Layout.load(self.__repository_root).name)
+		return self.__layout
+	
+	@property
+	def repository_root(self):
+		return self.__repository_root
+	
+	@property
+	def shards(self):
+		"""
+		repository roots, the first one is repository_root
+		"""
+		if self.__shards is None:
+			self.__shards = Shards.load(self.__repository_root)
+		return self.__shards
+	
+	@property
+	def storage(self):
+		"""
+		policy of files without a target policy
+		"""
+		return self.__storage
+	
+	@property
+	def throttle(self):
+		return self.__throttle
+	
+	def close(self):
+		if self.__journal is not None:
+			self.__journal.close()
+			self.__journal = None
+		
+		if self.__index is not None:
+			self.__index.close()
+			self.__index = None
+	
+	def compress_directory(self, directory):
+		"""
+		marks directory compressed once, new files in it are compressed by the filesystem
+		
+		filesystems without transparent compression keep files as they are
+		"""
+		with self.__lock:
+			if directory in self.__compressed_directories:
+				return
+			self.__compressed_directories.add(directory)
+		
+		try:
+			_compress(directory)
+		except OSError as ex:
+			logging.warning("UNCOMPRESSED: %s %s", directory, ex)
+	
+	def contains(self, file_path):
+		"""
+		file_path is under any root of the repository
+		"""
+		file_path = os.path.abspath(file_path)
+		file_drive, file_path = os.path.splitdrive(file_path)
+		for repository_root in self.shards.roots:
+			repository_drive, repository_root = os.path.splitdrive(os.path.abspath(repository_root))
+			if file_drive.lower() != repository_drive.lower():
+				continue
+			if not os.path.relpath(file_path, repository_root).startswith(".."):
+				return True
+		return False
+	
+	def __setup(self):
+		self.__lock = threading.Lock()
+		self.__compressed_directories = set()
+		self.__index = None
+		self.__journal = None
+		self.__journal_file_name = Repository.JOURNAL_FILE_NAME
+		self.__layout = None
+
+
+def _compress(directory):
+	if os.name == "nt":
+		_compress_nt(directory)
+		return
+	
+	import fcntl
+	
+	# FS_IOC_GETFLAGS, FS_IOC_SETFLAGS and FS_COMPR_FL of linux/fs.h, honored by btrfs
+	FS_IOC_GETFLAGS = 0x80086601
+	FS_IOC_SETFLAGS = 0x40086602
+	FS_COMPR_FL = 0x00000004
+	
+	descriptor = os.open(directory, os.O_RDONLY)
+	try:
+		flags = bytearray(8)
+		fcntl.ioctl(descriptor, FS_IOC_GETFLAGS, flags)
+		value = int.from_bytes(flags, "little") | FS_COMPR_FL
+		fcntl.ioctl(descriptor, FS_IOC_SETFLAGS, value.to_bytes(8, "little"))
+	finally:
+		os.close(descriptor)
+
+
+def _compress_nt(directory):
+	import ctypes
+	from ctypes import wintypes
+	
+	FILE_FLAG_BACKUP_SEMANTICS = 0x02000000
+	FSCTL_SET_COMPRESSION = 0x0009C040
+	COMPRESSION_FORMAT_DEFAULT = 1
+	GENERIC_READ = 0x80000000
+	GENERIC_WRITE = 0x40000000
+	OPEN_EXISTING = 3
+	SHARE_ALL = 0x00000007
+	
+	kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+	kernel32.CreateFileW.restype = wintypes.HANDLE
+	handle = kernel32.CreateFileW(directory, GENERIC_READ | GENERIC_WRITE, SHARE_ALL, None, OPEN_EXISTING, FILE_FLAG_BACKUP_SEMANTICS, None)
+	if handle == wintypes.HANDLE(-1).value:
+		raise ctypes.WinError(ctypes.get_last_error())
+	try:
+		state = wintypes.USHORT(COMPRESSION_FORMAT_DEFAULT)
+		returned = wintypes.DWORD()
+		if not kernel32.DeviceIoControl(wintypes.HANDLE(handle), FSCTL_SET_COMPRESSION, ctypes.byref(state), ctypes.sizeof(state), None, 0, ctypes.byref(returned), None):
+			raise ctypes.WinError(ctypes.get_last_error())
+	finally:
+		kernel32.CloseHandle(wintypes.HANDLE(handle))
@@ -0,0 +1,52 @@
+"""
+/* --------------------------------
+   Browse server tests
+
+ [Usage]
+ 1. Run "python -m unittest discover tests" or "python -m pytest tests" on this project
+-------------------------------- */
+"""
+import os
+import sys
+import tempfile
+import unittest
+from urllib.request import urlopen
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from browse import BrowseServer
+from index import VersionIndex
+from work import File
+
+
+class TreeTest(unittest.TestCase):
+	@unittest.skipIf(os.name == "nt", "posix roots")
+	def test_posix_root(self):
+		# the root lists "/" that leads to the top directories, as it lists drives on Windows
+		with tempfile.TemporaryDirectory() as root:
+			repository_file_path = os.path.join(root, "a.bb.2601011200.txt")
+			with open(repository_file_path, "w", encoding="utf-8") as file:
+				file.write("a")
+			index = VersionIndex(root)
+			index.register("/tmp/w/a.txt", [File.Version(".bb.2601011200", repository_file_path)])
+			server = BrowseServer(index, port=0)
+			server.start()
+			try:
+				url = "http://%s:%s" % server.server_address
+				def get(route):
+					with urlopen(url + route) as response:
+						return response.read().decode()
+				
+				page = get("/")
+				self.assertIn("href=\"/tree//?", page)
+				self.assertNotIn("/tree///", page)
+				self.assertIn("href=\"/tree//tmp/?", get("/tree//"))
+				self.assertIn(">w/</a>", get("/tree//tmp/"))
+				self.assertIn(">a.txt</a>", get("/tree//tmp/w/?at=2601011300"))
+			finally:
+				server.stop()
+				index.close()
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,324 @@
+"""
+/* --------------------------------
+   Engine command tests
+
+ [Usage]
+ 1. Run "python -m unittest discover tests" or "python -m pytest tests" on this project
+-------------------------------- */
+"""
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PySide6.QtCore import QCoreApplication, QSettings
+from watchdog.events import FileMovedEvent
+
+from engine import Engine
+from index import VersionIndex
+from journal import Journal
+import path
+
+
+class VersionsCommandTest(unittest.TestCase):
+	@classmethod
+	def setUpClass(cls):
+		cls.application = QCoreApplication.instance() or QCoreApplication([])
+	
+	def test_versions_of_stored_file(self):
+		# the engine keys versions by the path of work.File, the command looks them up by the path it is given
+		with tempfile.TemporaryDirectory() as root:
+			file_path = os.path.join(root, "work", "a.txt")
+			os.makedirs(os.path.dirname(file_path))
+			with open(file_path, "w", encoding="utf-8") as file:
+				file.write("a")
+			
+			engine = Engine()
+			engine.repository_root = os.path.join(root, "repository")
+			engine.targets_file_path = os.path.join(root, "target.json")
+			engine.retry_file_path = os.path.join(root, "retry.json")
+			engine.log_file_path = ""
+			try:
+				self.assertTrue(engine.store_file(engine.inquiry(file_path)))
+				# indexed once the group of the copy is committed
+				engine.durability.flush()
+				versions = engine.execute({"command" : "versions", "path" : file_path})["versions"]
+			finally:
+				engine.stop()
+			
+			self.assertEqual(len(versions), 1)
+			self.assertTrue(os.path.isfile(os.path.join(root, "repository", versions[0]["repository_path"].lstrip("/\\"))))
+	
+	def test_versions_of_target_repository(self):
+		# versions stored into the own repository of a target are found through the engine
+		with tempfile.TemporaryDirectory() as root:
+			file_path = os.path.join(root, "work", "a.txt")
+			os.makedirs(os.path.dirname(file_path))
+			with open(file_path, "w", encoding="utf-8") as file:
+				file.write("a")
+			
+			engine = Engine()
+			engine.repository_root = os.path.join(root, "repository")
+			engine.targets_file_path = os.path.join(root, "target.json")
+			engine.retry_file_path = os.path.join(root, "retry.json")
+			engine.log_file_path = ""
+			try:
+				target = engine.add_target()
+				target.root = os.path.join(root, "work")
+				target.repository_root = os.path.join(root, "target")
+				self.assertTrue(engine.store_file(engine.inquiry(file_path)))
+				# copied on the lane of the target repository
+				deadline = time.monotonic() + 10
+				versions = []
+				while not versions and time.monotonic() < deadline:
+					time.sleep(0.05)
+					engine.durability.flush()
+					versions = engine.find_versions(file_path)
+				shared_versions = engine.repository.index.find_versions(path.normalize(file_path))
+			finally:
+				engine.stop()
+			
+			self.assertEqual(len(versions), 1)
+			self.assertEqual(shared_versions, [])
+	
+	def test_version_superseded_before_its_group_commit(self):
+		# a store in the next minute replaces the previous version, which is still waiting for its group
+		with tempfile.TemporaryDirectory() as root:
+			file_path = os.path.join(root, "work", "a.txt")
+			os.makedirs(os.path.dirname(file_path))
+			with open(file_path, "w", encoding="utf-8") as file:
+				file.write("a")
+			modified_time = os.path.getmtime(file_path) // 60 * 60
+			os.utime(file_path, (modified_time, modified_time))
+			
+			engine = Engine()
+			engine.repository_root = os.path.join(root, "repository")
+			engine.targets_file_path = os.path.join(root, "target.json")
+			engine.retry_file_path = os.path.join(root, "retry.json")
+			engine.log_file_path = ""
+			engine.durability.window = 60.0
+			try:
+				self.assertTrue(engine.store_file(engine.inquiry(file_path)))
+				with open(file_path, "w", encoding="utf-8") as file:
+					file.write("b")
+				os.utime(file_path, (modified_time + 60, modified_time + 60))
+				self.assertTrue(engine.store_file(engine.inquiry(file_path)))
+				engine.durability.flush()
+				versions = engine.execute({"command" : "versions", "path" : file_path})["versions"]
+			finally:
+				engine.stop()
+			
+			self.assertEqual(len(versions), 1)
+			file_names = [file_name for _, _, file_names in os.walk(os.path.join(root, "repository")) for file_name in file_names if file_name.startswith("a.bb.")]
+			self.assertEqual(len(file_names), 1)
+	
+	def test_version_published_with_its_group(self):
+		# a version is listed once it is in place, and its row is committed with the group
+		with tempfile.TemporaryDirectory() as root:
+			file_path = os.path.join(root, "work", "a.txt")
+			os.makedirs(os.path.dirname(file_path))
+			with open(file_path, "w", encoding="utf-8") as file:
+				file.write("a")
+			
+			engine = Engine()
+			engine.repository_root = os.path.join(root, "repository")
+			engine.targets_file_path = os.path.join(root, "target.json")
+			engine.retry_file_path = os.path.join(root, "retry.json")
+			engine.log_file_path = ""
+			engine.durability.window = 60.0
+			try:
+				file = engine.inquiry(file_path)
+				self.assertTrue(engine.store_file(file))
+				self.assertEqual(file.versions, [])
+				self.assertIsNone(file.current_version)
+				# the same minute waiting for its group is not copied again
+				self.assertTrue(engine.store_file(file))
+				
+				engine.durability.flush()
+				self.assertEqual(len(file.versions), 1)
+				self.assertIs(file.current_version, file.versions[0])
+				self.assertIsNotNone(file.current_version.timestamp)
+				reader = VersionIndex(engine.repository_root, read_only=True)
+				try:
+					self.assertEqual(len(reader.find_versions(file.path)), 1)
+				finally:
+					reader.close()
+			finally:
+				engine.stop()
+
+
+class SplitJournalTest(unittest.TestCase):
+	@classmethod
+	def setUpClass(cls):
+		cls.application = QCoreApplication.instance() or QCoreApplication([])
+	
+	def test_window_copies_kept_by_worker_recovery(self):
+		# the worker recovers on start while the window of split mode is copying
+		with tempfile.TemporaryDirectory() as root:
+			source = os.path.join(root, "a.txt")
+			destination = os.path.join(root, "b.txt")
+			with open(source, "w", encoding="utf-8") as file:
+				file.write("a")
+			
+			engines = [Engine(), Engine()]
+			for engine in engines:
+				engine.repository_root = os.path.join(root, "repository")
+				engine.targets_file_path = os.path.join(root, "target.json")
+				engine.retry_file_path = os.path.join(root, "retry.json")
+				engine.log_file_path = ""
+			window, worker = engines
+			window.is_passive = True
+			window.durability.window = 60.0
+			try:
+				self.assertNotEqual(window.journal.file_path, worker.journal.file_path)
+				window.journal.copy(Journal.RESTORE, source, destination, on_durable=lambda: None)
+				worker.journal.recover()
+				window.durability.flush()
+			finally:
+				window.stop()
+				worker.stop()
+			
+			with open(destination, encoding="utf-8") as file:
+				self.assertEqual(file.read(), "a")
+
+
+class ConfigTest(unittest.TestCase):
+	@classmethod
+	def setUpClass(cls):
+		cls.application = QCoreApplication.instance() or QCoreApplication([])
+	
+	def test_round_trip(self):
+		# an empty list of shard roots is written as @Invalid(), which is read back as None
+		for roots in ([], ["d:/shard"], ["d:/shard", "e:/shard"]):
+			with tempfile.TemporaryDirectory() as root:
+				file_path = os.path.join(root, "config.ini")
+				config = QSettings(file_path, QSettings.IniFormat)
+				config.setValue("Shards/roots", roots)
+				config.sync()
+				
+				engine = Engine()
+				engine.restore(QSettings(file_path, QSettings.IniFormat))
+				config = QSettings(os.path.join(root, "stored.ini"), QSettings.IniFormat)
+				engine.store(config)
+				config.sync()
+				
+				stored = QSettings(os.path.join(root, "stored.ini"), QSettings.IniFormat).value("Shards/roots") or []
+				self.assertEqual([stored] if isinstance(stored, str) else list(stored), roots)
+				# restored again as the next start does
+				Engine().restore(QSettings(os.path.join(root, "stored.ini"), QSettings.IniFormat))
+
+
+class RelocateTest(unittest.TestCase):
+	@classmethod
+	def setUpClass(cls):
+		cls.application = QCoreApplication.instance() or QCoreApplication([])
+	
+	def test_history_follows_rename(self):
+		with tempfile.TemporaryDirectory() as root:
+			file_path = os.path.join(root, "work", "a.txt")
+			to = os.path.join(root, "work", "b.txt")
+			os.makedirs(os.path.dirname(file_path))
+			with open(file_path, "w", encoding="utf-8") as file:
+				file.write("a")
+			
+			engine = Engine()
+			engine.repository_root = os.path.join(root, "repository")
+			engine.targets_file_path = os.path.join(root, "target.json")
+			engine.retry_file_path = os.path.join(root, "retry.json")
+			engine.log_file_path = ""
+			try:
+				self.assertTrue(engine.store_file(engine.inquiry(file_path)))
+				engine.durability.flush()
+				os.rename(file_path, to)
+				engine.on_moved(FileMovedEvent(file_path, to))
+				engine.durability.flush()
+				index = engine.repository.index
+				versions = index.find_versions(engine.inquiry(to).path)
+				self.assertEqual(index.find_versions(path.normalize(file_path)), [])
+			finally:
+				engine.stop()
+			
+			self.assertEqual(len(versions), 1)
+			# the hash recorded on store is kept, so that verify needs no rehash
+			self.assertIsNotNone(versions[0].hash)
+			self.assertTrue(os.path.isfile(index.repository_file_path(versions[0])))
+	
+	def test_same_version_kept(self):
+		# a rename onto a file with a version of the same minute never overwrites that version
+		with tempfile.TemporaryDirectory() as root:
+			file_path = os.path.join(root, "work", "a.txt")
+			to = os.path.join(root, "work", "b.txt")
+			os.makedirs(os.path.dirname(file_path))
+			for each_path, content in ((file_path, "a"), (to, "b")):
+				with open(each_path, "w", encoding="utf-8") as file:
+					file.write(content)
+				os.utime(each_path, (0, 0))
+			
+			engine = Engine()
+			engine.repository_root = os.path.join(root, "repository")
+			engine.targets_file_path = os.path.join(root, "target.json")
+			engine.retry_file_path = os.path.join(root, "retry.json")
+			engine.log_file_path = ""
+			try:
+				self.assertTrue(engine.store_file(engine.inquiry(file_path)))
+				self.assertTrue(engine.store_file(engine.inquiry(to)))
+				engine.durability.flush()
+				os.replace(file_path, to)
+				engine.on_moved(FileMovedEvent(file_path, to))
+				engine.durability.flush()
+				index = engine.repository.index
+				versions = index.find_versions(path.normalize(to))
+				kept = index.find_versions(path.normalize(file_path))
+			finally:
+				engine.stop()
+			
+			self.assertEqual(len(versions), 1)
+			with open(index.repository_file_path(versions[0]), encoding="utf-8") as file:
+				self.assertEqual(file.read(), "b")
+			self.assertEqual(len(kept), 1)
+			with open(index.repository_file_path(kept[0]), encoding="utf-8") as file:
+				self.assertEqual(file.read(), "a")
+
+
+
+class DeduplicateTest(unittest.TestCase):
+	@classmethod
+	def setUpClass(cls):
+		cls.application = QCoreApplication.instance() or QCoreApplication([])
+	
+	def test_times_kept(self):
+		# the same content at another time keeps its own time, at the same time it is linked
+		with tempfile.TemporaryDirectory() as root:
+			file_paths = [os.path.join(root, "work", name) for name in ("a.txt", "b.txt", "c.txt")]
+			os.makedirs(os.path.dirname(file_paths[0]))
+			for file_path, modified_time in zip(file_paths, (0, 3600, 0)):
+				with open(file_path, "w", encoding="utf-8") as file:
+					file.write("a")
+				os.utime(file_path, (modified_time, modified_time))
+			
+			engine = Engine()
+			engine.repository_root = os.path.join(root, "repository")
+			engine.targets_file_path = os.path.join(root, "target.json")
+			engine.retry_file_path = os.path.join(root, "retry.json")
+			engine.log_file_path = ""
+			engine.storage.deduplicates = True
+			try:
+				for file_path in file_paths:
+					self.assertTrue(engine.store_file(engine.inquiry(file_path)))
+					engine.durability.flush()
+				index = engine.repository.index
+				stats = [os.stat(index.repository_file_path(index.find_versions(path.normalize(file_path))[0])) for file_path in file_paths]
+			finally:
+				engine.stop()
+			
+			self.assertEqual([int(stat.st_mtime) for stat in stats], [0, 3600, 0])
+			self.assertEqual(stats[1].st_nlink, 1)
+			if os.name != "nt":
+				self.assertEqual(stats[0].st_ino, stats[2].st_ino)
+
+
+if __name__ == "__main__":
+	unittest.main()
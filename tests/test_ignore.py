@@ -0,0 +1,94 @@
+"""
+/* --------------------------------
+   Ignore rule tests
+
+ [Usage]
+ 1. Run "python -m unittest discover tests" or "python -m pytest tests" on this project
+-------------------------------- */
+"""
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PySide6.QtCore import QCoreApplication
+from watchdog.events import DirMovedEvent, FileMovedEvent
+
+from ignore import IgnoreRules
+import metrics
+from work import Work
+
+
+class IgnoreRulesTest(unittest.TestCase):
+	def test_match(self):
+		rules = IgnoreRules(["# comment", "*.tmp", "!keep.tmp", "node_modules/", "/build/", "docs/**/*.pdf"])
+		self.assertTrue(rules.match("a.tmp"))
+		self.assertTrue(rules.match("x/y/a.tmp"))
+		# the last matching line wins
+		self.assertFalse(rules.match("x/keep.tmp"))
+		self.assertTrue(rules.match("node_modules", True))
+		self.assertFalse(rules.match("node_modules"))
+		self.assertTrue(rules.match("x\\node_modules\\a.js"))
+		self.assertTrue(rules.match("build", True))
+		self.assertFalse(rules.match("x/build", True))
+		self.assertTrue(rules.match("docs/a.pdf"))
+		self.assertTrue(rules.match("docs/a/b/c.pdf"))
+		self.assertFalse(rules.match("a.txt"))
+		self.assertFalse(IgnoreRules())
+	
+	def test_hits(self):
+		counted = metrics.REGISTRY.snapshot().get("bb_ignore_hits_total", {}).get("pattern=*.log", 0)
+		rules = IgnoreRules(["*.log", "!b.log"])
+		for relative_path in ("a.log", "b.log", "c.log", "d.txt"):
+			rules.match(relative_path)
+		self.assertEqual(rules.hits, {"*.log" : 2, "!b.log" : 1})
+		self.assertEqual(metrics.REGISTRY.snapshot()["bb_ignore_hits_total"]["pattern=*.log"], counted + 2)
+		rules.reset_hits()
+		self.assertEqual(rules.hits, {"*.log" : 0, "!b.log" : 0})
+
+
+class MoveAcrossRulesTest(unittest.TestCase):
+	@classmethod
+	def setUpClass(cls):
+		cls.application = QCoreApplication.instance() or QCoreApplication([])
+	
+	def test_moves(self):
+		# the target sees a move into its rules as a creation, and one out of them as a deletion
+		with tempfile.TemporaryDirectory() as root:
+			os.makedirs(os.path.join(root, "b"))
+			for file_name in ("x.txt", "y.tmp"):
+				with open(os.path.join(root, "b", file_name), "w", encoding="utf-8") as file:
+					file.write("a")
+			
+			events = []
+			target = Work()
+			target.root = root + "..."
+			target.ignore_patterns = ["*.tmp", "cache/"]
+			target.on_created_handler = lambda event: events.append(("created", event.src_path))
+			target.on_deleted_handler = lambda event: events.append(("deleted", event.src_path))
+			target.on_moved_handler = lambda event: events.append(("moved", event.src_path))
+			handler = Work._Work__Handler(target)
+			
+			handler.on_moved(FileMovedEvent(os.path.join(root, "a.tmp"), os.path.join(root, "a.txt")))
+			handler.on_moved(FileMovedEvent(os.path.join(root, "a.txt"), os.path.join(root, "a.tmp")))
+			handler.on_moved(FileMovedEvent(os.path.join(root, "a.tmp"), os.path.join(root, "b.tmp")))
+			handler.on_moved(FileMovedEvent(os.path.join(root, "a.txt"), os.path.join(root, "b.txt")))
+			handler.on_moved(DirMovedEvent(os.path.join(root, "cache"), os.path.join(root, "b")))
+			synthetic = FileMovedEvent(os.path.join(root, "cache", "x.txt"), os.path.join(root, "b", "x.txt"))
+			synthetic.is_synthetic = True
+			handler.on_moved(synthetic)
+			handler.on_moved(DirMovedEvent(os.path.join(root, "c"), os.path.join(root, "cache")))
+		
+		self.assertEqual(events, [
+			("created", os.path.join(root, "a.txt")),
+			("deleted", os.path.join(root, "a.txt")),
+			("moved", os.path.join(root, "a.txt")),
+			("created", os.path.join(root, "b", "x.txt")),
+			("deleted", os.path.join(root, "c")),
+		])
+
+
+if __name__ == "__main__":
+	unittest.main()
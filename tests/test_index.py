@@ -0,0 +1,46 @@
+"""
+/* --------------------------------
+   Version index tests
+
+ [Usage]
+ 1. Run "python -m unittest discover tests" or "python -m pytest tests" on this project
+-------------------------------- */
+"""
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from index import VersionIndex
+from work import File
+
+
+class RelocateDirectoryTest(unittest.TestCase):
+	def test_destination_kept(self):
+		# moving a directory onto one with histories merges both, the moved version wins on the same key
+		with tempfile.TemporaryDirectory() as root:
+			index = VersionIndex(root)
+			try:
+				def register(file_path, *keys):
+					index.register(file_path, [File.Version(key, os.path.join(root, file_path.strip("/") + key)) for key in keys])
+				
+				register("/w/a/x.txt", ".bb.2601011200", ".bb.2601011300")
+				register("/w/b/x.txt", ".bb.2601011300", ".bb.2601011400")
+				register("/w/b/y.txt", ".bb.2601011200")
+				register("/w/b/z.txt", ".bb.2601011200")
+				index.bury("/w/b/z.txt")
+				
+				index.relocate_directory("/w/a/", "/w/b/", os.path.join(root, "w", "a", ""), os.path.join(root, "w", "b", ""))
+				
+				self.assertEqual([version.key for version in index.find_versions("/w/b/x.txt")], [".bb.2601011200", ".bb.2601011300", ".bb.2601011400"])
+				self.assertEqual(len(index.find_versions("/w/b/y.txt")), 1)
+				self.assertEqual([tombstone.path for tombstone in index.find_deleted_files("/w/b/")], ["/w/b/z.txt"])
+				self.assertEqual(index.find_versions("/w/a/x.txt"), [])
+			finally:
+				index.close()
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,42 @@
+"""
+/* --------------------------------
+   Path normalization tests
+
+ [Usage]
+ 1. Run "python -m unittest discover tests" or "python -m pytest tests" on this project
+-------------------------------- */
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import path
+
+
+class NormalizeTest(unittest.TestCase):
+	def test_idempotent(self):
+		# keys of the index are normalized by the engine and again by work.File, and looked up once normalized by the command line
+		for file_path in ("/tmp/x", "//tmp/x", "/", "c:\\Work\\a.txt", "relative/dir/", "/tmp/dir/"):
+			normalized = path.normalize(file_path)
+			self.assertEqual(path.normalize(normalized), normalized, file_path)
+	
+	@unittest.skipIf(os.name == "nt", "posix roots")
+	def test_posix_root(self):
+		self.assertEqual(path.normalize("/tmp/rv/w/a.txt"), "/tmp/rv/w/a.txt")
+		self.assertEqual(path.normalize("////tmp/rv/w/a.txt"), "/tmp/rv/w/a.txt")
+		self.assertEqual(path.normalize("/"), "/")
+	
+	def test_drive(self):
+		self.assertEqual(path.normalize("C:\\Work\\A.txt" if os.name == "nt" else "c:/Work/A.txt"), "c:/work/a.txt")
+	
+	def test_strip_root(self):
+		# a mirror of a posix root joined onto a repository root stays in it
+		root = os.path.join("repository", "")
+		self.assertTrue(os.path.join(root, path.strip_root("/tmp/a.bb.2601011200.txt")).startswith(root))
+		self.assertTrue(os.path.join(root, path.strip_root("////tmp/a.bb.2601011200.txt")).startswith(root))
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,111 @@
+"""
+/* --------------------------------
+   Protocol framing tests
+
+ [Usage]
+ 1. Run "python -m unittest discover tests" or "python -m pytest tests" on this project
+-------------------------------- */
+"""
+import os
+import socket
+import struct
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import protocol
+
+
+class FramingTest(unittest.TestCase):
+	def setUp(self):
+		self.sender, self.receiver = socket.socketpair()
+	
+	def tearDown(self):
+		self.sender.close()
+		self.receiver.close()
+	
+	def test_round_trip(self):
+		messages = [{"argv" : ["a b", "c"]}, {"commands" : [{"command" : "stats"}]}, {"text" : "あ" * 1000}]
+		for message in messages:
+			protocol.send(self.sender, message)
+		self.assertEqual([protocol.receive(self.receiver) for _ in messages], messages)
+	
+	def test_message_in_pieces(self):
+		# a message arriving a few bytes at a time is read whole
+		payload = b'{"results" : [1, 2]}'
+		data = struct.pack(">I", len(payload)) + payload
+		
+		def send():
+			for index in range(0, len(data), 3):
+				self.sender.sendall(data[index:index + 3])
+		thread = threading.Thread(target=send)
+		thread.start()
+		try:
+			self.assertEqual(protocol.receive(self.receiver), {"results" : [1, 2]})
+		finally:
+			thread.join()
+	
+	def test_closed(self):
+		self.sender.close()
+		self.assertIsNone(protocol.receive(self.receiver))
+	
+	def test_closed_in_message(self):
+		for data in (b"\x00\x00", struct.pack(">I", 10) + b'{"a"'):
+			with self.subTest(data=data):
+				sender, receiver = socket.socketpair()
+				try:
+					sender.sendall(data)
+					sender.close()
+					with self.assertRaises(protocol.ProtocolError):
+						protocol.receive(receiver)
+				finally:
+					receiver.close()
+	
+	def test_too_large(self):
+		self.sender.sendall(struct.pack(">I", protocol.MAX_MESSAGE_SIZE + 1))
+		with self.assertRaises(protocol.ProtocolError):
+			protocol.receive(self.receiver)
+
+
+class ConnectionTest(unittest.TestCase):
+	def setUp(self):
+		self.server = socket.create_server(("127.0.0.1", 0))
+		self.port = self.server.getsockname()[1]
+		self.requests = []
+		self.thread = threading.Thread(target=self.__serve)
+		self.thread.start()
+	
+	def tearDown(self):
+		self.thread.join()
+		self.server.close()
+	
+	def test_request(self):
+		# 1 connection carries several batches, a single command gets its own result back
+		with protocol.Connection("127.0.0.1", self.port) as connection:
+			self.assertEqual(connection.request({"command" : "stats"}), {"command" : "stats"})
+			commands = [{"command" : "targets"}, {"command" : "versions", "path" : "a b"}]
+			self.assertEqual(connection.request(commands), commands)
+			with self.assertRaises(protocol.ProtocolError):
+				connection.request({"command" : "fail"})
+		self.assertEqual(len(self.requests), 3)
+	
+	def __serve(self):
+		# echoes commands back as their results, and fails the whole batch on "fail"
+		connection, _ = self.server.accept()
+		with connection:
+			while True:
+				message = protocol.receive(connection)
+				if message is None:
+					return
+				self.requests.append(message)
+				commands = message["commands"]
+				if any(command["command"] == "fail" for command in commands):
+					protocol.send(connection, {"error" : "failed"})
+				else:
+					protocol.send(connection, {"results" : commands})
+
+
+if __name__ == "__main__":
+	unittest.main()
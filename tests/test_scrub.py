@@ -0,0 +1,48 @@
+"""
+/* --------------------------------
+   Scrubber tests
+
+ [Usage]
+ 1. Run "python -m unittest discover tests" or "python -m pytest tests" on this project
+-------------------------------- */
+"""
+from concurrent.futures import ProcessPoolExecutor
+import os
+import signal
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from index import VersionIndex
+import scrub
+from work import File
+
+
+class ScrubberTest(unittest.TestCase):
+	def test_hashed_on_store_verified(self):
+		# a version hashed on the way of its copy waits for the next interval, an unhashed one is verified first
+		with tempfile.TemporaryDirectory() as root:
+			index = VersionIndex(root)
+			try:
+				for name, hash in (("a", "0" * 64), ("b", None)):
+					version = File.Version(".bb.2601011200", os.path.join(root, name + ".bb.2601011200.txt"))
+					version.hash = hash
+					index.record(f"/w/{name}.txt", version)
+				
+				versions = index.find_versions_to_verify(time.time() - 3600, 10)
+				self.assertEqual([version.path for version in versions], ["/w/b.txt"])
+			finally:
+				index.close()
+	
+	@unittest.skipIf(os.name == "nt", "posix signals")
+	def test_workers_ignore_interrupt(self):
+		# Ctrl-C reaches the whole process group, only the owner of the pool handles it
+		with ProcessPoolExecutor(1, initializer=scrub._ignore_interrupt) as pool:
+			self.assertEqual(pool.submit(signal.getsignal, signal.SIGINT).result(), signal.SIG_IGN)
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,81 @@
+"""
+/* --------------------------------
+   Store burst durability benchmark
+
+ [Usage]
+ 1. Run "python tools/bench_durability.py [--files N] [--size BYTES] [--directories N] [--threads N] [--window SECONDS]" on this project
+ 2. A burst of journaled stores is copied in a temporary directory with each durability mode: none, per file fsync and group commit
+ 3. Run it on the drive of the repository, with "--root DIR_PATH", since fsync costs depend on the device
+-------------------------------- */
+"""
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from durability import Durability
+from journal import Journal
+
+
+def prepare(root, files, size, directories):
+	ret = []
+	for number in range(files):
+		directory = os.path.join(root, "work", f"directory{number % directories}")
+		os.makedirs(directory, exist_ok=True)
+		file_path = os.path.join(directory, f"file{number}.bin")
+		with open(file_path, "wb") as file:
+			file.write(os.urandom(size))
+		ret.append(file_path)
+	return ret
+
+
+def run(root, sources, mode, threads, window):
+	repository_root = os.path.join(root, f"repository-{mode}")
+	durability = Durability(mode, window)
+	journal = Journal(os.path.join(repository_root, ".bb.journal"), durability)
+	durable = []
+	
+	def store(source):
+		destination = os.path.join(repository_root, os.path.relpath(source, root) + ".bb")
+		os.makedirs(os.path.dirname(destination), exist_ok=True)
+		journal.copy(Journal.STORE, source, destination, on_durable=lambda: durable.append(destination))
+	
+	started = time.perf_counter()
+	with ThreadPoolExecutor(threads) as pool:
+		for future in [pool.submit(store, source) for source in sources]:
+			future.result()
+	durability.stop()
+	elapsed = time.perf_counter() - started
+	journal.close()
+	assert len(durable) == len(sources)
+	return elapsed, durability.metrics
+
+
+def main():
+	parser = ArgumentParser(description=__doc__)
+	parser.add_argument("--files", type=int, default=2000)
+	parser.add_argument("--size", type=int, default=16 * 1024)
+	parser.add_argument("--directories", type=int, default=20)
+	parser.add_argument("--threads", type=int, default=1,
+						help="concurrent stores, the watcher of a target stores one after another")
+	parser.add_argument("--window", type=float, default=0.05,
+						help="seconds of a group commit window")
+	parser.add_argument("--root", default=None, metavar="DIR_PATH",
+						help="directory the temporary files are made in")
+	args = parser.parse_args()
+	
+	with tempfile.TemporaryDirectory(dir=args.root) as root:
+		sources = prepare(root, args.files, args.size, args.directories)
+		print(f"{args.files} files x {args.size} bytes in {args.directories} directories, {args.threads} threads")
+		print(f"{'mode':<8}{'seconds':>10}{'files/s':>10}{'fsyncs':>10}{'groups':>10}")
+		for mode in Durability.MODES:
+			elapsed, metrics = run(root, sources, mode, args.threads, args.window)
+			print(f"{mode:<8}{elapsed:>10.2f}{args.files / elapsed:>10.0f}{metrics['fsyncs']:>10}{metrics['groups']:>10}")
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,81 @@
+"""
+/* --------------------------------
+   Snapshot export throughput benchmark
+
+ [Usage]
+ 1. Run "python tools/bench_export.py [--files N] [--size BYTES] [--versions N]" on this project
+ 2. A synthetic repository is made in a temporary directory, and exported in every format to the null device
+-------------------------------- */
+"""
+from argparse import ArgumentParser
+from collections import namedtuple
+import datetime
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from export import Exporter, FORMATS
+from index import VersionIndex
+import path
+from snapshot import FORMAT_TIMECODE, Snapshot
+
+
+Version = namedtuple("Version", ("key", "repository_file_path", "timecode", "reversion_timecode", "is_reversion"))
+
+
+def peak_memory():
+	try:
+		import resource
+	except ImportError:
+		return None
+	ret = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	return ret if sys.platform == "darwin" else ret * 1024
+
+
+def prepare(root, files, size, versions):
+	index = VersionIndex(os.path.join(root, "repository"))
+	chunk = os.urandom(size)
+	started = datetime.datetime(2024, 1, 1)
+	for number in range(files):
+		file_path = path.normalize(os.path.join(root, "work", f"directory{number % 100}", f"file{number}.bin"))
+		for count in range(versions):
+			timestamp = started + datetime.timedelta(minutes=count)
+			timecode = timestamp.strftime(FORMAT_TIMECODE)
+			repository_file_path = os.path.join(index.repository_root, "data", str(number), timecode)
+			os.makedirs(os.path.dirname(repository_file_path), exist_ok=True)
+			with open(repository_file_path, "wb") as file:
+				file.write(chunk)
+			os.utime(repository_file_path, (timestamp.timestamp(), timestamp.timestamp()))
+			index.record(file_path, Version(f".bb.{timecode}", repository_file_path, timecode, timecode, False))
+	return index, started + datetime.timedelta(minutes=versions)
+
+
+def main():
+	parser = ArgumentParser(description=__doc__)
+	parser.add_argument("--files", type=int, default=2000)
+	parser.add_argument("--size", type=int, default=256 * 1024)
+	parser.add_argument("--versions", type=int, default=3)
+	args = parser.parse_args()
+	
+	with tempfile.TemporaryDirectory() as root:
+		index, time_ = prepare(root, args.files, args.size, args.versions)
+		directory = path.normalize(os.path.join(root, "work"))
+		print(f"{args.files} files x {args.size} bytes, {args.versions} versions each")
+		print(f"{'format':<8}{'seconds':>10}{'MiB/s':>10}{'peak memory [MiB]':>20}")
+		for format in FORMATS:
+			exporter = Exporter(format)
+			started = time.perf_counter()
+			with open(os.devnull, "wb") as file:
+				exporter.export(Snapshot(index, directory, time_), file)
+			elapsed = time.perf_counter() - started
+			memory = peak_memory()
+			memory = f"{memory / (1024 * 1024):.1f}" if memory is not None else "-"
+			print(f"{format:<8}{elapsed:>10.2f}{exporter.bytes / (1024 * 1024) / elapsed:>10.1f}{memory:>20}")
+		index.close()
+
+
+if __name__ == "__main__":
+	main()
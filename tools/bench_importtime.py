@@ -0,0 +1,75 @@
+"""
+/* --------------------------------
+   Import time benchmark based on "python -X importtime"
+
+ [Usage]
+ 1. Run "python tools/bench_importtime.py [--repeat N] [--top N] [--budget MS] [MODULE ...]" on this project
+ 2. Without any MODULE, the startup modules "app", "daemon" and "engine" are measured
+ 3. With --budget, it exits with 1 when any module takes longer than MS to import
+-------------------------------- */
+"""
+from argparse import ArgumentParser
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+
+_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def measure(module, root):
+	"""
+	returns cumulative microseconds of the module and self microseconds of each imported module
+	"""
+	completed = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=root, capture_output=True, text=True)
+	if completed.returncode != 0:
+		raise RuntimeError(completed.stderr.strip().splitlines()[-1])
+	
+	total = 0
+	details = {}
+	for line in completed.stderr.splitlines():
+		m = _LINE.match(line)
+		if m is None:
+			continue
+		self_time, cumulative_time, indent, name = m.groups()
+		details[name] = details.get(name, 0) + int(self_time)
+		if name == module and len(indent) == 1:
+			total = int(cumulative_time)
+	return total, details
+
+
+def main():
+	parser = ArgumentParser(description=__doc__)
+	parser.add_argument("modules", nargs="*", default=["app", "daemon", "engine"], metavar="MODULE")
+	parser.add_argument("--repeat", type=int, default=5)
+	parser.add_argument("--top", type=int, default=10)
+	parser.add_argument("--budget", type=float, default=0.0, metavar="MS")
+	args = parser.parse_args()
+	
+	root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+	is_over = False
+	for module in args.modules:
+		try:
+			runs = [measure(module, root) for count in range(args.repeat)]
+		except RuntimeError as ex:
+			print(f"{module}: unavailable: {ex}")
+			continue
+		
+		total = statistics.median(run[0] for run in runs) / 1000
+		print(f"{module}: {total:.1f} ms")
+		names = set().union(*(run[1] for run in runs))
+		self_times = {name : statistics.median(run[1].get(name, 0) for run in runs) for name in names}
+		for name in sorted(self_times, key=self_times.get, reverse=True)[:args.top]:
+			print(f"  {self_times[name] / 1000:>8.1f} ms  {name}")
+		
+		if args.budget and args.budget < total:
+			print(f"  over the budget {args.budget:.1f} ms")
+			is_over = True
+	
+	sys.exit(1 if is_over else 0)
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,89 @@
+"""
+/* --------------------------------
+   Startup time and memory benchmark, headless daemon against the GUI build
+
+ [Usage]
+ 1. Quit the resident application, the benchmark needs the singleton port
+ 2. Run "python tools/bench_startup.py [--repeat N]" on this project
+-------------------------------- */
+"""
+from argparse import ArgumentParser
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+
+_PROBE = r"""
+import json, os, sys, time
+started = time.perf_counter()
+sys.path.insert(0, {root!r})
+os.chdir({work!r})
+
+if {headless!r}:
+	from daemon import Daemon
+	instance = Daemon(sys.argv)
+else:
+	from app import Application
+	instance = Application()
+instance.start()
+elapsed = time.perf_counter() - started
+
+def peak_memory():
+	try:
+		import resource
+		ret = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+		return ret if sys.platform == "darwin" else ret * 1024
+	except ImportError:
+		import ctypes
+		from ctypes import wintypes
+		class Counters(ctypes.Structure):
+			_fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD),
+						("PeakWorkingSetSize", ctypes.c_size_t), ("WorkingSetSize", ctypes.c_size_t),
+						("QuotaPeakPagedPoolUsage", ctypes.c_size_t), ("QuotaPagedPoolUsage", ctypes.c_size_t),
+						("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t), ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+						("PagefileUsage", ctypes.c_size_t), ("PeakPagefileUsage", ctypes.c_size_t)]
+		counters = Counters()
+		counters.cb = ctypes.sizeof(counters)
+		ctypes.windll.psapi.GetProcessMemoryInfo(ctypes.windll.kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb)
+		return counters.PeakWorkingSetSize
+
+print(json.dumps({{"seconds" : elapsed, "peak_memory" : peak_memory(), "qt_widgets" : "PySide6.QtWidgets" in sys.modules}}))
+sys.stdout.flush()
+instance.stop()
+"""
+
+
+def measure(headless, repeat):
+	root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+	results = []
+	for count in range(repeat):
+		with tempfile.TemporaryDirectory() as work:
+			code = _PROBE.format(root=root, work=work, headless=headless)
+			completed = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+			if completed.returncode != 0 or not completed.stdout.strip():
+				return None, completed.stderr.strip().splitlines()[-1:] or ["failed"]
+			results.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+	return results, None
+
+
+def main():
+	parser = ArgumentParser(description=__doc__)
+	parser.add_argument("--repeat", type=int, default=5)
+	args = parser.parse_args()
+	
+	print(f"{'build':<10}{'startup [ms]':>16}{'peak memory [MiB]':>20}{'Qt widgets':>12}")
+	for name, headless in (("headless", True), ("gui", False)):
+		results, error = measure(headless, args.repeat)
+		if results is None:
+			print(f"{name:<10}unavailable: {error[0]}")
+			continue
+		seconds = statistics.median(result["seconds"] for result in results)
+		peak_memory = statistics.median(result["peak_memory"] for result in results)
+		print(f"{name:<10}{seconds * 1000:>16.1f}{peak_memory / (1024 * 1024):>20.1f}{str(results[0]['qt_widgets']):>12}")
+
+
+if __name__ == "__main__":
+	main()
@@ -10,5 +10,5 @@
 
 @cd /d %~dp0..\
 
-@pyinstaller __main__.py --onefile --noconsole --icon=assets/app.ico --name=backup_breadcrumb.exe
+@pyinstaller __main__.py --onefile --noconsole --icon=assets/app.ico --add-data "assets/app.ico;assets" --name=backup_breadcrumb.exe
 @exit /b
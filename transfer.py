@@ -0,0 +1,199 @@
+"""
+/* --------------------------------
+   Copy engine
+
+ - token bucket throttles on bytes/s and operations/s shared by every store and restore copy
+ - keeps backup traffic out of the page cache where posix_fadvise is available
+ - hashes content on the way of copies, and apart from them for the scrubber
+-------------------------------- */
+"""
+import hashlib
+import os
+import shutil
+import threading
+import time
+
+
+class TokenBucket:
+	"""
+	rate limiter, consumers may run into debt and then wait for it to be paid back
+	"""
+	def __init__(self, rate=0, capacity=None):
+		self.__lock = threading.Lock()
+		self.__rate = 0
+		self.__capacity = 0
+		self.__tokens = 0
+		self.__timestamp = time.monotonic()
+		self.setup(rate, capacity)
+	
+	@property
+	def rate(self):
+		return self.__rate
+	
+	def consume(self, amount):
+		"""
+		blocks until amount is allowed to pass
+		"""
+		if self.__rate <= 0:
+			return
+		
+		with self.__lock:
+			now = time.monotonic()
+			self.__tokens = min(self.__capacity, self.__tokens + (now - self.__timestamp) * self.__rate)
+			self.__timestamp = now
+			self.__tokens -= amount
+			wait = -self.__tokens / self.__rate if self.__tokens < 0 else 0
+		
+		if wait > 0:
+			time.sleep(wait)
+	
+	def setup(self, rate, capacity=None):
+		with self.__lock:
+			self.__rate = rate or 0
+			# 1 second burst by default
+			self.__capacity = capacity if capacity is not None else self.__rate
+			self.__tokens = self.__capacity
+			self.__timestamp = time.monotonic()
+
+
+class Throttle:
+	"""
+	pair of byte and operation buckets, every consumption is forwarded to the parent throttle too
+	"""
+	def __init__(self, bytes_per_second=0, operations_per_second=0, parent=None):
+		self.__bytes = TokenBucket(bytes_per_second)
+		self.__operations = TokenBucket(operations_per_second)
+		self.__drops_cache = None
+		self.__parent = parent
+	
+	@property
+	def bytes_per_second(self):
+		return self.__bytes.rate
+	
+	@bytes_per_second.setter
+	def bytes_per_second(self, value):
+		self.__bytes.setup(value)
+	
+	@property
+	def drops_cache(self):
+		"""
+		inherited from the parent when not specified
+		"""
+		if self.__drops_cache is not None:
+			return self.__drops_cache
+		if self.__parent is not None:
+			return self.__parent.drops_cache
+		return True
+	
+	@drops_cache.setter
+	def drops_cache(self, value):
+		self.__drops_cache = value
+	
+	@property
+	def operations_per_second(self):
+		return self.__operations.rate
+	
+	@operations_per_second.setter
+	def operations_per_second(self, value):
+		self.__operations.setup(value)
+	
+	@property
+	def parent(self):
+		return self.__parent
+	
+	@parent.setter
+	def parent(self, value):
+		self.__parent = value
+	
+	def acquire_bytes(self, amount):
+		self.__bytes.consume(amount)
+		if self.__parent is not None:
+			self.__parent.acquire_bytes(amount)
+	
+	def acquire_operation(self):
+		self.__operations.consume(1)
+		if self.__parent is not None:
+			self.__parent.acquire_operation()
+	
+	def deserialize(self, data):
+		self.bytes_per_second = data.get("bytes_per_second", 0)
+		self.operations_per_second = data.get("operations_per_second", 0)
+		if "drops_cache" in data:
+			self.drops_cache = data["drops_cache"]
+	
+	def serialize(self):
+		ret = {
+			"bytes_per_second" :		self.bytes_per_second,
+			"operations_per_second" :	self.operations_per_second,
+		}
+		if self.__drops_cache is not None:
+			ret["drops_cache"] = self.__drops_cache
+		
+		return ret
+
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def copy(source, destination, throttle=None, drops_source_cache=False, digest=None):
+	"""
+	works like shutil.copy2, returns the number of copied bytes
+	
+	digest is a hashlib object updated with the copied bytes, so that the content is hashed without reading it again
+	pages of destination are dirty until it is synced, they are dropped by durability.Durability.sync instead
+	"""
+	if throttle is not None:
+		throttle.acquire_operation()
+	drops_cache = is_dropping_cache(throttle)
+	
+	ret = 0
+	buffer = bytearray(CHUNK_SIZE)
+	view = memoryview(buffer)
+	with open(source, "rb") as source_file, open(destination, "wb") as destination_file:
+		if drops_cache:
+			os.posix_fadvise(source_file.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+		
+		while True:
+			size = source_file.readinto(buffer)
+			if not size:
+				break
+			if throttle is not None:
+				throttle.acquire_bytes(size)
+			destination_file.write(view[:size])
+			if digest is not None:
+				digest.update(view[:size])
+			ret += size
+		
+		if drops_cache and drops_source_cache:
+			os.posix_fadvise(source_file.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+	
+	shutil.copystat(source, destination)
+	return ret
+
+
+def hash_file(file_path, drops_cache=True):
+	"""
+	returns the sha256 hex digest of the content of file_path
+	"""
+	digest = hashlib.sha256()
+	buffer = bytearray(CHUNK_SIZE)
+	view = memoryview(buffer)
+	drops_cache = drops_cache and hasattr(os, "posix_fadvise")
+	with open(file_path, "rb") as file:
+		if drops_cache:
+			os.posix_fadvise(file.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+		while True:
+			size = file.readinto(buffer)
+			if not size:
+				break
+			digest.update(view[:size])
+		if drops_cache:
+			os.posix_fadvise(file.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+	return digest.hexdigest()
+
+
+def is_dropping_cache(throttle=None):
+	"""
+	whether copies made with throttle keep their pages out of the page cache
+	"""
+	return hasattr(os, "posix_fadvise") and (throttle is None or throttle.drops_cache)
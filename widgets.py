@@ -8,9 +8,12 @@
 import os
 import subprocess
 
-from PySide6.QtCore import QDir, QEvent, QSize, Qt, Signal
-from PySide6.QtGui import QColor, QPalette
-from PySide6.QtWidgets import QAbstractItemView, QApplication, QComboBox, QFileSystemModel, QLineEdit, QMenu, QPushButton, QStyle, QStyledItemDelegate, QTabWidget, QTreeView, QWidget
+from PySide6.QtCore import QDir, QEvent, QSize, Qt, QTimer, Signal
+from PySide6.QtGui import QColor, QPalette, QStandardItem, QStandardItemModel
+from PySide6.QtWidgets import QAbstractItemView, QApplication, QComboBox, QFileSystemModel, QHBoxLayout, QLabel, QLineEdit, QMenu, QPushButton, QStyle, QStyledItemDelegate, QTabWidget, QTreeView, QWidget
+
+from engine import Engine
+import metrics
 
 
 class BreadcrumbNavigation(QWidget):
@@ -164,6 +167,50 @@ class FileTreeView(QTreeView):
 			self.hideColumn(index)
 
 
+class StatusPanel(QWidget):
+	"""
+	lag of the backup on the status bar
+	"""
+	def __init__(self, parent=None):
+		super().__init__(parent)
+		self.__setup()
+	
+	def set_status(self, status):
+		"""
+		shows engine.Engine.status, only labels are updated
+		"""
+		state = status.get("state", Engine.IDLE)
+		self.__state_label.setText(self.tr(self.__STATE_TEXTS[state]))
+		self.__state_label.setStyleSheet(f"color: {self.__STATE_COLORS[state]}" if state in self.__STATE_COLORS else "")
+		
+		self.__queue_label.setText(self.tr("Queued: {0}").format(status.get("queued", 0)))
+		oldest_pending_seconds = status.get("oldest_pending_seconds", 0)
+		self.__lag_label.setText(self.tr("Oldest change waiting: {0}").format(metrics.format_seconds(oldest_pending_seconds)) if oldest_pending_seconds else "")
+		retry_pending = status.get("retry_pending", 0)
+		self.__retry_label.setText(self.tr("Retries: {0}").format(retry_pending) if retry_pending else "")
+		self.__stored_label.setText(self.tr("Stored: {0} versions, {1}").format(status.get("stored", 0), metrics.format_bytes(status.get("copied_bytes", 0))))
+	
+	__STATE_COLORS = {Engine.BUSY : "#2d7ff9", Engine.BEHIND : "#e8453c"}
+	
+	__STATE_TEXTS = {Engine.IDLE : "Up to date", Engine.BUSY : "Busy", Engine.BEHIND : "Behind"}
+	
+	def __setup(self):
+		self.__state_label = QLabel(self)
+		self.__queue_label = QLabel(self)
+		self.__lag_label = QLabel(self)
+		self.__retry_label = QLabel(self)
+		self.__stored_label = QLabel(self)
+		
+		layout = QHBoxLayout()
+		layout.setContentsMargins(0, 0, 0, 0)
+		for label in (self.__state_label, self.__queue_label, self.__lag_label, self.__retry_label):
+			layout.addWidget(label)
+		layout.addStretch()
+		layout.addWidget(self.__stored_label)
+		self.setLayout(layout)
+		self.set_status({})
+
+
 class TabWidget(QTabWidget):
 	"""
 	appends add tab button
@@ -309,6 +356,19 @@ class TargetTreeView(QTreeView):
 	def current_path(self):
 		return self.__common.breadcrumb_path
 	
+	@property
+	def is_showing_deleted(self):
+		return self.__is_showing_deleted
+	
+	@is_showing_deleted.setter
+	def is_showing_deleted(self, value):
+		if value == self.__is_showing_deleted:
+			return
+		
+		self.__is_showing_deleted = value
+		self.__show_deleted_action.setChecked(value)
+		self.__update_model()
+	
 	@property
 	def target(self):
 		return self.__common.target
@@ -323,6 +383,9 @@ class TargetTreeView(QTreeView):
 	def item(self, index):
 		return self.model().index(index.row(), 0, index.parent())
 	
+	def inquiry(self, file_path):
+		return self.window().application.inquiry(file_path, self.is_showing_deleted)
+	
 	def paintEvent(self, event):
 		super().paintEvent(event)
 		header = self.header()
@@ -333,6 +396,9 @@ class TargetTreeView(QTreeView):
 			self.__is_shown = True
 			self.header().sectionResized.connect(self.__on_header_section_resized)
 	
+	def refresh(self):
+		self.__update_model()
+	
 	def setup(self):
 		self.target.rootChanged.connect(self.__update_model)
 		self.target.recursiveChanged.connect(self.__update_model)
@@ -373,6 +439,43 @@ class TargetTreeView(QTreeView):
 			
 			return ret
 	
+	class __DeletedModel(QStandardItemModel):
+		"""
+		deleted files of the directory listed from the version index
+		"""
+		def __init__(self, parent=None):
+			super().__init__(parent)
+			self.__setup()
+		
+		def filePath(self, index):
+			return self.data(self.index(index.row(), 0, index.parent()), Qt.UserRole)
+		
+		def flags(self, index):
+			ret = super().flags(index) & ~Qt.ItemIsEditable
+			if index.isValid():
+				if index.column() == self.columnCount() - 1:
+					ret |= Qt.ItemIsEditable
+			
+			return ret
+		
+		def headerData(self, section, orientation, role=Qt.DisplayRole):
+			if section == self.columnCount() - 1:
+				if role == Qt.DecorationRole:
+					return self.parent().window().application.icon
+			
+			return super().headerData(section, orientation, role)
+		
+		def setup(self, directory):
+			for tombstone in self.parent().window().application.get_deleted_files(directory):
+				name_item = QStandardItem(os.path.basename(tombstone.path))
+				name_item.setData(tombstone.path, Qt.UserRole)
+				deleted_item = QStandardItem(tombstone.timestamp.strftime("%Y/%m/%d %H:%M"))
+				version_item = QStandardItem()
+				self.appendRow([name_item, deleted_item, version_item])
+		
+		def __setup(self):
+			self.setHorizontalHeaderLabels([self.tr("Name"), self.tr("Date Deleted"), self.tr("Version")])
+	
 	class __ItemDelegate(QStyledItemDelegate):
 		def __init__(self, parent=None):
 			super().__init__(parent)
@@ -383,8 +486,11 @@ class TargetTreeView(QTreeView):
 				if index.column() == self.parent().header().count() - 1:
 					ret = self.__ComboBoxCell(parent)
 					file_path = self.parent().filePath(index)
-					file = self.parent().window().application.inquiry(file_path)
-					for version in reversed(file.versions):
+					if self.parent().is_showing_deleted:
+						versions = self.parent().window().application.find_versions(file_path)
+					else:
+						versions = self.parent().inquiry(file_path).versions
+					for version in reversed(versions):
 						if version.is_reversion:
 							continue
 						ret.addItem(version.timestamp.strftime("%Y/%m/%d %H:%M"), version)
@@ -398,8 +504,10 @@ class TargetTreeView(QTreeView):
 			if index.isValid():
 				if index.column() == self.parent().header().count() - 1:
 					file_path = self.parent().filePath(index)
-					file = self.parent().window().application.inquiry(file_path)
-					if file.current_version.is_reversion:
+					file = self.parent().inquiry(file_path)
+					if self.parent().is_showing_deleted:
+						return
+					if file.current_version is not None and file.current_version.is_reversion:
 						version = file.find_version(file.current_version.reversion_timecode)
 						if version:
 							position = editor.findData(version)
@@ -413,10 +521,13 @@ class TargetTreeView(QTreeView):
 			if index.isValid():
 				if index.column() == self.parent().header().count() - 1:
 					file_path = self.parent().filePath(index)
-					file = self.parent().window().application.inquiry(file_path)
+					file = self.parent().inquiry(file_path)
 					version = editor.currentData()
 					if version:
-						file.restore(version.timecode)
+						self.parent().window().application.restore_file(file, version.timecode)
+						if self.parent().is_showing_deleted:
+							# the restored file is no more deleted, rebuild after the editor has been closed
+							QTimer.singleShot(0, self.parent().refresh)
 						return
 			
 			super().setModelData(editor, model, index)
@@ -474,8 +585,12 @@ class TargetTreeView(QTreeView):
 			else:
 				self.column_sizes[index] = size
 	
+	def __on_show_deleted_toggled(self, checked):
+		self.is_showing_deleted = checked
+	
 	def __setup(self):
 		self.__is_shown = False
+		self.__is_showing_deleted = False
 		self.__setup_context_menu()
 		
 		self.setItemDelegate(self.__ItemDelegate(self))
@@ -497,6 +612,12 @@ class TargetTreeView(QTreeView):
 
 		action = self.__context_menu.addAction(self.tr("Show in explorer"))
 		action.triggered.connect(self.__explore)
+		
+		self.__context_menu.addSeparator()
+		
+		self.__show_deleted_action = self.__context_menu.addAction(self.tr("Show deleted files"))
+		self.__show_deleted_action.setCheckable(True)
+		self.__show_deleted_action.toggled.connect(self.__on_show_deleted_toggled)
 	
 	def __start(self, path):
 		# explorer would choke on forward slashes
@@ -508,6 +629,12 @@ class TargetTreeView(QTreeView):
 			subprocess.run(f"\"{path}\"", shell=True)
 	
 	def __update_model(self):
+		if self.is_showing_deleted:
+			model = self.__DeletedModel(self)
+			model.setup(self.current_path)
+			self.setModel(model)
+			return
+		
 		model = self.__DirectoryModel(self)
 		index = model.setRootPath(self.current_path)
 		self.setModel(model)
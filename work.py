@@ -6,16 +6,30 @@
 -------------------------------- */
 """
 import datetime
+import hashlib
 import logging
 import os
 import re
-import shutil
+import threading
+import time
 
 from PySide6.QtCore import QObject, Signal
-from watchdog.events import FileCreatedEvent, FileDeletedEvent, FileModifiedEvent, FileMovedEvent, FileSystemEventHandler
+from watchdog.events import DirDeletedEvent, DirMovedEvent, FileCreatedEvent, FileDeletedEvent, FileModifiedEvent, FileMovedEvent, FileSystemEventHandler
 from watchdog.observers import Observer
 
+from ignore import IgnoreRules
+import journal
+from journal import Journal
+import metrics
 import path
+from storage import StoragePolicy
+import transfer
+
+
+_STORES = metrics.REGISTRY.counter("bb_stores_total", "versions stored")
+_SKIPPED_STORES = metrics.REGISTRY.counter("bb_skipped_stores_total", "stores with nothing new to keep")
+_STORE_FAILURES = metrics.REGISTRY.counter("bb_store_failures_total", "stores failed, to be retried")
+_ACTIVATE_SECONDS = metrics.REGISTRY.histogram("bb_activate_seconds", "duration of the initial scan of a target", buckets=(0.1, 1.0, 10.0, 60.0, 300.0, 1800.0, 7200.0))
 
 
 class File(QObject):
@@ -32,6 +46,17 @@ class File(QObject):
 		def key(self):
 			return self.__key
 		
+		@property
+		def hash(self):
+			"""
+			sha256 of the content, known only for versions stored by this process
+			"""
+			return self.__hash
+		
+		@hash.setter
+		def hash(self, value):
+			self.__hash = value
+		
 		@property
 		def is_reversion(self):
 			return self.__is_reversion
@@ -53,6 +78,7 @@ class File(QObject):
 			return datetime.datetime.fromtimestamp(os.path.getmtime(self.repository_file_path))
 		
 		def __setup(self):
+			self.__hash = None
 			self.__is_reversion = False
 			self.__reversion_timecode = None
 			self.__timecode = None
@@ -71,7 +97,19 @@ class File(QObject):
 	def __init__(self, path, parent=None):
 		super().__init__(parent)
 		self.__path = File.normalize(path)
-		self.__repository_root = parent.repository_root 
+		# kept apart from the Qt parent, which is dropped for a file made on a watcher thread
+		self.__repository = parent
+		self.__shards = parent.shards
+		self.__index = parent.index
+		self.__journal = parent.journal
+		self.__layout = parent.layout
+		self.__storage = parent.storage
+		self.__throttle = parent.throttle
+		# versions waiting for their group commit, to the version each of them replaces once published
+		self.__pending_versions = {}
+		self.__versions_lock = threading.Lock()
+		# stores of the observer, the lanes and the retries of the same file are made 1 at a time
+		self.__store_lock = threading.Lock()
 		self.__setup()
 	
 	def __iter__(self):
@@ -85,10 +123,7 @@ class File(QObject):
 	
 	@staticmethod
 	def normalize(file_path):
-		sections = path.explode(os.path.normpath(file_path).lower())
-		for index in range(len(sections)):
-			sections[index] = path.rstrippath(sections[index])
-		return "/".join(sections)
+		return path.normalize(file_path)
 	
 	@property
 	def current_version(self):
@@ -102,6 +137,10 @@ class File(QObject):
 	def extension(self):
 		return self.__extension
 	
+	@property
+	def last_error(self):
+		return self.__last_error
+	
 	@property
 	def last_version(self):
 		ret = None
@@ -124,6 +163,17 @@ class File(QObject):
 	def repository_directory(self):
 		return self.__repository_directory
 	
+	@property
+	def repository_root(self):
+		"""
+		root of the shard that holds the versions
+		"""
+		return self.__shards.root_of(self.__shard)
+	
+	@property
+	def shard(self):
+		return self.__shard
+	
 	@property
 	def versions(self):
 		return [*self.__versions]
@@ -139,7 +189,80 @@ class File(QObject):
 		
 		return None
 	
-	def restore(self, timecode):
+	def relocate(self, file_path):
+		"""
+		re-links all versions to file_path by renaming them inside the repository
+		
+		a version whose key file_path already has is never overwritten, and stays with the old path
+		"""
+		file_path = File.normalize(file_path)
+		directory, name = path.rsplitpath(file_path)
+		name, extension = os.path.splitext(name)
+		# versions stay on their shard, renames never cross volumes
+		repository_directory = self.__layout.version_directory(self.__shards.root_of(self.__shard), file_path)
+		keys = {version.key for version in self.__index.find_versions(file_path)}
+		
+		relocated = []
+		try:
+			if self.__versions:
+				os.makedirs(repository_directory, exist_ok=True)
+			for version in self.__versions:
+				file_name = name + version.key + extension
+				if version.key in keys or os.path.exists(repository_directory + file_name):
+					logging.error("KEPT: %s %s, %s has the same version", self.path, version.key, file_path)
+					continue
+				os.replace(version.repository_file_path, repository_directory + file_name)
+				moved = self.Version(version.key, repository_directory + file_name)
+				moved.hash = version.hash
+				relocated.append(moved)
+			if self.__versions and len(relocated) == len(self.__versions) and self.__layout.is_per_file:
+				os.rmdir(self.repository_directory)
+		
+		except Exception as ex:
+			logging.error("ERROR: %s", ex)
+		
+		# rows are moved in place, so that their hashes and the other rows of file_path are kept
+		self.__index.relocate_versions(self.path, file_path, relocated)
+		self.__path = file_path
+		self.__setup()
+	
+	@staticmethod
+	def relocate_directory(shards, directory_path, to, index, layout):
+		"""
+		re-links the versions of all files under directory_path to be under the directory to
+		tree layouts mirror source directories, so that a single rename moves the whole tree on each shard
+		"""
+		directory_path = path.normalize_dir_expression(File.normalize(directory_path))
+		to = path.normalize_dir_expression(File.normalize(to))
+		if not layout.is_tree:
+			File.__relocate_hashed_directory(shards, directory_path, to, index, layout)
+			return
+		
+		is_relocated = False
+		for root in shards.roots:
+			source = layout.directory_of(root, directory_path)
+			destination = layout.directory_of(root, to)
+			if not os.path.isdir(source):
+				continue
+			
+			try:
+				if not os.path.exists(destination):
+					os.makedirs(os.path.dirname(path.rstrippath(destination)), exist_ok=True)
+					os.rename(source, destination)
+				else:
+					# destination already has histories, so merge both trees entry by entry
+					File.__merge_directory(source, destination)
+				is_relocated = True
+			
+			except Exception as ex:
+				logging.error("ERROR: %s", ex)
+		
+		if is_relocated:
+			# rows are relative to their shard root, so that 1 rewrite covers every shard
+			root = shards.root_of(0)
+			index.relocate_directory(directory_path, to, layout.directory_of(root, directory_path), layout.directory_of(root, to))
+	
+	def restore(self, timecode, throttle=None):
 		version = self.find_version(timecode)
 		if version is None:
 			return False
@@ -156,92 +279,187 @@ class File(QObject):
 		self.__current_version = self.Version(key, file_path)
 		try:
 			os.makedirs(self.repository_directory, exist_ok=True)
+			throttle = throttle or self.__throttle
 			if not is_last:
-				shutil.copy2(version.repository_file_path, file_path)
-			shutil.copy2(version.repository_file_path, self.path)
+				digest = hashlib.sha256()
+				self.__journal.copy(Journal.STORE, version.repository_file_path, file_path, throttle, drops_source_cache=True, drops_destination_cache=True, digest=digest)
+				self.__current_version.hash = digest.hexdigest()
+			os.makedirs(self.directory, exist_ok=True)
+			self.__journal.copy(Journal.RESTORE, version.repository_file_path, self.path, throttle, drops_source_cache=True)
 			
 			while self.__versions:
 				if not self.__versions[-1].is_reversion:
 					break
-				os.remove(self.__versions.pop().repository_file_path)
+				reversion = self.__versions.pop()
+				os.remove(reversion.repository_file_path)
+				self.__index.forget(self.path, reversion.key)
 			
 			if not is_last:
 				self.__versions.append(self.__current_version)
+				self.__index.record(self.path, self.__current_version)
+			self.__index.revive(self.path)
 		
 		except Exception as ex:
-			logging.error(f"{datetime.datetime.now()} ERROR: {ex}")
+			logging.error("ERROR: %s", ex)
 		
 		self.__current_version = self.__versions[-1]
 		return True
 	
-	def store(self):
-		timecode = File.__generate_timecode(self.path)
-		key = f"{File.SUBEXTENSION_REPOSITORY}.{timecode}"
+	def store(self, throttle=None, storage=None, on_durable=None):
+		"""
+		returns False when the copy failed, the reason is kept as last_error
 		
-		diff = int(timecode)
-		if self.current_version is not None:
-			diff -= int(self.current_version.timecode)
+		storage is the storage.StoragePolicy of the target, the one of the repository by default
+		on_durable is called once a new version is in place and indexed, never when nothing new has been kept
+		"""
+		with self.__store_lock:
+			return self.__store_version(throttle, storage, on_durable)
+	
+	__FORMAT_TIMECODE = "%y%m%d%H%M"
+	
+	def __deduplicate(self, version):
+		original = self.__index.find_version_by_hash(version.hash)
+		if original is None:
+			return
+		original_file_path = self.__index.repository_file_path(original)
+		if os.path.normcase(os.path.abspath(original_file_path)) == os.path.normcase(os.path.abspath(version.repository_file_path)):
+			return
 		
-		version = self.find_version(timecode)
-		if version is not None:
-			if version is not self.current_version:
-				return
-			if diff == 0 or diff == 1:
+		# linked beside the version and renamed over it, so that the version is never missing
+		temporary_file_path = version.repository_file_path + journal.TEMPORARY_EXTENSION
+		try:
+			# a link has the modification time of the original, which would become the time of the version
+			if os.stat(original_file_path).st_mtime_ns != os.stat(version.repository_file_path).st_mtime_ns:
 				return
+			os.link(original_file_path, temporary_file_path)
+			os.replace(temporary_file_path, version.repository_file_path)
+		except OSError as ex:
+			# on another volume, or out of links, so that the copy is kept
+			logging.info("UNDEDUPLICATED: %s %s", version.repository_file_path, ex)
+			if os.path.exists(temporary_file_path):
+				os.remove(temporary_file_path)
+	
+	@staticmethod
+	def __generate_timecode(file_path):
+		ret = datetime.datetime.fromtimestamp(os.path.getmtime(file_path)).strftime(File.__FORMAT_TIMECODE)
+		return ret
+	
+	@staticmethod
+	def __merge_directory(source, destination):
+		for current_directory, directories, file_names in os.walk(source, topdown=False):
+			relative_directory = os.path.relpath(current_directory, source)
+			destination_directory = os.path.normpath(os.path.join(destination, relative_directory))
+			os.makedirs(destination_directory, exist_ok=True)
+			for file_name in file_names:
+				os.replace(os.path.join(current_directory, file_name), os.path.join(destination_directory, file_name))
+			os.rmdir(current_directory)
+	
+	@staticmethod
+	def __relocate_hashed_directory(shards, directory_path, to, index, layout):
+		# hashed directories follow file paths, so that every file under directory_path moves on its own
+		entries = {}
+		for entry in index.find_versions_under(directory_path):
+			entries.setdefault(entry.path, []).append(entry)
+		
+		for file_path, versions in entries.items():
+			file_to = to + file_path[len(directory_path):]
+			root = shards.root_of(versions[0].shard)
+			source = layout.version_directory(root, file_path)
+			destination = layout.version_directory(root, file_to)
+			try:
+				if os.path.isdir(source):
+					if not os.path.exists(destination):
+						os.makedirs(os.path.dirname(path.rstrippath(destination)), exist_ok=True)
+						os.rename(source, destination)
+					else:
+						File.__merge_directory(source, destination)
+			except Exception as ex:
+				logging.error("ERROR: %s", ex)
+			index.relocate(file_path, file_to)
+			# registered again at once, so that the shard of file_to is known before its next inquiry
+			relocated = [File.Version(version.key, destination + path.rsplitpath(version.repository_path)[1]) for version in index.find_versions(file_to) + versions]
+			index.register(file_to, [version for version in relocated if os.path.isfile(version.repository_file_path)])
+	
+	def __store_version(self, throttle, storage, on_durable):
+		try:
+			timecode = File.__generate_timecode(self.path)
+		except OSError as ex:
+			self.__last_error = ex
+			_STORE_FAILURES.inc()
+			return False
 		
+		key = f"{File.SUBEXTENSION_REPOSITORY}.{timecode}"
 		file_name = self.name + key + self.extension
 		file_path = self.repository_directory + file_name
+		version = self.Version(key, file_path)
+		
+		with self.__versions_lock:
+			# versions waiting for their group are stored already, so that the same minute is never copied twice
+			stored_versions = [*self.__versions, *self.__pending_versions]
+			if any(stored_version.timecode == timecode for stored_version in stored_versions):
+				_SKIPPED_STORES.inc()
+				return True
+			
+			# the newest version replaces the one of the previous minute, once it is in place itself
+			latest_version = [*self.__pending_versions][-1] if self.__pending_versions else self.__current_version
+			is_replacing = latest_version is not None and int(timecode) - int(latest_version.timecode) == 1
+			self.__pending_versions[version] = latest_version if is_replacing else None
+		
+		digest = hashlib.sha256()
+		storage = storage or self.__storage
+		def on_indexed():
+			# published with the group commit of the copy, its rows are committed once for the group
+			version.hash = digest.hexdigest()
+			if storage.deduplicates:
+				self.__deduplicate(version)
+			self.__index.record(self.path, version, commits=False)
+			with self.__versions_lock:
+				replaced_version = self.__pending_versions.pop(version, None)
+				# a replaced version which failed its own commit has never been published
+				is_replaced = replaced_version in self.__versions
+				if is_replaced:
+					self.__versions.remove(replaced_version)
+				self.__versions.append(version)
+				self.__current_version = version
+			if is_replaced:
+				try:
+					os.remove(replaced_version.repository_file_path)
+				except OSError as ex:
+					logging.error("ERROR: %s", ex)
+				self.__index.forget(self.path, replaced_version.key, commits=False)
+			if on_durable is not None:
+				on_durable()
+		
+		def on_aborted():
+			with self.__versions_lock:
+				self.__pending_versions.pop(version, None)
 		
-		self.__current_version = self.Version(key, file_path)
 		try:
 			os.makedirs(self.repository_directory, exist_ok=True)
-			shutil.copy2(self.path, file_path)
-			
-			if diff == 0 or diff == 1:
-				current_version = self.__versions.pop()
-				if diff:
-					os.remove(current_version.repository_file_path)
-			
-			self.__versions.append(self.__current_version)
+			if storage.compresses:
+				self.__repository.compress_directory(self.repository_directory)
+			self.__journal.copy(Journal.STORE, self.path, file_path, throttle or self.__throttle, drops_destination_cache=True, digest=digest,
+								on_durable=on_indexed, on_abort=on_aborted, on_group=self.__index.commit)
 		
 		except Exception as ex:
-			logging.error(f"{datetime.datetime.now()} ERROR: {ex}")
+			logging.error("ERROR: %s", ex)
+			on_aborted()
+			self.__last_error = ex
+			_STORE_FAILURES.inc()
+			return False
 		
-		self.__current_version = self.__versions[-1]
-	
-	__FORMAT_TIMECODE = "%y%m%d%H%M"
-	
-	@staticmethod
-	def __derepository(file_path):
-		head, tail = path.lsplitpath(file_path)
-		if head.endswith("/"):
-			tail = head[-1] + tail
-			head = head[:-1]
-		if head.startswith("@"):
-			head = head[1:] + ":"
-		ret = head + tail
-		return ret
-	
-	@staticmethod
-	def __enrepository(file_path):
-		head, tail = path.lsplitpath(file_path)
-		if head.endswith("/"):
-			tail = head[-1] + tail
-			head = head[:-1]
-		if head.endswith(":"):
-			head = "@" + head[:-1]
-		ret = head + tail
-		return ret
-	
-	@staticmethod
-	def __generate_timecode(file_path):
-		ret = datetime.datetime.fromtimestamp(os.path.getmtime(file_path)).strftime(File.__FORMAT_TIMECODE)
-		return ret
+		_STORES.inc()
+		self.__last_error = None
+		return True
 	
 	def __setup(self):
+		self.__last_error = None
 		self.__directory, name = path.rsplitpath(self.path)
 		self.__name, self.__extension = os.path.splitext(name)
-		self.__repository_directory = path.normalize_dir_expression(self.__repository_root) + File.__enrepository(self.directory)
+		self.__shard = self.__index.find_shard(self.path)
+		if self.__shard is None:
+			self.__shard = self.__shards.place(self.path)
+		self.__repository_directory = self.__layout.version_directory(self.__shards.root_of(self.__shard), self.path)
 		self.__setup_versions()
 	
 	def __setup_versions(self):
@@ -260,6 +478,8 @@ class File(QObject):
 				if os.path.isfile(repository_file_path):
 					self.__current_version = self.Version(key, repository_file_path)
 					self.__versions.append(self.__current_version)
+		
+		self.__index.register(self.path, self.__versions)
 
 
 class Work(QObject):
@@ -273,10 +493,33 @@ class Work(QObject):
 	def __str__(self):
 		return self.root
 	
+	activeChanged = Signal()
+	ignoreChanged = Signal()
 	nameChanged = Signal()
 	recursiveChanged = Signal()
+	repositoryChanged = Signal()
 	rootChanged = Signal()
 	
+	@property
+	def ignore_patterns(self):
+		return self.__common.ignore_rules.patterns
+	
+	@ignore_patterns.setter
+	def ignore_patterns(self, value):
+		if value == self.ignore_patterns:
+			return
+		
+		self.__common.ignore_rules = IgnoreRules(value)
+		self.ignoreChanged.emit()
+	
+	@property
+	def ignore_rules(self):
+		return self.__common.ignore_rules
+	
+	@property
+	def throttle(self):
+		return self.__throttle
+	
 	@property
 	def is_active(self):
 		return self.__observer is not None
@@ -349,6 +592,21 @@ class Work(QObject):
 	def on_moved_handler(self, value):
 		self.__common.on_moved_handler = value
 	
+	@property
+	def repository_root(self):
+		"""
+		own repository of the target, empty means the repository shared by every target
+		"""
+		return self.__repository_root
+	
+	@repository_root.setter
+	def repository_root(self, value):
+		if value == self.repository_root:
+			return
+		
+		self.__repository_root = value
+		self.repositoryChanged.emit()
+	
 	@property
 	def root(self):
 		return self.__root
@@ -364,10 +622,15 @@ class Work(QObject):
 				value = value[:-3]
 				self.__is_recursive = True
 			self.__root = Work.__normalize_root(value)
+			self.__common.root = self.__root
 			self.name = os.path.basename(path.rstrippath(self.__root))
 		
 		self.rootChanged.emit()
 	
+	@property
+	def storage(self):
+		return self.__storage
+	
 	def activate(self):
 		if self.is_active:
 			return
@@ -376,26 +639,46 @@ class Work(QObject):
 			return
 		
 		app = self.parent()
+		if app.is_passive:
+			# the engine worker process watches the target, so that only the state is kept here
+			self.__observer = self.__PassiveObserver()
+			self.activeChanged.emit()
+			return
+		
+		started = time.perf_counter()
+		rules = self.ignore_rules
 		if self.is_recursive:
 			for current_directory, directories, file_names in os.walk(self.root):
+				relative_directory = os.path.relpath(current_directory, self.root)
+				relative_directory = "" if relative_directory == os.curdir else path.normalize_dir_expression(relative_directory)
+				if rules:
+					# prune in place so that os.walk never descends into ignored directories
+					directories[:] = [directory for directory in directories if not rules.match(relative_directory + directory, True)]
 				for file_name in file_names:
+					if rules and rules.match(relative_directory + file_name):
+						continue
 					file_path = path.implode(current_directory, file_name)
 					file = app.inquiry(file_path)
 					if file.current_version is None:
-						file.store()
+						app.store_file(file, self.throttle)
 		else:
-			for file_name in os.listdir(self.root):
-				file_path = path.implode(self.root, file_name)
-				if os.path.isfile(file_path):
-					file = app.inquiry(file_path)
-					if file.current_version is None:
-						file.store()
+			with os.scandir(self.root) as entries:
+				for entry in entries:
+					if rules and rules.match(entry.name, entry.is_dir()):
+						continue
+					if entry.is_file():
+						file_path = path.implode(self.root, entry.name)
+						file = app.inquiry(file_path)
+						if file.current_version is None:
+							app.store_file(file, self.throttle)
+		_ACTIVATE_SECONDS.observe(time.perf_counter() - started)
 		
 		handler = self.__Handler(self)
 		
 		self.__observer = Observer()
 		self.__observer.schedule(handler, self.root, recursive=self.is_recursive)
 		self.__observer.start()
+		self.activeChanged.emit()
 	
 	def deactivate(self):
 		if not self.is_active:
@@ -404,6 +687,7 @@ class Work(QObject):
 		self.__observer.stop()
 		self.__observer.join()
 		self.__observer = None
+		self.activeChanged.emit()
 	
 	def deserialize(self, desc, data):
 		is_active = self.is_active
@@ -418,6 +702,17 @@ class Work(QObject):
 		if "is_recursive" in data:
 			self.__is_recursive = data["is_recursive"]
 		
+		if "ignore" in data:
+			self.ignore_patterns = data["ignore"]
+		
+		if "throttle" in data:
+			self.throttle.deserialize(data["throttle"])
+		
+		self.repository_root = data.get("repository", "")
+		
+		if "storage" in data:
+			self.storage.deserialize(data["storage"])
+		
 		if is_active:
 			self.activate()
 	
@@ -425,7 +720,12 @@ class Work(QObject):
 		ret = {
 			"is_active" :		self.is_active,
 			"is_recursive" :	self.is_recursive,
+			"ignore" :			self.ignore_patterns,
+			"throttle" :		self.throttle.serialize(),
+			"storage" :			self.storage.serialize(),
 		}
+		if self.repository_root:
+			ret["repository"] = self.repository_root
 		
 		return ret
 	
@@ -435,6 +735,8 @@ class Work(QObject):
 	
 	class __CommonData:
 		def __init__(self):
+			self.ignore_rules = IgnoreRules()
+			self.root = ""
 			self.on_created_handler = None
 			self.on_deleted_handler = None
 			self.on_modified_handler = None
@@ -444,6 +746,7 @@ class Work(QObject):
 		def __init__(self, parent, *args, **kwargs):
 			super().__init__(*args, **kwargs)
 			self.__common = parent._common
+			self.__is_recursive = parent.is_recursive
 		
 		def on_created(self, event):
 			if self.__common is None:
@@ -452,6 +755,8 @@ class Work(QObject):
 				return
 			if not isinstance(event, FileCreatedEvent):
 				return
+			if self.__is_ignored(event.src_path):
+				return
 			self.__common.on_created_handler(event)
 		
 		def on_deleted(self, event):
@@ -459,7 +764,9 @@ class Work(QObject):
 				return
 			if self.__common.on_deleted_handler is None:
 				return
-			if not isinstance(event, FileDeletedEvent):
+			if not isinstance(event, (FileDeletedEvent, DirDeletedEvent)):
+				return
+			if self.__is_ignored(event.src_path, event.is_directory):
 				return
 			self.__common.on_deleted_handler(event)
 		
@@ -470,6 +777,8 @@ class Work(QObject):
 				return
 			if not isinstance(event, FileModifiedEvent):
 				return
+			if self.__is_ignored(event.src_path):
+				return
 			self.__common.on_modified_handler(event)
 		
 		def on_moved(self, event):
@@ -477,9 +786,40 @@ class Work(QObject):
 				return
 			if self.__common.on_moved_handler is None:
 				return
-			if not isinstance(event, FileMovedEvent):
+			if not isinstance(event, (FileMovedEvent, DirMovedEvent)):
+				return
+			
+			# a move across the ignore rules is a creation or a deletion for the target
+			is_source_ignored = self.__is_ignored(event.src_path, event.is_directory)
+			is_destination_ignored = self.__is_ignored(event.dest_path, event.is_directory)
+			if is_source_ignored != is_destination_ignored and getattr(event, "is_synthetic", False):
+				# contents of a moved directory are created or deleted with the directory itself
+				return
+			if is_destination_ignored:
+				if not is_source_ignored:
+					self.on_deleted(DirDeletedEvent(event.src_path) if event.is_directory else FileDeletedEvent(event.src_path))
+				return
+			if is_source_ignored:
+				if event.is_directory:
+					self.__create_directory(event.dest_path)
+				else:
+					self.on_created(FileCreatedEvent(event.dest_path))
 				return
 			self.__common.on_moved_handler(event)
+		
+		def __create_directory(self, directory):
+			if not self.__is_recursive:
+				return
+			for current_directory, directories, file_names in os.walk(directory):
+				directories[:] = [name for name in directories if not self.__is_ignored(os.path.join(current_directory, name), True)]
+				for file_name in file_names:
+					self.on_created(FileCreatedEvent(os.path.join(current_directory, file_name)))
+		
+		def __is_ignored(self, file_path, is_directory=False):
+			rules = self.__common.ignore_rules
+			if not rules:
+				return False
+			return rules.match(os.path.relpath(file_path, self.__common.root), is_directory)
 	
 	class __KeepActivity:
 		def __init__(self, work):
@@ -496,6 +836,13 @@ class Work(QObject):
 				self.__work.activate()
 			return True
 	
+	class __PassiveObserver:
+		def join(self):
+			pass
+		
+		def stop(self):
+			pass
+	
 	@staticmethod
 	def __normalize_root(value):
 		ret = value
@@ -509,3 +856,6 @@ class Work(QObject):
 		self.__root = ""
 		self.__name = ""
 		self.__is_recursive = False
+		self.__throttle = transfer.Throttle(parent=getattr(self.parent(), "throttle", None))
+		self.__repository_root = ""
+		self.__storage = StoragePolicy(parent=getattr(self.parent(), "storage", None))